@@ -1,363 +1,860 @@
-import requests
-import pandas as pd
-import time
-import logging
-from concurrent.futures import ThreadPoolExecutor, wait
-import re
-import os
-import configparser
-import sys
-
-# ========== 日志配置 ==========
-# 日志文件名
-LOG_FILENAME = 'BangumiMigrate-Csv-Pro.log'
-
-# 创建日志处理器（既输出到文件又输出到控制台）
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('[%(asctime)s][%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-
-# 文件日志
-file_handler = logging.FileHandler(LOG_FILENAME, encoding='utf-8')
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# 控制台日志
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-# ========== 配置读取 ==========
-def load_config():
-    config = configparser.ConfigParser()
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
-
-    if not os.path.exists(config_path):
-        logging.error(f"配置文件不存在: {config_path}")
-        raise FileNotFoundError(f"配置文件不存在: {config_path}")
-
-    config.read(config_path, encoding='utf-8')
-    logging.info(f"配置文件已读取: {config_path}")
-    return config
-
-# ========== 状态映射 ==========
-def map_status_to_type(status):
-    # 根据状态映射到对应的 type，这里需要根据实际情况进行调整
-    if "想" in status:
-        return 1
-    elif "读过" in status or "看过" in status or "玩过" in status or "听过" in status:
-        return 2
-    elif "在读" in status or "在看" in status or "在玩" in status or "在听" in status:
-        return 3
-    elif "搁置" in status:
-        return 4
-    elif "抛弃" in status:
-        return 5
-    else:
-        return 0  # 未知状态
-
-# ========== 网络请求通用 ==========
-def make_request(session, url, method='GET', data=None, access_token=None):
-    base_headers = {
-        'accept': '*/*',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Adachi/BangumiMigrate(https://github.com/Adachi-Git/BangumiMigrate)',
-        'Authorization': f'Bearer {access_token}'
-    }
-
-    try:
-        logging.info(f"准备发起 {method} 请求: {url}")
-        if data:
-            logging.debug(f"请求数据: {data}")
-        response = session.request(method, url, headers=base_headers, json=data)
-        response.raise_for_status()  # 检查请求是否成功
-
-        # 记录日志
-        logging.info(f"{method} 请求到 {url} - 状态码: {response.status_code}")
-        logging.debug("请求头部: %s", base_headers)
-        return response
-
-    except requests.exceptions.RequestException as e:
-        # 处理请求失败的情况，例如重试等
-        logging.error(f"{method} 请求 {url} 失败: {e}")
-        return None
-
-# ========== 获取条目信息 ==========
-def get_subject_info(session, subject_id, access_token):
-    """获取条目信息，包括总集数"""
-    try:
-        subject_url = f'https://api.bgm.tv/v0/subjects/{subject_id}'
-        response = make_request(session, subject_url, method='GET', access_token=access_token)
-
-        if response:
-            subject_data = response.json()
-            logging.debug(f"条目 {subject_id} 响应内容: {subject_data}")
-            # 如果存在total_episodes字段且不为空，返回总集数
-            if 'total_episodes' in subject_data and subject_data['total_episodes'] is not None and subject_data['total_episodes'] > 0:
-                return subject_data['total_episodes']
-
-        # 如果无法获取或没有总集数信息，返回0
-        return 0
-
-    except Exception as e:
-        logging.error(f"获取条目 {subject_id} 信息时出错: {e}")
-        return 0
-
-# ========== 标记单集已看 ==========
-def mark_episode_watched(session, episode_id, access_token):
-    """标记单个剧集为看过"""
-    try:
-        # 构建正确的 URL，对单集进行标记
-        ep_url = f'https://api.bgm.tv/ep/{episode_id}/status/watched'
-
-        # 发送请求标记剧集为看过
-        response = make_request(session, ep_url, method='POST', access_token=access_token)
-
-        if response:
-            logging.info(f"剧集 {episode_id} 已成功标记为看过")
-            return True
-        else:
-            logging.error(f"标记剧集 {episode_id} 失败")
-            return False
-
-    except Exception as e:
-        logging.error(f"标记剧集 {episode_id} 时出错: {e}")
-        return False
-
-# ========== 设置条目进度 ==========
-def update_progress(session, subject_id, eps_num, access_token, status_type, auto_complete=False):
-    """设置条目的观看进度"""
-    try:
-        # 增加等待时间，确保收藏操作已完成
-        time.sleep(3)
-
-        logging.info(f"更新条目 {subject_id} 进度为第 {eps_num} 集，auto_complete={auto_complete}")
-
-        # 直接使用 progress API 更新进度
-        progress_url = f'https://api.bgm.tv/subject/{subject_id}/update/watched_eps'
-
-        # 这里使用表单数据而不是 JSON
-        form_data = {'watched_eps': eps_num}
-
-        # 调整 make_request 函数来发送表单数据
-        headers = {
-            'accept': '*/*',
-            'User-Agent': 'wan0ge/Trakt-to-Bangumi(https://github.com/wan0ge/Trakt-to-Bangumi)',
-            'Authorization': f'Bearer {access_token}'
-        }
-
-        try:
-            # 使用表单数据发送请求
-            response = session.post(progress_url, headers=headers, data=form_data)
-            response.raise_for_status()
-
-            logging.info(f"POST 请求 {progress_url} - 状态码: {response.status_code}")
-
-            if response.status_code in [200, 201, 202, 204]:
-                logging.info(f"条目 {subject_id} 已成功更新进度为看到第 {eps_num} 集")
-                return True
-            else:
-                logging.error(f"更新条目 {subject_id} 进度失败，状态码: {response.status_code}")
-                return False
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"POST 请求 {progress_url} 失败: {e}")
-            return False
-
-    except Exception as e:
-        logging.error(f"更新条目 {subject_id} 的进度失败: {e}")
-        return False
-
-# ========== 处理单条数据 ==========
-def process_row(row, api_url, wait_time, access_token, auto_complete=False):
-    # 获取 'ID'、'状态'、'评分'、'我的简评'、'私密' 和 '标签' 列的值
-    collection_id = row.ID
-    status = row.状态
-    rate = row.我的评价 if hasattr(row, '我的评价') else None
-    comment = row.我的简评 if hasattr(row, '我的简评') else None
-    private = row.私密 if hasattr(row, '私密') else None
-    tags = row.标签.split() if (hasattr(row, '标签') and not pd.isna(row.标签)) else []
-
-    # 获取进度信息
-    watched_eps = 0
-    total_eps = 0
-
-    if hasattr(row, '看到') and not pd.isna(row.看到):
-        try:
-            watched_eps = int(row.看到)
-        except (ValueError, TypeError):
-            watched_eps = 0
-
-    if hasattr(row, '话数') and not pd.isna(row.话数):
-        try:
-            total_eps = int(row.话数)
-        except (ValueError, TypeError):
-            # 处理非数字或特殊格式的情况
-            total_eps = 0
-
-    # 根据状态映射到对应的 type
-    type_value = map_status_to_type(status)
-
-    # 动态生成请求的 URL
-    url = f'{api_url}{collection_id}'
-
-    # 处理评论部分，去除不可见字符
-    if comment is not None and isinstance(comment, str):
-        comment = re.sub(r'[\x00-\x1F\x7F-\x9F\u200B-\u200F\u2028-\u202F\u2060-\u206F]', '', comment)
-
-    # 准备请求体数据
-    data = {
-        "type": type_value,
-        "rate": int(float(rate)) if (rate is not None and not pd.isna(rate) and rate != '') else 0,
-        "comment": str(comment).strip() if (comment is not None and not pd.isna(comment)) else "",
-        "private": bool(private) if (private is not None and not pd.isna(private)) else False,
-        "tags": [tag.strip() for tag in tags] if tags else []
-    }
-    logging.info(f"开始处理条目ID: {collection_id}, 状态: {status}, 数据: {data}")
-
-    # 发送收藏请求
-    with requests.Session() as session:
-        collection_response = make_request(session, url, method='POST', data=data, access_token=access_token)
-
-        # 处理进度
-        if collection_response:
-            eps_to_mark = 0
-
-            # 修复: 根据auto_complete和type_value状态确定正确的标记策略
-            # 如果是已完成状态("看过"等)且设置了自动标满进度
-            if type_value == 2 and auto_complete:
-                # 优先使用CSV中的总集数
-                if total_eps > 0:
-                    eps_to_mark = total_eps
-                else:
-                    # 如果CSV中没有总集数，则从API获取条目信息
-                    api_total_eps = get_subject_info(session, collection_id, access_token)
-                    if api_total_eps > 0:
-                        eps_to_mark = api_total_eps
-                        logging.info(f"条目 {collection_id} 从API获取总集数: {api_total_eps}")
-                    elif watched_eps > 0:  # 如果API也获取不到，但有看到的集数，则使用看到的集数
-                        eps_to_mark = watched_eps
-                    else:
-                        logging.warning(f"条目 {collection_id} 无法获取总集数，也没有'看到'数据，不更新进度")
-            # 否则使用用户提供的观看进度
-            elif watched_eps > 0:
-                eps_to_mark = watched_eps
-
-            # 只有当有明确的进度需要设置时才更新进度
-            if eps_to_mark > 0:
-                # 等待一段时间再更新进度
-                time.sleep(2)
-                # 更新进度
-                update_progress(session, collection_id, eps_to_mark, access_token, type_value, auto_complete)
-            else:
-                logging.info(f"条目 {collection_id} 无需更新进度")
-        else:
-            logging.error(f"条目 {collection_id} 收藏请求失败")
-
-    # 等待一定时间
-    logging.debug(f"条目 {collection_id} 处理后等待 {wait_time} 秒")
-    time.sleep(wait_time)
-
-# ========== 主程序 ==========
-def main():
-    try:
-        # 读取配置
-        config = load_config()
-
-        # 检查BangumiMigrate部分是否存在
-        if 'BangumiMigrate' not in config:
-            logging.error("配置文件中缺少[BangumiMigrate]部分")
-            return
-
-        # 获取配置项
-        bangumi_access_token = config.get('BangumiMigrate', 'access_token')
-        bangumi_input_csv = config.get('BangumiMigrate', 'input_csv')
-        wait_time = config.getint('BangumiMigrate', 'wait_time', fallback=5)
-        # 新增自动标满进度的配置项
-        auto_complete = config.getboolean('BangumiMigrate', 'auto_complete', fallback=False)
-
-        # API URL常量
-        API_URL = 'https://api.bgm.tv/v0/users/-/collections/'
-
-        # 检查配置
-        if bangumi_access_token == '请输入你的Bangumi访问令牌':
-            logging.error("请在config.ini的[BangumiMigrate]部分设置你的Bangumi访问令牌")
-            return
-
-        if bangumi_input_csv == '请输入你的Bangumi导入文件名.csv':
-            logging.error("请在config.ini的[BangumiMigrate]部分设置你的Bangumi导入文件名")
-            return
-
-        # 构建CSV文件路径（当前目录下）
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), bangumi_input_csv)
-
-        if not os.path.exists(csv_path):
-            logging.error(f"CSV文件不存在: {csv_path}")
-            return
-
-        # 读取CSV文件
-        logging.info(f"开始读取CSV文件: {csv_path}")
-        df = pd.read_csv(csv_path)
-        logging.info(f"成功读取CSV文件，共{len(df)}条记录")
-
-        # 检查必要的列是否存在
-        required_columns = ['ID', '状态']
-        for col in required_columns:
-            if col not in df.columns:
-                logging.error(f"CSV文件缺少必要的列: {col}")
-                return
-
-        # 记录进度配置
-        if auto_complete:
-            logging.info("已启用自动标满进度功能，所有'看过'状态的条目将被标记为看完")
-        else:
-            logging.info("未启用自动标满进度功能，将根据'看到'列的值更新进度")
-
-        # 使用线程池进行并发处理
-        with ThreadPoolExecutor() as executor:
-            futures = []
-
-            # 提交每一行数据的处理任务到线程池
-            for row in df.itertuples(index=False):
-                future = executor.submit(process_row, row, API_URL, wait_time, bangumi_access_token, auto_complete)
-                futures.append(future)
-
-            # 等待所有任务完成
-            wait(futures)
-
-        logging.info("所有数据处理完成")
-
-    except Exception as e:
-        logging.error(f"程序执行错误: {e}")
-
-if __name__ == "__main__":
-    print("欢迎使用 Bangumi Csv数据导入工具Pro v2.8")
-    print("https://github.com/Adachi-Git/Bangumi2Bangumi")
-    print("https://github.com/wan0ge/Trakt-to-Bangumi")
-    print("-" * 60)
-    print("本工具可以将把 Trakt To Bangumi 项目转换的Bangumi Csv文件一键导入Bangumi")
-    print()
-    config = load_config()   # 这里要加这一行先读取一下配置
-    print()
-    print("请确保已在 config.ini 文件中设置了正确的 导入文件名 ")
-    print(f"当前导入文件名为: {config['BangumiMigrate']['input_csv']} 请确认当前目录有该文件")
-    print()
-    print(f"当前标记全部集数为看过状态为: {config['BangumiMigrate']['auto_complete']}")
-    print(f"为true时将最后一集标记 看到 实现全部标记看过")
-    print(f"为false时使用csv文件中的 看到 数值标记")
-    print()
-    print("-" * 60)
-    confirm = input("确定要继续吗？输入 y 并回车继续，其他键退出：")
-    if confirm.lower() != 'y':
-        print("用户取消，程序退出。")
-        logging.info('========== 脚本结束 ==========')
-        exit(0)
-    try:
-        main()
-    except Exception as e:
-        logging.error(f"程序执行过程中发生未捕获的异常: {e}")
-    finally:
-        # 添加这行代码使窗口不会在程序执行完毕后立即关闭
+import requests
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import re
+import os
+import configparser
+import sys
+import csv
+import json
+from collections import Counter
+
+import profiling
+
+# ========== 日志配置 ==========
+# 日志文件名
+LOG_FILENAME = 'BangumiMigrate-Csv-Pro.log'
+
+# 导入脚本使用自己的具名日志器，被 Trakt-to-Bangumi.py --import 或 sync_daemon.py 加载时
+# 不会改动调用方的根日志器，其他脚本的日志也不会写入本脚本的日志文件和控制台
+logger = logging.getLogger("BangumiMigrate")
+formatter = logging.Formatter('[%(asctime)s][%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def setup_logging():
+    """添加日志处理器（既输出到文件又输出到控制台），作为脚本运行或被加载后需要显示导入进度时调用一次"""
+    if logger.handlers:
+        return
+    logger.setLevel(logging.DEBUG)
+    # 文件日志
+    file_handler = logging.FileHandler(LOG_FILENAME, encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    # 控制台日志
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+    # 已有自己的处理器，不再传给调用方的根日志器，避免重复记录
+    logger.propagate = False
+
+# ========== 配置读取 ==========
+def load_config():
+    config = configparser.ConfigParser()
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+
+    if not os.path.exists(config_path):
+        logger.error(f"配置文件不存在: {config_path}")
+        raise FileNotFoundError(f"配置文件不存在: {config_path}")
+
+    config.read(config_path, encoding='utf-8')
+    logger.info(f"配置文件已读取: {config_path}")
+    return config
+
+# ========== 状态映射 ==========
+def map_status_to_type(status):
+    # 根据状态映射到对应的 type，这里需要根据实际情况进行调整
+    if "想" in status:
+        return 1
+    elif "读过" in status or "看过" in status or "玩过" in status or "听过" in status:
+        return 2
+    elif "在读" in status or "在看" in status or "在玩" in status or "在听" in status:
+        return 3
+    elif "搁置" in status:
+        return 4
+    elif "抛弃" in status:
+        return 5
+    else:
+        return 0  # 未知状态
+
+# ========== 导入统计 ==========
+# 延迟直方图的分桶上界（毫秒），最后一个桶收集超过最大上界的请求
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，分位数取所在桶的上界"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.min_ms = ms if self.min_ms is None else min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else round(self.max_ms)
+        return round(self.max_ms)
+
+    def summary(self):
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "min_ms": round(self.min_ms or 0, 1),
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+class ImportMetrics:
+    """
+    统计各类请求的延迟、状态码分布、重试次数、行吞吐量和排队深度。
+    运行中定期输出到控制台，结束时生成 JSON 汇总，用于根据实测结果调整 wait_time 和 max_workers。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.latency = {}              # 请求类型 -> LatencyHistogram
+            self.status_codes = Counter()  # 状态码 -> 次数（网络错误记为 "error"）
+            self.retries = Counter()       # 步骤 -> 重试次数
+            self.rows = Counter()          # 完成/失败/跳过 -> 行数
+            self.queue_depth = 0
+            self.in_flight = 0
+            self.max_queue_depth = 0
+
+    def observe_request(self, kind, status_code, seconds):
+        with self.lock:
+            self.latency.setdefault(kind, LatencyHistogram()).observe(seconds * 1000)
+            self.status_codes[str(status_code) if status_code is not None else 'error'] += 1
+
+    def observe_retry(self, step_name):
+        with self.lock:
+            self.retries[step_name] += 1
+
+    def observe_row(self, result):
+        with self.lock:
+            self.rows[result] += 1
+
+    def observe_queue(self, queue_depth, in_flight):
+        with self.lock:
+            self.queue_depth = queue_depth
+            self.in_flight = in_flight
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            finished = self.rows['完成'] + self.rows['失败']
+            throttled = self.status_codes.get('429', 0)
+            server_errors = sum(n for code, n in self.status_codes.items() if code.isdigit() and int(code) >= 500)
+            return {
+                "elapsed_seconds": round(elapsed, 1),
+                "rows": dict(self.rows),
+                "rows_per_second": round(finished / elapsed, 3) if elapsed > 0 else 0,
+                "requests": sum(self.status_codes.values()),
+                "status_codes": dict(self.status_codes),
+                "throttled_429": throttled,
+                "server_errors_5xx": server_errors,
+                "retries": dict(self.retries),
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "latency": {kind: hist.summary() for kind, hist in self.latency.items()},
+            }
+
+    def report(self):
+        """输出一行简要统计到控制台和日志"""
+        data = self.summary()
+        latency = ", ".join(f"{kind} p50={h['p50_ms']}ms p95={h['p95_ms']}ms" for kind, h in data['latency'].items())
+        logger.info(
+            f"[统计] 已完成 {data['rows'].get('完成', 0)} 行, 失败 {data['rows'].get('失败', 0)} 行, "
+            f"{data['rows_per_second']} 行/秒 | 排队 {data['queue_depth']}, 执行中 {data['in_flight']} | "
+            f"状态码 {data['status_codes']} | 429: {data['throttled_429']}, 5xx: {data['server_errors_5xx']} | "
+            f"重试 {sum(data['retries'].values())} | {latency}"
+        )
+
+    def start_reporter(self, interval):
+        """启动后台线程，每 interval 秒输出一次统计，返回用于停止的 Event"""
+        stop = threading.Event()
+        if interval > 0:
+            def loop():
+                while not stop.wait(interval):
+                    self.report()
+            threading.Thread(target=loop, name='ImportMetrics', daemon=True).start()
+        return stop
+
+# 全局统计对象
+METRICS = ImportMetrics()
+
+# ========== 网络请求通用 ==========
+def send_request(session, url, method='GET', data=None, access_token=None, kind=None):
+    """发起请求，返回 (响应, 状态码)；失败时响应为 None，网络错误时状态码为 None"""
+    base_headers = {
+        'accept': '*/*',
+        'Content-Type': 'application/json',
+        'User-Agent': 'Adachi/BangumiMigrate(https://github.com/Adachi-Git/BangumiMigrate)',
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    try:
+        logger.info(f"准备发起 {method} 请求: {url}")
+        if data:
+            logger.debug(f"请求数据: {data}")
+        # 记录请求延迟和状态码
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, headers=base_headers, json=data)
+        except requests.exceptions.RequestException:
+            METRICS.observe_request(kind or method, None, time.monotonic() - started)
+            raise
+        METRICS.observe_request(kind or method, response.status_code, time.monotonic() - started)
+        response.raise_for_status()  # 检查请求是否成功
+
+        # 记录日志
+        logger.info(f"{method} 请求到 {url} - 状态码: {response.status_code}")
+        logger.debug("请求头部: %s", base_headers)
+        return response, response.status_code
+
+    except requests.exceptions.RequestException as e:
+        # 返回状态码，由调用方决定是否重试
+        logger.error(f"{method} 请求 {url} 失败: {e}")
+        status_code = e.response.status_code if getattr(e, 'response', None) is not None else None
+        return None, status_code
+
+def is_retryable(status_code):
+    """网络错误、限流(429)和服务器错误(5xx)视为临时失败，可以重试"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+# Bangumi API 地址
+BANGUMI_API_BASE = 'https://api.bgm.tv/v0'
+
+# ========== 获取条目剧集列表 ==========
+# 条目ID -> 按顺序排列的本篇剧集ID列表，每次导入中每个条目只请求一次
+_episode_cache = {}
+_episode_cache_lock = threading.Lock()
+
+def clear_episode_cache():
+    """每次导入开始时清空，sync_daemon.py 持续运行时之后新播出的剧集也能标记"""
+    with _episode_cache_lock:
+        _episode_cache.clear()
+
+# 每页请求的剧集数
+EPISODE_PAGE_SIZE = 100
+
+def get_cached_episodes(subject_id):
+    """返回本次导入已缓存的条目本篇剧集ID列表，没有缓存时返回 None"""
+    with _episode_cache_lock:
+        return _episode_cache.get(str(subject_id))
+
+def cache_episodes(subject_id, episodes):
+    """把获取到的全部剧集按集数排序后缓存，返回剧集ID列表"""
+    episodes = sorted(episodes, key=lambda ep: ep.get('sort', 0))
+    episode_ids = [ep['id'] for ep in episodes if ep.get('id')]
+    logger.debug(f"条目 {subject_id} 共有 {len(episode_ids)} 个本篇剧集")
+    with _episode_cache_lock:
+        _episode_cache[str(subject_id)] = episode_ids
+    return episode_ids
+
+def get_episode_page(session, subject_id, offset, access_token):
+    """
+    获取条目从 offset 开始的一页本篇剧集，返回 (剧集列表, 剧集总数, 状态码)，失败时剧集列表为 None。
+    每页由调度器单独安排一步，和其他请求一样受请求间隔限制
+    """
+    episodes_url = f'{BANGUMI_API_BASE}/episodes?subject_id={subject_id}&type=0&limit={EPISODE_PAGE_SIZE}&offset={offset}'
+    response, status_code = send_request(session, episodes_url, method='GET', access_token=access_token, kind='episodes')
+    if not response:
+        return None, 0, status_code
+    try:
+        page = response.json()
+    except ValueError as e:
+        logger.error(f"解析条目 {subject_id} 剧集列表失败: {e}")
+        return None, 0, status_code
+    return page.get('data') or [], page.get('total', 0), status_code
+
+# ========== 设置条目进度 ==========
+def update_progress(session, subject_id, episode_ids, access_token):
+    """通过 v0 剧集收藏接口一次性把多集标记为看过，返回 (是否成功, 状态码)"""
+    logger.info(f"更新条目 {subject_id} 进度，标记前 {len(episode_ids)} 集为看过")
+    progress_url = f'{BANGUMI_API_BASE}/users/-/collections/{subject_id}/episodes'
+    data = {"episode_id": episode_ids, "type": 2}
+    response, status_code = send_request(session, progress_url, method='PATCH', data=data, access_token=access_token, kind='progress')
+    if response:
+        logger.info(f"条目 {subject_id} 已成功更新进度为看到第 {len(episode_ids)} 集")
+        return True, status_code
+    logger.error(f"更新条目 {subject_id} 进度失败，状态码: {status_code}")
+    return False, status_code
+
+# ========== 解析单条数据 ==========
+def get_cell(row, key):
+    """读取CSV单元格，缺失或为空时返回 None"""
+    value = row.get(key)
+    if value is None:
+        return None
+    value = value.strip()
+    return value if value else None
+
+def parse_int(value):
+    """解析集数等整数，兼容 "12.0" 这类写法，无法解析时返回 0"""
+    if value is None:
+        return 0
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        # 处理非数字或特殊格式的情况
+        return 0
+
+def parse_row(row):
+    """从CSV行中解析条目ID、状态、收藏请求体以及进度信息"""
+    # 获取 'ID'、'状态'、'评分'、'我的简评'、'私密' 和 '标签' 列的值
+    collection_id = get_cell(row, 'ID')
+    status = get_cell(row, '状态') or ''
+    rate = get_cell(row, '我的评价')
+    comment = get_cell(row, '我的简评')
+    private = get_cell(row, '私密')
+    tags = (get_cell(row, '标签') or '').split()
+
+    if not collection_id:
+        raise ValueError("缺少条目ID")
+
+    # 获取进度信息
+    watched_eps = parse_int(get_cell(row, '看到'))
+    total_eps = parse_int(get_cell(row, '话数'))
+
+    # 根据状态映射到对应的 type
+    type_value = map_status_to_type(status)
+
+    # 处理评论部分，去除不可见字符
+    if comment is not None:
+        comment = re.sub(r'[\x00-\x1F\x7F-\x9F\u200B-\u200F\u2028-\u202F\u2060-\u206F]', '', comment)
+
+    # 准备请求体数据
+    data = {
+        "type": type_value,
+        "rate": parse_int(rate),
+        "comment": comment.strip() if comment is not None else "",
+        "private": private is not None and private.lower() in ('1', '1.0', 'true', 'yes', '是'),
+        "tags": [tag.strip() for tag in tags] if tags else []
+    }
+    return collection_id, status, type_value, data, watched_eps, total_eps
+
+# ========== 线程内复用会话 ==========
+_thread_local = threading.local()
+
+def get_session():
+    """每个工作线程复用同一个 Session，保持连接复用"""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.session = session
+    return session
+
+# ========== 速率限制 ==========
+class RateLimiter:
+    """全局请求速率限制：任意两次请求的发起间隔不小于 interval 秒（只由调度线程调用）"""
+
+    def __init__(self, interval):
+        self.interval = max(0.0, float(interval))
+        self.next_slot = 0.0
+
+    def ready_at(self):
+        """返回下一次允许发起请求的时间点"""
+        return self.next_slot
+
+    def consume(self, now):
+        """占用一个请求名额"""
+        self.next_slot = max(now, self.next_slot) + self.interval
+
+# ========== 导入调度器 ==========
+class ImportScheduler:
+    """
+    按最早开始时间调度导入步骤：步骤放入小顶堆，到期且速率限制允许时才交给线程池执行。
+    所有等待都由调度线程在条件变量上完成，工作线程只负责发请求，不会因 sleep 被占用。
+    每个条目同一时间只有一个步骤在排队或执行，排队步骤数超过 max_pending 时 submit 会阻塞，
+    读取CSV的一方因此按导入速度逐行读取，而不是一次性把整个文件变成待办任务。
+    """
+
+    def __init__(self, max_workers, rate_limiter, max_pending=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max_pending or self.max_workers * 8
+        self.rate_limiter = rate_limiter
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.thread = threading.Thread(target=self._dispatch, name='ImportScheduler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, task):
+        """提交一个新条目，返回 task.start 的结果；排队的步骤过多时阻塞等待"""
+        with self.cond:
+            while len(self.heap) + self.in_flight >= self.max_pending:
+                self.cond.wait()
+        return task.start(self)
+
+    def schedule(self, step, delay=0.0):
+        """安排步骤在 delay 秒后执行，step 为接收调度器参数的可调用对象"""
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), step))
+            self.cond.notify_all()
+
+    def close(self):
+        """声明不再提交新条目，已安排的步骤全部完成后调度线程退出"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def join(self):
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def _dispatch(self):
+        with self.cond:
+            while True:
+                if not self.heap:
+                    if self.closed and self.in_flight == 0:
+                        break
+                    self.cond.wait()
+                    continue
+                if self.in_flight >= self.max_workers:
+                    self.cond.wait()
+                    continue
+                now = time.monotonic()
+                start_at = max(self.heap[0][0], self.rate_limiter.ready_at())
+                if start_at > now:
+                    self.cond.wait(start_at - now)
+                    continue
+                _, _, step = heapq.heappop(self.heap)
+                self.rate_limiter.consume(now)
+                self.in_flight += 1
+                METRICS.observe_queue(len(self.heap), self.in_flight)
+                self.executor.submit(self._run_step, step)
+
+    def _run_step(self, step):
+        try:
+            step(self)
+        except Exception as e:
+            logger.error(f"执行导入步骤时出错: {e}")
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                METRICS.observe_queue(len(self.heap), self.in_flight)
+                self.cond.notify_all()
+
+# ========== 导入日志（断点续传） ==========
+JOURNAL_HEADER = ["ID", "步骤", "状态码", "尝试次数", "结果", "时间", "标记集数", "收藏状态"]
+
+class ImportJournal:
+    """
+    逐条记录每个条目每一步的执行结果，边导入边写入磁盘。
+    重新运行时据此跳过已完成的条目，并从未完成的步骤继续。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = {}  # 条目ID -> 已成功完成的步骤集合
+        self.marked = {}  # 条目ID -> 进度步骤标记的集数（旧导入日志没有这一列）
+        self.statuses = {}  # 条目ID -> 最近一次收藏成功时的状态（旧导入日志没有这一列）
+        self._load()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if is_new:
+            self.writer.writerow(JOURNAL_HEADER)
+            self.file.flush()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # 跳过表头
+            for row in reader:
+                if len(row) >= 5 and row[4] == '成功':
+                    self.completed.setdefault(row[0], set()).add(row[1])
+                    if row[1] == 'progress' and len(row) >= 7 and row[6].isdigit():
+                        self.marked[row[0]] = int(row[6])
+                    if row[1] == 'collect' and len(row) >= 8 and row[7]:
+                        self.statuses[row[0]] = row[7]
+        logger.info(f"从导入日志 {self.path} 读取到 {len(self.completed)} 个条目的记录")
+
+    def completed_steps(self, subject_id):
+        return self.completed.get(str(subject_id), set())
+
+    def marked_episodes(self, subject_id):
+        """已标记的集数：没有进度步骤时为0，旧导入日志中的进度步骤没有记录集数时为 None"""
+        subject_id = str(subject_id)
+        if subject_id in self.marked:
+            return self.marked[subject_id]
+        return None if 'progress' in self.completed_steps(subject_id) else 0
+
+    def collected_status(self, subject_id):
+        """最近一次收藏成功时的状态，没有收藏记录或旧导入日志没有记录状态时为 None"""
+        return self.statuses.get(str(subject_id))
+
+    def record(self, subject_id, step, status_code, attempt, result, marked='', status=''):
+        """写入一条记录并立即落盘，保证中断后不丢失"""
+        with self.lock:
+            self.writer.writerow([subject_id, step, status_code if status_code is not None else '', attempt, result,
+                                  time.strftime('%Y-%m-%d %H:%M:%S'), marked, status])
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if result == '成功':
+                self.completed.setdefault(str(subject_id), set()).add(step)
+                if marked != '':
+                    self.marked[str(subject_id)] = marked
+                if status:
+                    self.statuses[str(subject_id)] = status
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# ========== 单条目导入任务 ==========
+# 收藏成功后到更新进度之间的间隔（秒），确保收藏操作已完成
+PROGRESS_DELAY = 5
+# 失败重试的基础退避时间（秒），第 n 次重试等待 RETRY_BASE_DELAY * 2^(n-1)
+RETRY_BASE_DELAY = 5
+
+class ImportTask:
+    """
+    单个条目的导入流程：收藏 → 获取剧集列表 → 更新进度，每一步都由调度器单独安排。
+    收藏和进度都是按目标值写入，重复执行结果相同，因此失败的步骤可以安全地重试。
+    """
+
+    def __init__(self, row, api_url, access_token, journal, auto_complete=False, max_retries=3):
+        (self.collection_id, self.status, self.type_value, self.data,
+         self.watched_eps, self.total_eps) = parse_row(row)
+        self.api_url = api_url
+        self.access_token = access_token
+        self.journal = journal
+        self.auto_complete = auto_complete
+        self.max_retries = max_retries
+        self.attempts = {}
+        self.eps_to_mark = 0
+        self.episode_ids = []
+        self.fetched_episodes = []
+
+    def start(self, scheduler):
+        """根据导入日志决定从哪一步开始，返回 False 表示该条目已全部完成"""
+        steps = self.journal.completed_steps(self.collection_id)
+        if 'done' in steps:
+            if self.status_changed():
+                # 状态变化（比如在看 → 看过）：重新收藏，之后按新状态重新获取剧集并设置进度
+                logger.info(f"条目 {self.collection_id} 的状态从 {self.journal.collected_status(self.collection_id)} 变为 {self.status}，重新收藏")
+                scheduler.schedule(self.collect)
+                return True
+            if not self.progress_increased():
+                return False
+            # 已导入的条目看到的集数增加（持续同步中继续观看）：已经收藏，只重新执行进度步骤
+            logger.info(f"条目 {self.collection_id} 看到的集数增加到 {self.watched_eps}，只更新进度")
+            scheduler.schedule(self.episodes)
+            return True
+        if 'collect' in steps:
+            logger.info(f"条目 {self.collection_id} 已收藏，从进度步骤继续")
+            scheduler.schedule(self.after_collect)
+        else:
+            scheduler.schedule(self.collect)
+        return True
+
+    def status_changed(self):
+        """状态是否与导入日志中最近一次收藏时的状态不同；旧导入日志没有记录状态时视为未变化"""
+        collected = self.journal.collected_status(self.collection_id)
+        return collected is not None and collected != self.status
+
+    def progress_increased(self):
+        """看到的集数是否超过导入日志中已标记的集数；自动标满进度的"看过"条目已标记全部剧集"""
+        if self.type_value == 2 and self.auto_complete or self.watched_eps <= 0:
+            return False
+        marked = self.journal.marked_episodes(self.collection_id)
+        return marked is not None and self.watched_eps > marked
+
+    def collect(self, scheduler):
+        """发送收藏请求，成功后安排后续步骤"""
+        attempt = self._next_attempt('collect')
+        logger.info(f"开始处理条目ID: {self.collection_id}, 状态: {self.status}, 数据: {self.data}, 第 {attempt} 次尝试")
+        url = f'{self.api_url}{self.collection_id}'
+        collection_response, status_code = send_request(get_session(), url, method='POST', data=self.data, access_token=self.access_token, kind='collect')
+        if not collection_response:
+            logger.error(f"条目 {self.collection_id} 收藏请求失败")
+            self._retry_or_fail(scheduler, 'collect', self.collect, status_code)
+            return
+
+        self.journal.record(self.collection_id, 'collect', status_code, attempt, '成功', status=self.status)
+        self.after_collect(scheduler)
+
+    def after_collect(self, scheduler):
+        """收藏完成后，只有确实需要设置进度时才去获取剧集列表"""
+        needs_full = self.type_value == 2 and self.auto_complete
+        if needs_full or self.watched_eps > 0:
+            scheduler.schedule(self.episodes)
+        else:
+            logger.info(f"条目 {self.collection_id} 无需更新进度")
+            self._finish()
+
+    def episodes(self, scheduler):
+        """获取剧集列表（同一条目只请求一次），确定需要标记的集数"""
+        self._next_attempt('episodes')
+        self.episode_page(scheduler)
+
+    def episode_page(self, scheduler):
+        """获取一页剧集，还有下一页时单独安排下一步，失败重试时从失败的那一页继续"""
+        episode_ids = get_cached_episodes(self.collection_id)
+        if episode_ids is None:
+            page, total, status_code = get_episode_page(get_session(), self.collection_id, len(self.fetched_episodes), self.access_token)
+            if page is None:
+                self._retry_or_fail(scheduler, 'episodes', self.episodes, status_code)
+                return
+            self.fetched_episodes.extend(page)
+            if page and len(self.fetched_episodes) < total:
+                scheduler.schedule(self.episode_page)
+                return
+            episode_ids = cache_episodes(self.collection_id, self.fetched_episodes)
+
+        # 修复: 根据auto_complete和type_value状态确定正确的标记策略
+        # 如果是已完成状态("看过"等)且设置了自动标满进度
+        if self.type_value == 2 and self.auto_complete:
+            # 优先使用CSV中的总集数，否则使用剧集列表的长度
+            if self.total_eps > 0:
+                self.eps_to_mark = self.total_eps
+            elif episode_ids:
+                self.eps_to_mark = len(episode_ids)
+                logger.info(f"条目 {self.collection_id} 从API获取总集数: {len(episode_ids)}")
+            elif self.watched_eps > 0:  # 如果API也获取不到，但有看到的集数，则使用看到的集数
+                self.eps_to_mark = self.watched_eps
+            else:
+                logger.warning(f"条目 {self.collection_id} 无法获取总集数，也没有'看到'数据，不更新进度")
+        # 否则使用用户提供的观看进度
+        elif self.watched_eps > 0:
+            self.eps_to_mark = self.watched_eps
+
+        self.episode_ids = episode_ids[:self.eps_to_mark]
+        if self.eps_to_mark > 0 and not self.episode_ids:
+            logger.warning(f"条目 {self.collection_id} 没有可标记的本篇剧集")
+        # 只有当有明确的进度需要设置时才更新进度，延后执行而不是占用线程等待
+        if self.episode_ids:
+            scheduler.schedule(self.progress, PROGRESS_DELAY)
+        else:
+            logger.info(f"条目 {self.collection_id} 无需更新进度")
+            self._finish()
+
+    def progress(self, scheduler):
+        """一次请求标记所有需要的剧集"""
+        attempt = self._next_attempt('progress')
+        success, status_code = update_progress(get_session(), self.collection_id, self.episode_ids, self.access_token)
+        if not success:
+            self._retry_or_fail(scheduler, 'progress', self.progress, status_code)
+            return
+
+        self.journal.record(self.collection_id, 'progress', status_code, attempt, '成功', self.eps_to_mark)
+        self._finish()
+
+    def _finish(self):
+        self.journal.record(self.collection_id, 'done', '', sum(self.attempts.values()), '成功')
+        METRICS.observe_row('完成')
+
+    def _next_attempt(self, step_name):
+        self.attempts[step_name] = self.attempts.get(step_name, 0) + 1
+        return self.attempts[step_name]
+
+    def _retry_or_fail(self, scheduler, step_name, step, status_code):
+        """临时失败按指数退避重新安排该步骤，否则记录为失败"""
+        attempt = self.attempts.get(step_name, 0)
+        if is_retryable(status_code) and attempt <= self.max_retries:
+            delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            logger.warning(f"条目 {self.collection_id} 的 {step_name} 步骤失败 (状态码: {status_code})，{delay} 秒后重试 ({attempt}/{self.max_retries})")
+            self.journal.record(self.collection_id, step_name, status_code, attempt, '重试')
+            METRICS.observe_retry(step_name)
+            scheduler.schedule(step, delay)
+        else:
+            logger.error(f"条目 {self.collection_id} 的 {step_name} 步骤最终失败 (状态码: {status_code})，共尝试 {attempt} 次")
+            self.journal.record(self.collection_id, step_name, status_code, attempt, '失败')
+            METRICS.observe_row('失败')
+
+# ========== 主程序 ==========
+# API URL常量
+API_URL = f'{BANGUMI_API_BASE}/users/-/collections/'
+
+def check_config(config):
+    """检查导入所需的配置项，有问题时记录错误并返回 False"""
+    # 检查BangumiMigrate部分是否存在
+    if 'BangumiMigrate' not in config:
+        logger.error("配置文件中缺少[BangumiMigrate]部分")
+        return False
+
+    # 检查配置
+    if config.get('BangumiMigrate', 'access_token') == '请输入你的Bangumi访问令牌':
+        logger.error("请在config.ini的[BangumiMigrate]部分设置你的Bangumi访问令牌")
+        return False
+
+    if config.get('BangumiMigrate', 'input_csv') == '请输入你的Bangumi导入文件名.csv':
+        logger.error("请在config.ini的[BangumiMigrate]部分设置你的Bangumi导入文件名")
+        return False
+    return True
+
+def journal_path_for(csv_path):
+    """导入日志与CSV同名，记录每个条目每一步的结果"""
+    return os.path.join(os.path.dirname(csv_path), f"import_journal_{os.path.splitext(os.path.basename(csv_path))[0]}.csv")
+
+def import_csv(config, csv_path):
+    """按 [BangumiMigrate] 的设置导入一个CSV文件，导入日志和统计文件写在CSV所在目录（sync_daemon.py 也调用此函数）"""
+    if not os.path.exists(csv_path):
+        logger.error(f"CSV文件不存在: {csv_path}")
+        return
+
+    # 逐行流式读取CSV文件，兼容带BOM的文件
+    logger.info(f"开始读取CSV文件: {csv_path}")
+    with open(csv_path, newline='', encoding='utf-8-sig') as csv_file:
+        reader = csv.DictReader(csv_file)
+
+        # 检查必要的列是否存在
+        required_columns = ['ID', '状态']
+        for col in required_columns:
+            if col not in (reader.fieldnames or []):
+                logger.error(f"CSV文件缺少必要的列: {col}")
+                return
+
+        import_rows(config, reader, journal_path_for(csv_path))
+
+def import_rows(config, rows, journal_path):
+    """
+    导入逐行产生的条目（CSV的 DictReader，或 Trakt-to-Bangumi.py --import 转换时通过队列逐行传来的结果），
+    rows 结束后等待所有步骤完成，统计文件写在导入日志所在目录
+    """
+    # 获取配置项
+    bangumi_access_token = config.get('BangumiMigrate', 'access_token')
+    wait_time = config.getfloat('BangumiMigrate', 'wait_time', fallback=0.5)
+    max_workers = config.getint('BangumiMigrate', 'max_workers', fallback=4)
+    max_retries = config.getint('BangumiMigrate', 'max_retries', fallback=3)
+    resume = config.getboolean('BangumiMigrate', 'resume', fallback=True)
+    metrics_interval = config.getfloat('BangumiMigrate', 'metrics_interval', fallback=30)
+    # 新增自动标满进度的配置项
+    auto_complete = config.getboolean('BangumiMigrate', 'auto_complete', fallback=False)
+
+    # 记录进度配置
+    if auto_complete:
+        logger.info("已启用自动标满进度功能，所有'看过'状态的条目将被标记为看完")
+    else:
+        logger.info("未启用自动标满进度功能，将根据'看到'列的值更新进度")
+
+    # 使用调度器进行并发处理：请求速率由 wait_time 限制，并发数由 max_workers 限制
+    logger.info(f"请求间隔: {wait_time} 秒，并发数: {max_workers}")
+    if not resume and os.path.exists(journal_path):
+        logger.info(f"未启用断点续传，忽略已有导入日志: {journal_path}")
+        os.remove(journal_path)
+    journal = ImportJournal(journal_path)
+    clear_episode_cache()
+
+    scheduler = ImportScheduler(max_workers, RateLimiter(wait_time))
+    scheduler.start()
+    METRICS.reset()
+    stop_reporter = METRICS.start_reporter(metrics_interval)
+
+    # 逐行提交，调度器排队已满时在这里等待
+    total = 0
+    skipped = 0
+    try:
+        for row in rows:
+            total += 1
+            try:
+                task = ImportTask(row, API_URL, bangumi_access_token, journal, auto_complete, max_retries)
+            except Exception as e:
+                logger.error(f"解析数据行失败: {row}, 错误: {e}")
+                continue
+            if not scheduler.submit(task):
+                skipped += 1
+                METRICS.observe_row('跳过')
+        logger.info(f"成功读取全部条目，共{total}条记录")
+        if skipped:
+            logger.info(f"根据导入日志跳过 {skipped} 个已完成的条目")
+    finally:
+        # 等待所有任务完成
+        scheduler.close()
+        scheduler.join()
+        journal.close()
+        stop_reporter.set()
+
+    # 输出并保存最终统计
+    METRICS.report()
+    metrics_path = os.path.join(os.path.dirname(journal_path), f"import_metrics_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(metrics_path, 'w', encoding='utf-8') as metrics_file:
+        json.dump(METRICS.summary(), metrics_file, ensure_ascii=False, indent=2)
+    logger.info(f"导入统计已保存: {metrics_path}")
+
+    logger.info("所有数据处理完成")
+
+def main():
+    try:
+        # 读取配置
+        config = load_config()
+        if not check_config(config):
+            return
+
+        # 构建CSV文件路径（当前目录下）
+        bangumi_input_csv = config.get('BangumiMigrate', 'input_csv')
+        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), bangumi_input_csv)
+        import_csv(config, csv_path)
+
+    except Exception as e:
+        logger.error(f"程序执行错误: {e}")
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Bangumi Csv数据导入工具Pro")
+    parser.add_argument("--profile", action="store_true", help="性能分析：导入结束时写入 profile_*.prof（cProfile）和 profile_*.folded（所有线程的火焰图）")
+    args = parser.parse_args()
+    print("欢迎使用 Bangumi Csv数据导入工具Pro v2.8")
+    print("https://github.com/Adachi-Git/Bangumi2Bangumi")
+    print("https://github.com/wan0ge/Trakt-to-Bangumi")
+    print("-" * 60)
+    print("本工具可以将把 Trakt To Bangumi 项目转换的Bangumi Csv文件一键导入Bangumi")
+    print()
+    config = load_config()   # 这里要加这一行先读取一下配置
+    print()
+    print("请确保已在 config.ini 文件中设置了正确的 导入文件名 ")
+    print(f"当前导入文件名为: {config['BangumiMigrate']['input_csv']} 请确认当前目录有该文件")
+    print()
+    print(f"当前标记全部集数为看过状态为: {config['BangumiMigrate']['auto_complete']}")
+    print(f"为true时将最后一集标记 看到 实现全部标记看过")
+    print(f"为false时使用csv文件中的 看到 数值标记")
+    print()
+    print("-" * 60)
+    confirm = input("确定要继续吗？输入 y 并回车继续，其他键退出：")
+    if confirm.lower() != 'y':
+        print("用户取消，程序退出。")
+        logger.info('========== 脚本结束 ==========')
+        exit(0)
+    stop_profiling = profiling.start_profiling("BangumiMigrate") if args.profile else None
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"程序执行过程中发生未捕获的异常: {e}")
+    finally:
+        if stop_profiling:
+            stop_profiling()
+        # 添加这行代码使窗口不会在程序执行完毕后立即关闭
         input("\n程序执行完成，按回车键退出...")
\ No newline at end of file
@@ -1,1342 +1,2779 @@
-import csv
-import requests
-import datetime
-import time
-import os
-import urllib.parse
-import json
-import re
-import configparser
-import functools
-import logging
-
-# ---------------------- 日志设置开始 -----------------------
-# 配置日志系统
-LOG_FILENAME = "Trakt-to-Bangumi.log"
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILENAME, encoding='utf-8'),
-#        logging.StreamHandler()  # 同时在终端显示
-    ]
-)
-
-def log_print(*args, **kwargs):
-    # 日志+控制台输出，完全兼容print参数
-    msg = ' '.join(str(arg) for arg in args)
-    print(msg, **kwargs)
-    logging.info(msg)
-
-def log_error(*args, **kwargs):
-    msg = ' '.join(str(arg) for arg in args)
-    print(msg, **kwargs)
-    logging.error(msg)
-
-logging.info("========== 脚本启动 ==========")
-
-# ---------------------- 日志设置结束 -----------------------
-
-# 定义配置文件路径
-CONFIG_PATH = 'config.ini'
-
-# 读取配置文件
-def read_config():
-    config = configparser.ConfigParser()
-    
-    # 如果配置文件不存在，创建默认配置
-    if not os.path.exists(CONFIG_PATH):
-        # 使用多行字符串来保留注释
-        config_content = '''\
-#此文件用于 Trakt-to-Bangumi 转换脚本和 Bangumi2Bangumi-Csv版 导入脚本的设置
-[API]
-##必填项
-##TMDB API
-## https://www.themoviedb.org/settings/api
-tmdb_api_key = 请输入你的API Key(API密钥)
-
-##Trakt API
-##当csv中imdb id为空时将使用此项(Trakt API)反查TMDB id进行搜索匹配
-##非必填，但建议填写
-## https://trakt.tv/oauth/applications
-trakt_client_id = 请输入你的Trakt Client ID
-
-[Files]
-##必填项
-##输入文件名
-input_csv = 请输入你的文件名.csv
-
-##输出文件名
-output_csv = bangumi_export.csv
-
-[Settings]
-##自定义最终文件状态，决定最终导入时的状态
-##可选：在看/在读/在玩/在听/看过/读过/玩过/听过/搁置/抛弃
-watch_status = 看过
-
-
-[BangumiMigrate]
-##必填项
-##Bangumi API访问令牌
-## https://next.bgm.tv/demo/access-token
-access_token = 请输入你的Bangumi访问令牌
-
-##必填项
-##Bangumi导入文件名
-input_csv = bangumi_export.csv
-
-##API请求间隔时间(秒)
-wait_time = 2
-
-##true false
-##是否标记全部集数为看过（使用的是"看到"）
-##为true时将最后一集标记"看到"实现全部标记看过
-##为false时使用csv文件中的"看到"数值标记
-auto_complete = true
-
-'''
-        
-        # 直接写入包含注释的完整文件内容
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as configfile:
-            configfile.write(config_content)
-    
-    # 读取配置文件
-    config.read(CONFIG_PATH, encoding='utf-8')
-    
-    # 确保Settings部分存在
-    if 'Settings' not in config:
-        config['Settings'] = {}
-    
-    # 确保watch_status设置存在
-    if 'watch_status' not in config['Settings']:
-        config['Settings']['watch_status'] = '看过'
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as configfile:
-            config.write(configfile)
-    
-    return config
-
-# 全局配置对象
-CONFIG = read_config()
-
-def retry_on_network_error(max_retries=2, base_delay=1):
-    """
-    装饰器函数，用于在网络错误时进行重试
-    :param max_retries: 最大重试次数
-    :param base_delay: 基础延迟时间（秒）
-    """
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except (requests.exceptions.Timeout, 
-                        requests.exceptions.ConnectionError,
-                        requests.exceptions.RequestException) as e:
-                    retries += 1
-                    if retries >= max_retries:
-                        log_error(f"网络错误，已达到最大重试次数 {max_retries}，放弃尝试: {str(e)}")
-                        raise
-                    
-                    wait_time = base_delay * (2 ** (retries - 1))  # 指数退避策略
-                    log_error(f"网络错误: {str(e)}，将在 {wait_time} 秒后重试 ({retries}/{max_retries-1})...")
-                    time.sleep(wait_time)
-            return None
-        return wrapper
-    return decorator
-
-@retry_on_network_error(max_retries=3, base_delay=1)
-def make_api_request(url, headers=None, timeout=10):
-    """
-    发送API请求并处理响应
-    :param url: 请求URL
-    :param headers: 请求头
-    :param timeout: 超时时间（秒）
-    :return: 响应JSON或None
-    """
-    if headers is None:
-        headers = {}
-    
-    response = requests.get(url, headers=headers, timeout=timeout)
-    
-    # 检查状态码
-    if response.status_code != 200:
-        log_error(f"API请求失败，状态码: {response.status_code}，正在重试")
-        if response.status_code >= 500:  # 服务器错误，可能是临时的
-            raise requests.exceptions.RequestException(f"服务器错误: {response.status_code}")
-        return None  # 客户端错误或其他错误，不重试
-    
-    # 检查内容类型
-    content_type = response.headers.get('Content-Type', '')
-    if 'application/json' not in content_type.lower():
-        log_error(f"API返回了非JSON格式 (Content-Type: {content_type})")
-        # 如果响应是HTML，给出更明确的提示
-        if response.text.strip().startswith('<!DOCTYPE html>') or response.text.strip().startswith('<html'):
-            log_error("API返回了HTML页面而不是JSON数据，可能API端点已更改或服务暂时不可用")
-        return None
-    
-    # 检查响应内容是否为空
-    if not response.text.strip():
-        log_error("API返回空响应，可能是搜索条件无效")
-        return None  # 空响应，可能是合法的"无结果"，不重试
-    
-    try:
-        data = response.json()
-        return data
-    except json.JSONDecodeError as e:
-        log_error(f"JSON解析错误: {str(e)}, 响应内容: {response.text[:100]}...")
-        raise requests.exceptions.RequestException(f"JSON解析错误: {str(e)}")
-    
-    # 避免API速率限制
-    time.sleep(0.3)
-
-def get_trakt_data(trakt_id):
-    """通过Trakt API获取影视数据"""
-    # 从配置文件获取Trakt Client ID
-    trakt_client_id = CONFIG['API'].get('trakt_client_id', '')
-    
-    if not trakt_client_id or trakt_client_id == '请输入你的Trakt Client ID':
-        log_error("Trakt Client ID未配置，无法获取Trakt数据")
-        return None
-    
-    url = f"https://api.trakt.tv/shows/{trakt_id}" if trakt_id else None
-    
-    if not url:
-        return None
-        
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-version": "2",
-        "trakt-api-key": trakt_client_id
-    }
-    
-    try:
-        # 尝试获取剧集数据
-        show_data = make_api_request(url, headers, timeout=10)
-        
-        if show_data:
-            log_print(f"成功获取剧集数据: {show_data.get('title')}")
-            
-            # 从Trakt获取TMDB ID
-            tmdb_id = show_data.get("ids", {}).get("tmdb")
-            if tmdb_id:
-                # 使用TMDB ID获取详细信息
-                return get_tmdb_details(tmdb_id, "tv")
-            else:
-                log_error(f"Trakt剧集数据中没有TMDB ID")
-        else:
-            # 尝试获取电影数据
-            movie_url = f"https://api.trakt.tv/movies/{trakt_id}"
-            movie_data = make_api_request(movie_url, headers, timeout=10)
-            
-            if movie_data:
-                log_print(f"成功获取电影数据: {movie_data.get('title')}")
-                
-                # 从Trakt获取TMDB ID
-                tmdb_id = movie_data.get("ids", {}).get("tmdb")
-                if tmdb_id:
-                    # 使用TMDB ID获取详细信息
-                    return get_tmdb_details(tmdb_id, "movie")
-                else:
-                    log_error(f"Trakt电影数据中没有TMDB ID")
-    except Exception as e:
-        log_error(f"Trakt API请求失败: {str(e)}")
-    
-    return None
-
-def get_tmdb_data(imdb_id):
-    """通过 TMDB API 获取影视数据"""
-    # 从配置文件获取TMDB API密钥
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    url = f"https://api.themoviedb.org/3/find/{imdb_id}?api_key={tmdb_api_key}&external_source=imdb_id"
-    
-    try:
-        data = make_api_request(url, timeout=10)
-        
-        if data is None:
-            log_error(f"在TMDB中找不到imdb ID为{imdb_id}的作品")
-            return None
-            
-        # TMDB的find接口会返回电影或电视剧的结果
-        movie_results = data.get("movie_results", [])
-        tv_results = data.get("tv_results", [])
-        
-        if movie_results:
-            result = movie_results[0]
-            tmdb_id = result.get("id")
-            # 获取更详细的电影数据
-            return get_tmdb_details(tmdb_id, "movie")
-        elif tv_results:
-            result = tv_results[0]
-            tmdb_id = result.get("id")
-            # 获取更详细的电视剧数据
-            return get_tmdb_details(tmdb_id, "tv")
-        else:
-            log_error(f"在TMDB中找不到imdb ID为{imdb_id}的作品")
-            return None
-    except Exception as e:
-        log_error(f"TMDB API请求失败: {str(e)}")
-        return None
-
-def get_tmdb_details(tmdb_id, media_type):
-    """获取TMDB详细信息"""
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=release_dates,content_ratings"
-    
-    try:
-        data = make_api_request(url, timeout=10)
-        
-        if data is None:
-            return None
-            
-        # 获取发布日期
-        released = None
-        if media_type == "movie":
-            released = data.get("release_date")
-        else:  # tv
-            released = data.get("first_air_date")
-        
-        # 获取制作国家
-        country = "unknown"
-        country_name = "未知"
-        production_countries = data.get("production_countries", [])
-        if production_countries:
-            country = production_countries[0].get("iso_3166_1", "unknown").lower()
-            country_name = production_countries[0].get("name", "未知")
-        
-        # 获取年份
-        year = None
-        if released:
-            year = int(released.split("-")[0])
-        
-        return {
-            "title": data.get("title") if media_type == "movie" else data.get("name"),
-            "released": released,
-            "country": country,
-            "country_name": country_name,
-            "year": year,
-            "tmdb_id": tmdb_id,
-            "media_type": media_type,
-            "imdb_id": data.get("imdb_id")
-        }
-    except Exception as e:
-        log_error(f"获取TMDB详情失败: {str(e)}")
-        return None
-
-def get_tmdb_details_auto(tmdb_id):
-    """
-    通过tmdb_id自动判断类型查找详细信息（movie/tv）
-    优先movie，再tv（movie找不到再试tv）
-    """
-    detail = get_tmdb_details(tmdb_id, "movie")
-    if detail and detail.get("title"):
-        return detail
-    # 如果movie查不到，尝试tv
-    detail = get_tmdb_details(tmdb_id, "tv")
-    if detail and detail.get("title"):
-        return detail
-    return None
-
-def get_imdb_from_tmdb(tmdb_id, media_type='movie'):
-    """
-    通过tmdb id查imdb id，用于反查再走老流程
-    """
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={tmdb_api_key}"
-    try:
-        data = make_api_request(url, timeout=10)
-        if data and "imdb_id" in data and data["imdb_id"]:
-            return data["imdb_id"]
-    except Exception as e:
-        log_error(f"用tmdb id查imdb id失败: {str(e)}")
-    return None
-
-def get_japanese_title(tmdb_data):
-    """
-    自动用movie或tv接口，根据tmdb_data内容和类型，抓取日文标题（如果有）。
-    优先判断类型，如果没法判断则movie和tv都查一遍。
-    """
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    tmdb_id = tmdb_data.get('id') or tmdb_data.get('tmdb_id')
-    media_type = tmdb_data.get('media_type') or tmdb_data.get('type')
-
-    # 没有id直接返回None
-    if not tmdb_id:
-        return None
-
-    jp_title = None
-
-    # 先按类型查
-    if media_type == "tv" or (tmdb_data.get("name") and not tmdb_data.get("title")):
-        url = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp = make_api_request(url, timeout=10)
-        if resp and resp.get("name"):
-            jp_title = resp["name"]
-    elif media_type == "movie" or (tmdb_data.get("title") and not tmdb_data.get("name")):
-        url = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp = make_api_request(url, timeout=10)
-        if resp and resp.get("title"):
-            jp_title = resp["title"]
-    else:
-        # 类型没法确定，两种都查
-        url_tv = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        url_movie = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp_tv = make_api_request(url_tv, timeout=10)
-        resp_movie = make_api_request(url_movie, timeout=10)
-        if resp_tv and resp_tv.get("name"):
-            jp_title = resp_tv["name"]
-        elif resp_movie and resp_movie.get("title"):
-            jp_title = resp_movie["title"]
-
-    return jp_title
-
-def get_tmdb_japanese_title(tmdb_id, media_type):
-    """从TMDB获取日文标题"""
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    
-    url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-    try:
-        data = make_api_request(url, timeout=10)
-        
-        if data is None:
-            return None
-            
-        # 尝试获取日文标题
-        japanese_title = data.get("title") if media_type == "movie" else data.get("name")
-        if japanese_title and is_japanese(japanese_title):
-            return japanese_title
-        
-        # 如果主标题不是日文，检查alternative_titles
-        alt_titles_url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}/alternative_titles?api_key={tmdb_api_key}"
-        alt_data = make_api_request(alt_titles_url, timeout=10)
-        
-        if alt_data is None:
-            return None
-            
-        titles_key = "titles" if media_type == "movie" else "results"
-        for title_obj in alt_data.get(titles_key, []):
-            if title_obj.get("iso_3166_1") == "JP":
-                return title_obj.get("title") if media_type == "movie" else title_obj.get("name")
-    except Exception as e:
-        log_error(f"TMDB API请求失败: {str(e)}")
-    
-    return None
-
-def get_japanese_title(tmdb_data):
-    """
-    自动用movie或tv接口，根据tmdb_data内容和类型，抓取日文标题（如果有）。
-    优先判断类型，如果没法判断则movie和tv都查一遍。
-    """
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    tmdb_id = tmdb_data.get('id') or tmdb_data.get('tmdb_id')
-    media_type = tmdb_data.get('media_type') or tmdb_data.get('type')
-
-    # 没有id直接返回None
-    if not tmdb_id:
-        return None
-
-    jp_title = None
-
-    # 先按类型查
-    if media_type == "tv" or (tmdb_data.get("name") and not tmdb_data.get("title")):
-        url = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp = make_api_request(url, timeout=10)
-        if resp and resp.get("name"):
-            jp_title = resp["name"]
-    elif media_type == "movie" or (tmdb_data.get("title") and not tmdb_data.get("name")):
-        url = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp = make_api_request(url, timeout=10)
-        if resp and resp.get("title"):
-            jp_title = resp["title"]
-    else:
-        # 类型没法确定，两种都查
-        url_tv = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        url_movie = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
-        resp_tv = make_api_request(url_tv, timeout=10)
-        resp_movie = make_api_request(url_movie, timeout=10)
-        if resp_tv and resp_tv.get("name"):
-            jp_title = resp_tv["name"]
-        elif resp_movie and resp_movie.get("title"):
-            jp_title = resp_movie["title"]
-
-    return jp_title
-
-
-def get_best_tmdb_candidates(imdb_id=None, tmdb_id=None, csv_title=None):
-    """
-    综合IMDB ID或TMDB ID，返回优先级排序的tmdb候选详情列表（带评分）。
-    优先尝试movie、tv、find所有接口，返回所有有title/name的条目和其相似度评分。
-    """
-    from difflib import SequenceMatcher
-    tmdb_api_key = CONFIG['API']['tmdb_api_key']
-    results = []
-
-    # 1. 通过IMDB ID找tmdb（movie/tv/find）
-    if imdb_id:
-        url_find = f"https://api.themoviedb.org/3/find/{imdb_id}?api_key={tmdb_api_key}&external_source=imdb_id"
-        data_find = make_api_request(url_find, timeout=10)
-        if data_find:
-            for key in ["movie_results", "tv_results"]:
-                for item in data_find.get(key, []):
-                    if item.get("id"):
-                        tmdb_type = "movie" if key == "movie_results" else "tv"
-                        url_detail = f"https://api.themoviedb.org/3/{tmdb_type}/{item['id']}?api_key={tmdb_api_key}"
-                        detail = make_api_request(url_detail, timeout=10)
-                        if detail and (detail.get("title") or detail.get("name")):
-                            results.append(detail)
-    # 2. 通过TMDB ID查movie
-    if tmdb_id:
-        url_movie = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={tmdb_api_key}"
-        data_movie = make_api_request(url_movie, timeout=10)
-        if data_movie and data_movie.get("title"):
-            results.append(data_movie)
-        url_tv = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}"
-        data_tv = make_api_request(url_tv, timeout=10)
-        if data_tv and data_tv.get("name"):
-            results.append(data_tv)
-        # find接口也查一下
-        url_find = f"https://api.themoviedb.org/3/find/{tmdb_id}?api_key={tmdb_api_key}&external_source=tmdb_id"
-        data_find = make_api_request(url_find, timeout=10)
-        if data_find:
-            for key in ["movie_results", "tv_results"]:
-                for item in data_find.get(key, []):
-                    if item.get("id"):
-                        tmdb_type = "movie" if key == "movie_results" else "tv"
-                        url_detail = f"https://api.themoviedb.org/3/{tmdb_type}/{item['id']}?api_key={tmdb_api_key}"
-                        detail = make_api_request(url_detail, timeout=10)
-                        if detail and (detail.get("title") or detail.get("name")):
-                            results.append(detail)
-
-    # 3. 去重（用id+type+title去重）
-    seen = set()
-    unique_results = []
-    for item in results:
-        key = f"{item.get('id')}_{item.get('media_type', item.get('type', ''))}_{item.get('title', item.get('name', ''))}"
-        if key not in seen:
-            unique_results.append(item)
-            seen.add(key)
-
-    # 4. 给每个候选打分
-    def tmdb_title(item):
-        return item.get('title') or item.get('name') or ''
-    candidates = []
-    if csv_title:
-        for item in unique_results:
-            score = SequenceMatcher(None, csv_title.lower(), tmdb_title(item).lower()).ratio()
-            candidates.append((score, item))
-        candidates.sort(reverse=True, key=lambda x: x[0])
-    else:
-        # 没有csv_title就不打分
-        candidates = [(1.0, item) for item in unique_results]
-    return candidates
-
-def rate_tmdb_candidate(item, csv_title):
-    """
-    根据和csv标题的相似度评分，越高越优先
-    """
-    from difflib import SequenceMatcher
-    tmdb_title = item.get('title') or item.get('name') or ''
-    return SequenceMatcher(None, csv_title.lower(), tmdb_title.lower()).ratio()
-
-
-def get_country_name(tmdb_data):
-    """
-    智能获取TMDB条目的制作地区中/英文名。
-    优先 origin_country，再 production_countries，支持movie和tv。
-    """
-    country_code = None
-    country_name = "未知"
-    # tv类型优先
-    if tmdb_data.get("origin_country"):
-        codes = tmdb_data["origin_country"]
-        if isinstance(codes, list) and codes:
-            country_code = codes[0]
-    # movie类型
-    if not country_code and tmdb_data.get("production_countries"):
-        prod = tmdb_data["production_countries"]
-        if isinstance(prod, list) and prod:
-            country_code = prod[0].get("iso_3166_1")
-            country_name = prod[0].get("name", "未知")
-    # 补充用 ISO 国家码映射
-    code_map = {
-        "JP": "Japan", "US": "United States of America", "CN": "China", "KR": "South Korea", "GB": "United Kingdom", "FR": "France",
-    }
-    if country_code:
-        country_name = code_map.get(country_code.upper(), country_code)
-    return country_name
-
-def get_media_type(tmdb_data):
-    """
-    智能获取条目类型，仅返回"tv"或"movie"。
-    "Scripted"等非标准类型一律当tv处理。
-    """
-    mtype = tmdb_data.get("media_type") or tmdb_data.get("type")
-    if mtype in ["tv", "movie"]:
-        return mtype
-    if mtype and mtype.lower() == "scripted":
-        return "tv"
-    if tmdb_data.get("name") and not tmdb_data.get("title"):
-        return "tv"
-    if tmdb_data.get("title") and not tmdb_data.get("name"):
-        return "movie"
-    return "unknown"
-
-
-def is_japanese(text):
-    """简单判断文本是否含有日文字符"""
-    # 日文字符范围（平假名、片假名、汉字部分范围）
-    japanese_pattern = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]')
-    return bool(japanese_pattern.search(text))
-
-def search_bangumi(title, japanese_title, released, year=None):
-    """通过 Bangumi API 搜索匹配的条目，优先使用日文标题"""
-    results = []
-    
-    # 预处理标题，替换特殊符号为空格
-    def clean_title(title_str):
-        if not title_str:
-            return title_str
-        # 替换特殊符号为空格
-        cleaned = re.sub(r'[/\\:*?"<>|&#+\-\.,;=@!%\(\)\[\]\{\}]', ' ', title_str)
-        # 合并多个空格为单个空格
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        return cleaned
-    
-    # 1. 首先尝试使用日文标题搜索
-    if japanese_title and japanese_title != title:
-        # 处理标题中的特殊符号
-        clean_jp_title = clean_title(japanese_title)
-        encoded_jp_title = urllib.parse.quote(clean_jp_title)
-        
-        log_print(f"使用清理后的日文标题搜索: '{clean_jp_title}'")
-        jp_results = _search_bangumi_api(encoded_jp_title)
-        
-        if jp_results:
-            log_print(f"使用日文标题'{clean_jp_title}'搜索到 {len(jp_results)} 个结果")
-            results.extend(jp_results)
-        
-        # 尝试日文标题拆分简化搜索
-        if not jp_results and (japanese_title.find(':') > 0 or japanese_title.find('：') > 0 or 
-                              japanese_title.find('-') > 0 or japanese_title.find('～') > 0 or
-                              japanese_title.find('〜') > 0 or ' ' in japanese_title):
-            # 处理日文常见的分隔符
-            main_jp_title = japanese_title
-            for sep in [':', '：', '-', '～', '〜']:
-                if sep in main_jp_title:
-                    main_jp_title = main_jp_title.split(sep)[0]
-            
-            # 单独处理空格，因为空格可能是标题本身的一部分
-            # 只有当其他分隔符都不存在时，才考虑用空格分割
-            if main_jp_title == japanese_title and ' ' in japanese_title:
-                # 有些日文标题格式是"主标题 副标题"
-                main_jp_title = japanese_title.split(' ')[0]
-            
-            main_jp_title = clean_title(main_jp_title.strip())
-            
-            if main_jp_title != clean_jp_title:
-                log_print(f"尝试使用简化日文标题: {main_jp_title}")
-                encoded_simple_jp_title = urllib.parse.quote(main_jp_title)
-                simple_jp_results = _search_bangumi_api(encoded_simple_jp_title)
-                if simple_jp_results:
-                    log_print(f"使用简化日文标题'{main_jp_title}'搜索到 {len(simple_jp_results)} 个结果")
-                    results.extend(simple_jp_results)
-    
-    # 2. 然后使用英文标题搜索
-    clean_en_title = clean_title(title)
-    encoded_title = urllib.parse.quote(clean_en_title)
-    
-    log_print(f"使用清理后的英文标题搜索: '{clean_en_title}'")
-    eng_results = _search_bangumi_api(encoded_title)
-    
-    if eng_results:
-        log_print(f"使用英文标题'{clean_en_title}'搜索到 {len(eng_results)} 个结果")
-        results.extend(eng_results)
-    
-    # 3. 如果仍无结果，尝试英文标题拆分
-    if not results and (title.find(':') > 0 or title.find('-') > 0 or ' ' in title):
-        main_title = title
-        for sep in [':', '-']:
-            if sep in main_title:
-                main_title = main_title.split(sep)[0]
-        
-        # 如果标题中有空格，且没有其他分隔符，考虑第一个空格前的部分
-        if main_title == title and ' ' in title and len(title.split(' ')) > 1:
-            # 避免过度简化短标题
-            words = title.split(' ')
-            if len(words) > 2:  # 至少有三个词的标题才考虑简化
-                main_title = ' '.join(words[:2])  # 取前两个词
-        
-        main_title = clean_title(main_title.strip())
-        
-        if main_title != clean_en_title and len(main_title) > 3:  # 确保简化后的标题不会太短
-            log_print(f"尝试使用简化英文标题: {main_title}")
-            encoded_simple_title = urllib.parse.quote(main_title)
-            simple_results = _search_bangumi_api(encoded_simple_title)
-            if simple_results:
-                log_print(f"使用简化英文标题'{main_title}'搜索到 {len(simple_results)} 个结果")
-                results.extend(simple_results)
-    
-    # 处理搜索结果
-    if results:
-        return _process_bangumi_results(results, title, japanese_title, released, year)
-    
-    return None, None, None, None, 0.0  # 添加相似度分数作为返回值
-
-def _search_bangumi_api(encoded_title):
-    """调用Bangumi API进行搜索"""
-    url = f"https://api.bgm.tv/search/subject/{encoded_title}?type=2,6&responseGroup=small"
-    
-    headers = {
-        "User-Agent": "wan0ge/Trakt-to-Bangumi(https://github.com/wan0ge/Trakt-to-Bangumi)",
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        # 检查响应状态码
-        if response.status_code != 200:
-            log_error(f"Bangumi API返回了非200状态码: {response.status_code}")
-            return []
-            
-        # 检查内容类型
-        content_type = response.headers.get('Content-Type', '')
-        if 'application/json' not in content_type.lower():
-            log_error(f"Bangumi API返回了非JSON格式 (Content-Type: {content_type})")
-            return []
-            
-        # 检查是否为空响应
-        if not response.text or response.text.isspace():
-            log_error(f"Bangumi API搜索无结果: '{encoded_title}'")
-            return []
-            
-        # 尝试解析JSON
-        try:
-            data = response.json()
-        except json.JSONDecodeError as e:
-            # 如果返回的不是有效的JSON格式
-            if response.text.strip().startswith('<!DOCTYPE html>') or response.text.strip().startswith('<html'):
-                log_error(f"Bangumi API返回了HTML而不是JSON (可能是网站而不是API响应)")
-            else:
-                log_error(f"Bangumi API返回了无效的JSON格式: {str(e)}")
-            return []
-        
-        # 处理有效的JSON响应
-        if isinstance(data, dict) and "list" in data:
-            return data["list"]
-        elif isinstance(data, list):
-            return data
-        else:
-            # 空结果但格式正确
-            if not data:
-                log_error(f"Bangumi API搜索无结果: '{encoded_title}'")
-                return []
-            log_error(f"Bangumi API返回了意外的数据结构：{type(data)}")
-            return []
-            
-    except requests.exceptions.RequestException as e:
-        log_error(f"Bangumi API请求出错: {str(e)}")
-        return []
-    except Exception as e:
-        log_error(f"处理Bangumi API响应时出错: {str(e)}")
-        return []
-            
-    except Exception as e:
-        # Only show generic error for non-JSON parsing errors
-        if not isinstance(e, json.JSONDecodeError):
-            log_error(f"Bangumi API请求出错: {str(e)}")
-        return []
-
-def _process_bangumi_results(results, title, japanese_title, released, year):
-    """处理Bangumi搜索结果并找出最佳匹配"""
-    best_match = None
-    best_score = 0
-    best_similarity = 0  # 保存最佳匹配的相似度
-    
-    for item in results:
-        bgm_id = item.get("id")
-        bgm_title = item.get("name", "")
-        bgm_cn_title = item.get("name_cn", "")
-        bgm_date = item.get("air_date", item.get("date", ""))
-        
-        log_print(f"评估条目: ID={bgm_id}, 标题={bgm_title}, 中文标题={bgm_cn_title}, 日期={bgm_date}")
-        
-        # 计算匹配分数
-        score = 0
-        
-        # 1. 标题匹配分数
-        en_similarity = check_title_similarity(title, bgm_title, bgm_cn_title)
-        jp_similarity = 0
-        if japanese_title:
-            jp_similarity = check_title_similarity(japanese_title, bgm_title, bgm_cn_title)
-        
-        # 取最高的标题相似度
-        title_similarity = max(en_similarity, jp_similarity)
-        score += title_similarity * 5  # 标题相似度权重加大
-        
-        # 2. 日期匹配分数
-        if bgm_date and released:
-            date_score = calculate_date_score(released, bgm_date)
-            score += date_score
-        
-        # 3. 年份匹配额外加分
-        if year and bgm_date and len(bgm_date) >= 4 and bgm_date[:4] == str(year):
-            score += 2
-        
-        log_print(f"条目 {bgm_id} 的匹配分数: {score} (标题相似度: {title_similarity})")
-        
-        # 更新最佳匹配
-        if score > best_score:
-            best_score = score
-            best_similarity = title_similarity  # 保存相似度
-            best_match = item
-    
-    # 如果最佳分数达到阈值
-    if best_score >= 2.5:  # 调整阈值可以控制匹配的严格程度
-        log_print(f"找到最佳匹配: ID={best_match.get('id')}, Bangumi中文标题: {bgm_cn_title}, 相似度={best_score}")
-		
-        return (
-            best_match.get("id"),
-            best_match.get("name"),
-            best_match.get("name_cn", ""),
-            best_match.get("air_date", best_match.get("date", "")),  # 返回Bangumi的放送日期
-            best_similarity  # 返回最高标题相似度
-        )
-    
-    log_print(f"未找到足够可信的匹配项 (最高分数: {best_score})")
-    return None, None, None, None, 0.0
-
-def check_title_similarity(source_title, bgm_title, bgm_cn_title):
-    """检查标题相似度"""
-    from difflib import SequenceMatcher
-    
-    # 如果任一标题为空，返回0
-    if not source_title or (not bgm_title and not bgm_cn_title):
-        return 0
-    
-    # 计算与英文标题的相似度
-    similarity1 = SequenceMatcher(None, source_title.lower(), bgm_title.lower()).ratio()
-    
-    # 计算与中文标题的相似度（如果有）
-    similarity2 = 0
-    if bgm_cn_title:
-        similarity2 = SequenceMatcher(None, source_title.lower(), bgm_cn_title.lower()).ratio()
-    
-    # 返回最高相似度
-    return max(similarity1, similarity2)
-
-def calculate_date_score(tmdb_date, bgm_date):
-    """计算日期匹配分数，日期越接近分数越高"""
-    try:
-        tmdb_dt = datetime.datetime.strptime(tmdb_date, "%Y-%m-%d")
-        bgm_dt = datetime.datetime.strptime(bgm_date, "%Y-%m-%d")
-        diff = abs((tmdb_dt - bgm_dt).days)
-        
-        # 完全匹配得3分
-        if diff == 0:
-            return 3
-        # 1周内得2分
-        elif diff <= 7:
-            return 2
-        # 1个月内得1分
-        elif diff <= 30:
-            return 1
-        # 同一年得0.5分
-        elif tmdb_dt.year == bgm_dt.year:
-            return 0.5
-        # 相差一年得0.2分
-        elif abs(tmdb_dt.year - bgm_dt.year) == 1:
-            return 0.2
-        # 其他情况得0分
-        else:
-            return 0
-    except:
-        return 0
-
-def get_bangumi_details(bgm_id):
-    """获取Bangumi条目详细信息"""
-    url = f"https://api.bgm.tv/subject/{bgm_id}?responseGroup=large"
-    
-    headers = {
-        "User-Agent": "wan0ge/Trakt-to-Bangumi(https://github.com/wan0ge/Trakt-to-Bangumi)",
-        "Accept": "application/json"
-    }
-    
-    try:
-        data = make_api_request(url, headers, timeout=10)
-        return data
-    except Exception as e:
-        log_error(f"获取Bangumi详情失败: {str(e)}")
-        return None
-
-def convert_csv(timestamp):
-    """转换CSV文件为Bangumi导入格式，实时写入结果，并跳过重复项"""
-    # 从配置文件读取输入输出文件名
-    input_csv = CONFIG['Files']['input_csv']
-    output_csv = CONFIG['Files']['output_csv']
-
-    # 从配置文件读取自定义的观看状态
-    watch_status = CONFIG['Settings']['watch_status']
-    log_print(f"使用自定义观看状态: {watch_status}")
-
-    # 创建当天的日志文件名
-    success_log = f"success_log_{timestamp}.csv"
-    failure_log = f"failure_log_{timestamp}.csv"
-
-    if not os.path.exists(input_csv):
-        log_error(f"文件 {input_csv} 不存在！")
-        input("按任意键退出...")
-        return
-
-    # 首先获取要处理的总条目数，用于进度跟踪
-    try:
-        with open(input_csv, newline='', encoding='utf-8') as count_file:
-            total_items = sum(1 for _ in csv.DictReader(count_file))
-        log_print(f"共找到 {total_items} 条记录需要处理")
-    except Exception as e:
-        log_error(f"读取CSV文件出错: {str(e)}")
-        total_items = 0
-
-    # 读取已存在的输出文件，收集已处理的Bangumi ID
-    processed_bangumi_ids = set()
-    if os.path.exists(output_csv):
-        try:
-            with open(output_csv, newline='', encoding='utf-8') as existing_file:
-                reader = csv.reader(existing_file)
-                next(reader)  # 跳过表头
-                for row in reader:
-                    if row and row[0]:  # 确保有ID
-                        processed_bangumi_ids.add(row[0])
-            log_print(f"从输出文件中读取到 {len(processed_bangumi_ids)} 个已处理的Bangumi ID")
-        except Exception as e:
-            log_error(f"读取已存在的输出文件时出错: {str(e)}")
-
-    # 读取已存在的成功/失败日志，收集已处理的IMDB/TMDB/Trakt ID
-    processed_imdb_ids = set()
-    processed_trakt_ids = set()
-    processed_tmdb_ids = set()
-    skipped_items = 0
-    
-    # 支持后续从日志自动恢复
-    if os.path.exists(success_log):
-        try:
-            with open(success_log, newline='', encoding='utf-8') as existing_log:
-                reader = csv.reader(existing_log)
-                headers = next(reader)  # 读取表头
-                
-                # 检查表头是否包含Trakt ID列
-                has_trakt_column = "原Trakt ID" in headers
-                trakt_index = headers.index("原Trakt ID") if has_trakt_column else -1
-                
-                for row in reader:
-                    if row and len(row) > 0:  # 确保有数据
-                        # 添加IMDB ID到已处理集合
-                        if row[0]:  # IMDB ID
-                            processed_imdb_ids.add(row[0])
-                        
-                        # 添加Trakt ID到已处理集合(如果表头包含Trakt ID列)
-                        if has_trakt_column and trakt_index >= 0 and trakt_index < len(row) and row[trakt_index]:
-                            processed_trakt_ids.add(row[trakt_index])
-                            
-            log_print(f"从成功日志中读取到 {len(processed_imdb_ids)} 个已处理的IMDB ID")
-            log_print(f"从成功日志中读取到 {len(processed_trakt_ids)} 个已处理的Trakt ID")
-        except Exception as e:
-            log_error(f"读取已存在的成功日志时出错: {str(e)}")
-    
-    # 读取已存在的失败日志，也将其中的IMDB ID和Trakt ID加入已处理集合
-    if os.path.exists(failure_log):
-        try:
-            with open(failure_log, newline='', encoding='utf-8') as existing_log:
-                reader = csv.reader(existing_log)
-                headers = next(reader)  # 读取表头
-                
-                # 检查表头是否包含Trakt ID列
-                has_trakt_column = "原Trakt ID" in headers
-                trakt_index = headers.index("原Trakt ID") if has_trakt_column else -1
-                
-                for row in reader:
-                    if row and len(row) > 0:  # 确保有数据
-                        # 添加IMDB ID到已处理集合
-                        if row[0] and row[0] != "unknown":  # IMDB ID
-                            processed_imdb_ids.add(row[0])
-                        
-                        # 添加Trakt ID到已处理集合(如果表头包含Trakt ID列)
-                        if has_trakt_column and trakt_index >= 0 and trakt_index < len(row) and row[trakt_index] and row[trakt_index] != "unknown":
-                            processed_trakt_ids.add(row[trakt_index])
-                            
-            log_print(f"从失败日志中读取到 {len(processed_imdb_ids)} 个已处理的IMDB ID")
-            log_print(f"从失败日志中读取到 {len(processed_trakt_ids)} 个已处理的Trakt ID")
-        except Exception as e:
-            log_error(f"读取已存在的失败日志时出错: {str(e)}")
-    
-    # 初始化输出文件，如果不存在则写入表头
-    if not os.path.exists(output_csv):
-        with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
-            writer = csv.writer(outfile)
-            writer.writerow(["ID", "类型", "中文", "日文", "放送", "排名", "评分", "话数", "看到", "状态", "标签", "我的评价", "我的简评", "私密", "更新时间", "制作地区"])
-
-    # 初始化成功日志文件，如果不存在则写入表头
-    if not os.path.exists(success_log):
-        with open(success_log, 'w', newline='', encoding='utf-8') as success_file:
-            success_writer = csv.writer(success_file)
-            success_writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "匹配Bangumi ID", "匹配日文标题", "匹配中文标题", "相似度", "制作地区", "TMDB类型"])
-
-    # 初始化失败日志文件，如果不存在则写入表头
-    if not os.path.exists(failure_log):
-        with open(failure_log, 'w', newline='', encoding='utf-8') as failure_file:
-            failure_writer = csv.writer(failure_file)
-            failure_writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "失败原因", "制作地区", "TMDB类型"])
-
-    # -------- 合并跳过提示相关变量 --------
-    last_skip_reason = None
-    last_skip_start = None
-    last_skip_count = 0
-    # ---------------------------------------
-
-    with open(input_csv, newline='', encoding='utf-8') as infile:
-        reader = csv.DictReader(infile)
-
-        processed_items = 0
-        successful_matches = 0
-
-        for row in reader:
-            processed_items += 1
-
-            try:
-                imdb_id = row.get("imdb", "")  # 兼容有imdb字段
-                tmdb_id = row.get("tmdb", "")  # 新增：tmdb字段
-                trakt_id = row.get("trakt", "")  # 使用"trakt"字段
-                watched_at = row.get("watched_at", "")  # 使用"watched_at"字段
-                csv_title = row.get("title", "")  # 使用CSV中的标题作为备选
-
-                # 检查是否已处理过（可加去重判定）
-                skip_item = False
-                skip_reason = ""
-                skip_id_val = ""
-                if imdb_id and imdb_id in processed_imdb_ids:
-                    skip_item = True
-                    skip_reason = f"跳过已处理的IMDB ID: {imdb_id}"
-                    skip_id_val = imdb_id
-                elif tmdb_id and tmdb_id in processed_tmdb_ids:
-                    skip_item = True
-                    skip_reason = f"跳过已处理的TMDB ID: {tmdb_id}"
-                    skip_id_val = tmdb_id
-                elif trakt_id and trakt_id in processed_trakt_ids:
-                    skip_item = True
-                    skip_reason = f"跳过已处理的Trakt ID: {trakt_id}"
-                    skip_id_val = trakt_id
-
-                # -------- 合并输出跳过提示 --------
-                if skip_item:
-                    # 只按"跳过类型+具体ID"合并，不包含编号
-                    if skip_reason == last_skip_reason:
-                        last_skip_count += 1
-                    else:
-                        if last_skip_reason is not None:
-                            if last_skip_count > 1:
-                                log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
-                            else:
-                                log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
-                        last_skip_reason = skip_reason
-                        last_skip_start = processed_items
-                        last_skip_count = 1
-                    skipped_items += 1
-                    continue
-
-                # 每当要真正处理新内容（非跳过）时，先输出累计跳过提示
-                if last_skip_reason is not None:
-                    if last_skip_count > 1:
-                        log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
-                    else:
-                        log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
-                    last_skip_reason = None
-                    last_skip_start = None
-                    last_skip_count = 0
-
-                log_print(f"\n处理进度: [{processed_items}/{total_items}]")
-
-                tmdb_data = None
-                failure_reason = ""
-
-                # --------- 智能优选TMDB详情 ---------
-                # 新增多候选兜底逻辑
-                tmdb_candidates = []
-                if imdb_id and imdb_id.strip():
-                    log_print(f"正在使用IMDB ID处理: {imdb_id} (标题: {csv_title})")
-                    tmdb_candidates = get_best_tmdb_candidates(imdb_id=imdb_id, csv_title=csv_title)
-                elif tmdb_id and tmdb_id.strip():
-                    log_print(f"没有IMDB ID，使用TMDB ID综合查movie/tv/find详情后优选: {tmdb_id} (标题: {csv_title})")
-                    tmdb_candidates = get_best_tmdb_candidates(tmdb_id=tmdb_id, csv_title=csv_title)
-                elif trakt_id and trakt_id.strip():
-                    log_print(f"IMDB/TMDB ID均为空，尝试使用Trakt ID: {trakt_id} (标题: {csv_title})")
-                    tmdb_data = get_trakt_data(trakt_id)
-                    tmdb_candidates = [(1.0, tmdb_data)] if tmdb_data else []
-                else:
-                    failure_reason = "无有效ID字段"
-                    tmdb_candidates = []
-                
-                # 如果没有TMDB候选，启用兜底
-                if not tmdb_candidates:
-                    tmdb_candidates = [(1.0, {
-                        "title": csv_title,
-                        "released": None,
-                        "country": "unknown",
-                        "country_name": "未知",
-                        "year": None,
-                        "tmdb_id": None,
-                        "media_type": "unknown"
-                    })]
-                
-                # ------ 在这里加打印候选日志 ------
-                if tmdb_candidates:
-                    log_print(f"共获取到 {len(tmdb_candidates)} 个TMDB候选：")
-                    for idx, (score, item) in enumerate(tmdb_candidates, 1):
-                        main_title = item.get('title') or item.get('name')
-                        media_type = get_media_type(item)
-                        year = item.get('release_date') or item.get('first_air_date') or item.get('year')
-                        tmdb_id = item.get('id') or item.get('tmdb_id')
-                        log_print(
-                            f"  [{idx}] score={score:.3f} | type={media_type} | id={tmdb_id} | year={year} | title='{main_title}'"
-                        )
-                else:
-                    log_print("未获取到任何TMDB候选！")
-                # ----------------------------------
-
-                # 按优先级依次尝试Bangumi搜索
-                # 多候选兜底Bangumi优选逻辑，确保不会重复二次匹配
-                bangumi_id = None
-                bgm_jp_title = None
-                bgm_cn_title = None
-                bgm_air_date = None
-                similarity = 0.0
-                
-                for idx, (score, tmdb_data) in enumerate(tmdb_candidates):
-                    main_title = tmdb_data.get("title") or tmdb_data.get("name")
-                    country_name = get_country_name(tmdb_data)
-                    media_type = get_media_type(tmdb_data)
-                    japanese_title = get_japanese_title(tmdb_data)
-                    log_print(f"[候选{idx+1}] TMDB标题: 英文='{main_title}', 日文='{japanese_title}', score={score:.3f}, 制作地区='{country_name}', TMDB类型='{media_type}'")
-                    # 只要有一个Bangumi结果就立即停止后续
-                    bangumi_id, bgm_jp_title, bgm_cn_title, bgm_air_date, similarity = search_bangumi(
-                        main_title,
-                        japanese_title,
-                        tmdb_data.get("released"),
-                        tmdb_data.get("year")
-                    )
-                    if bangumi_id:
-                        break
-                
-                # 只有当所有TMDB候选都没有搜到Bangumi时，再用CSV原始标题兜底一次
-                if not bangumi_id and csv_title:
-                    log_error(f"所有TMDB候选都未在Bangumi找到匹配，尝试用CSV原始标题兜底: {csv_title}")
-                    bangumi_id, bgm_jp_title, bgm_cn_title, bgm_air_date, similarity = search_bangumi(
-                        csv_title,
-                        None,
-                        None,
-                        None
-                                    )
-
-                if not bangumi_id:
-                    failure_reason = failure_reason or "未找到Bangumi匹配项"
-                    log_error(f"仍未找到 Bangumi 匹配项，记录失败日志。")
-
-                    with open(failure_log, 'a', newline='', encoding='utf-8') as failure_file:
-                        failure_writer = csv.writer(failure_file)
-                        failure_writer.writerow([imdb_id, tmdb_id, trakt_id, csv_title, failure_reason, country_name, media_type])
-
-                    if imdb_id:
-                        processed_imdb_ids.add(imdb_id)
-                    if tmdb_id:
-                        processed_tmdb_ids.add(tmdb_id)
-                    if trakt_id:
-                        processed_trakt_ids.add(trakt_id)
-                    continue
-
-                if bangumi_id in processed_bangumi_ids:
-                    skip_msg = f"跳过已处理的Bangumi ID: {bangumi_id}"
-                    if skip_msg == last_skip_reason:
-                        last_skip_count += 1
-                    else:
-                        if last_skip_reason is not None:
-                            if last_skip_count > 1:
-                                log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
-                            else:
-                                log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
-                        last_skip_reason = skip_msg
-                        last_skip_start = processed_items
-                        last_skip_count = 1
-                    skipped_items += 1
-
-                    with open(success_log, 'a', newline='', encoding='utf-8') as success_file:
-                        success_writer = csv.writer(success_file)
-                        success_writer.writerow([
-                            imdb_id, tmdb_id, trakt_id, csv_title, bangumi_id, bgm_jp_title, bgm_cn_title,
-                            f"{similarity:.3f}", country_name, media_type
-                        ])
-                    if imdb_id:
-                        processed_imdb_ids.add(imdb_id)
-                    if tmdb_id:
-                        processed_tmdb_ids.add(tmdb_id)
-                    if trakt_id:
-                        processed_trakt_ids.add(trakt_id)
-                    continue
-
-                # 每当要真正处理新内容（非跳过）时，先输出累计跳过提示（保证Bangumi ID跳过也能合并输出）
-                if last_skip_reason is not None:
-                    if last_skip_count > 1:
-                        log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
-                    else:
-                        log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
-                    last_skip_reason = None
-                    last_skip_start = None
-                    last_skip_count = 0
-
-                # Bangumi 放送日期补全
-                if not bgm_air_date:
-                    log_print("未从搜索结果获取到Bangumi放送日期，尝试获取详细信息...")
-                    bgm_details = get_bangumi_details(bangumi_id)
-                    if bgm_details:
-                        bgm_air_date = bgm_details.get("air_date", "")
-                        log_print(f"从Bangumi详情获取到放送日期: {bgm_air_date}")
-
-                # 如果仍然没有Bangumi放送日期，则使用TMDB日期作为备选
-                if not bgm_air_date:
-                    log_print("未获取到Bangumi放送日期，使用TMDB日期作为备选")
-                    bgm_air_date = tmdb_data.get("released")
-
-                successful_matches += 1
-
-                # 记录成功日志
-                with open(success_log, 'a', newline='', encoding='utf-8') as success_file:
-                    success_writer = csv.writer(success_file)
-                    success_writer.writerow([
-                        imdb_id, tmdb_id, trakt_id, csv_title, bangumi_id, bgm_jp_title, bgm_cn_title,
-                        f"{similarity:.3f}", country_name, media_type
-                    ])
-
-                processed_bangumi_ids.add(bangumi_id)
-                if imdb_id:
-                    processed_imdb_ids.add(imdb_id)
-                if tmdb_id:
-                    processed_tmdb_ids.add(tmdb_id)
-                if trakt_id:
-                    processed_trakt_ids.add(trakt_id)
-
-                # 判断是否是“新格式”
-                is_new_format = bool(imdb_id or tmdb_id or trakt_id)
-                
-                if is_new_format:
-                    # 新规则：只有“动画”“电影”
-                    if media_type == "movie":
-                        category = "电影"
-                    else:
-                        category = "动画"
-                else:
-                    # 旧规则，按国家与类型判断
-                    country = tmdb_data.get("country", "unknown")
-                    # 这里是你之前的老逻辑（如：日本tv、movie等分开）
-                    if country == "jp":
-                        category = "动画"
-                    else:
-                        category = "剧集" if media_type == "tv" else "电影"
-
-                # 格式化观看日期 (如果需要转换格式)
-                try:
-                    watched_datetime = datetime.datetime.fromisoformat(watched_at.replace("Z", "+00:00"))
-                    formatted_watched_at = watched_datetime.strftime("%Y-%m-%d")
-                except:
-                    formatted_watched_at = watched_at
-
-                # 实时写入匹配结果到输出文件
-                with open(output_csv, 'a', newline='', encoding='utf-8') as outfile:
-                    writer = csv.writer(outfile)
-                    writer.writerow([bangumi_id, category, bgm_cn_title, bgm_jp_title, bgm_air_date, "", "", "", "", watch_status, "", "", "", "", formatted_watched_at, country_name])
-
-                log_print(f"成功转换并写入: {csv_title} -> Bangumi: {bgm_cn_title}, 放送日期: {bgm_air_date}, 制作地区: {country_name}, TMDB类型: {media_type}")
-
-                # 显示当前进度和匹配率
-                current_match_rate = (successful_matches / (processed_items - skipped_items) * 100) if (processed_items - skipped_items) > 0 else 0
-                log_print(f"当前匹配率: {current_match_rate:.2f}% ({successful_matches}/{processed_items - skipped_items})")
-
-                time.sleep(0.3)  # 避免 API 速率限制
-
-            except Exception as e:
-                log_error(f"转换时出错: {str(e)}")
-                with open(failure_log, 'a', newline='', encoding='utf-8') as failure_file:
-                    failure_writer = csv.writer(failure_file)
-                    failure_writer.writerow([
-                        row.get('imdb', 'unknown'),
-                        row.get('tmdb', 'unknown'),
-                        row.get('trakt', 'unknown'),
-                        row.get('title', 'unknown'),
-                        f"处理异常: {str(e)}",
-                        row.get('country_name', '未知'),
-                        row.get('media_type', 'unknown')
-                    ])
-                with open('error_log.txt', 'a', encoding='utf-8') as error_log:
-                    error_log.write(f"处理失败 [{processed_items}/{total_items}]: IMDB ID={row.get('imdb', 'unknown')}, TMDB ID={row.get('tmdb', 'unknown')}, Trakt ID={row.get('trakt', 'unknown')}, 标题={row.get('title', 'unknown')}, 错误: {str(e)}\n")
-                    import traceback
-                    error_log.write(traceback.format_exc() + "\n\n")
-                if row.get('imdb'):
-                    processed_imdb_ids.add(row.get('imdb'))
-                if row.get('tmdb'):
-                    processed_tmdb_ids.add(row.get('tmdb'))
-                if row.get('trakt'):
-                    processed_trakt_ids.add(row.get('trakt'))
-
-        # 循环结束补输出
-        if last_skip_reason is not None:
-            if last_skip_count > 1:
-                log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
-            else:
-                log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
-
-    # 总结
-    final_match_rate = (successful_matches / (total_items - skipped_items) * 100) if (total_items - skipped_items) > 0 else 0
-    log_print(f"\n处理完成！")
-    log_print(f"- 总条目数: {total_items}")
-    log_print(f"- 跳过条目: {skipped_items}")
-    log_print(f"- 实际处理: {total_items - skipped_items}")
-    log_print(f"- 成功匹配: {successful_matches}")
-    log_print(f"- 失败条目: {total_items - skipped_items - successful_matches}")
-    log_print(f"- 最终匹配率: {final_match_rate:.2f}%")
-    log_print(f"\n输出文件:")
-    log_print(f"- Bangumi导入CSV: {output_csv}")
-    log_print(f"- 成功匹配日志: {success_log}")
-    log_print(f"- 失败匹配日志: {failure_log}")
-
-    # 打开结果文件以便用户查看
-    try:
-        if os.name == 'nt':
-            os.system(f'start "" "{output_csv}"')
-        elif os.name == 'posix':
-            if os.system('which open > /dev/null') == 0:
-                os.system(f'open "{output_csv}"')
-            else:
-                os.system(f'xdg-open "{output_csv}" 2>/dev/null')
-    except:
-        pass
-
-    log_print("\n处理完成。按任意键退出...")
-    input()
-
-if __name__ == "__main__":
-    print("欢迎使用 Trakt-to-Bangumi 转换工具 v6.5")
-    print("https://github.com/wan0ge/Trakt-to-Bangumi")
-    print("-" * 60)
-    print("本工具将把 Trakt 导出的观看记录转换为 Bangumi 可导入格式")
-    print("请确保已在 config.ini 文件中设置了正确的 TMDB API Key 和输入文件名")
-    print(f"当前输入文件名为: {CONFIG['Files']['input_csv']}")
-    print(f"当前观看状态设定为: {CONFIG['Settings']['watch_status']}")
-    print("可用的观看状态: 想看、看过、在看、搁置、抛弃")
-    print("-" * 60)
-    confirm = input("确定要继续吗？输入 y 并回车继续，其他键退出：")
-    if confirm.lower() != 'y':
-        print("用户取消，程序退出。")
-        logging.info('========== 脚本结束 ==========')
-        exit(0)
-
-    # ====== 时间戳只生成一次 ======
-    timestamp = datetime.datetime.now().strftime("%Y%m%d")
-    convert_csv(timestamp)
+import csv
+import requests
+import datetime
+import time
+import os
+import urllib.parse
+import json
+import re
+import configparser
+import functools
+import logging
+import argparse
+import subprocess
+import sys
+import zlib
+import collections
+import contextlib
+import sqlite3
+import glob
+import gzip
+import importlib.util
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import dedup
+import profiling
+
+# ---------------------- 日志设置开始 -----------------------
+# 配置日志系统
+LOG_FILENAME = "Trakt-to-Bangumi.log"
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler(LOG_FILENAME, encoding='utf-8'),
+#        logging.StreamHandler()  # 同时在终端显示
+    ]
+)
+
+def log_print(*args, **kwargs):
+    # 日志+控制台输出，完全兼容print参数
+    msg = ' '.join(str(arg) for arg in args)
+    print(msg, **kwargs)
+    logging.info(msg)
+
+def log_error(*args, **kwargs):
+    msg = ' '.join(str(arg) for arg in args)
+    print(msg, **kwargs)
+    logging.error(msg)
+
+logging.info("========== 脚本启动 ==========")
+
+# ---------------------- 日志设置结束 -----------------------
+
+# 定义配置文件路径
+CONFIG_PATH = 'config.ini'
+
+# 读取配置文件
+def read_config():
+    config = configparser.ConfigParser()
+    
+    # 如果配置文件不存在，创建默认配置
+    if not os.path.exists(CONFIG_PATH):
+        # 使用多行字符串来保留注释
+        config_content = '''\
+#此文件用于 Trakt-to-Bangumi 转换脚本和 Bangumi2Bangumi-Csv版 导入脚本的设置
+[API]
+##必填项
+##TMDB API
+## https://www.themoviedb.org/settings/api
+tmdb_api_key = 请输入你的API Key(API密钥)
+
+##Trakt API
+##当csv中imdb id为空时将使用此项(Trakt API)反查TMDB id进行搜索匹配
+##非必填，但建议填写
+## https://trakt.tv/oauth/applications
+trakt_client_id = 请输入你的Trakt Client ID
+
+##Trakt 访问令牌，只有 trakt_source.py 直接获取观看历史和想看列表时需要
+##在上面的Trakt应用页面用设备授权(OAuth)获取: https://trakt.docs.apiary.io/#reference/authentication-devices
+trakt_access_token = 请输入你的Trakt Access Token
+
+[Files]
+##必填项
+##输入文件名
+input_csv = 请输入你的文件名.csv
+
+##输出文件名
+output_csv = bangumi_export.csv
+
+##映射数据库文件名，保存所有匹配成功的 IMDB/TMDB/Trakt ID → Bangumi 条目，之后任何文件中再遇到直接使用，不再请求API
+##首次使用时会自动导入当前目录所有success_log_*.csv，留空则不使用
+mapping_db = bangumi_mapping.db
+
+[Settings]
+##自定义最终文件状态，决定最终导入时的状态
+##可选：在看/在读/在玩/在听/看过/读过/玩过/听过/搁置/抛弃
+watch_status = 看过
+
+##true false
+##是否在转换前先用旧文件去重（效果同dedup.py，无需再单独运行），旧文件中已有的记录不会再请求API
+pre_dedup = false
+
+##去重用的旧文件或文件夹，多个用逗号分隔，文件夹会读取其中所有csv文件，不存在的路径会被忽略
+##默认为dedup.py的dedup文件夹和反向项目转换后的trakt_formatted.csv
+pre_dedup_sources = dedup, ../Bangumi to Trakt/trakt_formatted.csv
+
+##转换时在后台提前获取后面几个条目的TMDB信息，与当前条目的Bangumi搜索同时进行，0为关闭
+prefetch_rows = 3
+
+##TMDB请求的最小间隔(秒)，所有TMDB请求（包括提前获取）共用，支持小数，使用 --jobs 并行转换时由各分片进程分摊
+tmdb_interval = 0.05
+
+##API响应在映射数据库中保留的天数，超过后重新请求，0为不保存响应（只保存匹配结果）
+cache_ttl_days = 30
+
+##单个条目处理耗时超过此秒数时，记录到慢条目日志 slow_rows_*.csv（含TMDB、日文标题、每次Bangumi搜索、详情等各阶段耗时），0为关闭
+slow_row_seconds = 10
+
+
+[Matching]
+##Bangumi搜索结果的评分参数，修改后可用 python Trakt-to-Bangumi.py --rematch 对当天转换过的条目离线重新匹配（不请求API）
+##匹配分数 = 标题相似度 × title_weight + 日期分数 + 年份相同加分，达到 match_threshold 才算匹配成功
+match_threshold = 2.5
+title_weight = 5
+year_bonus = 2
+##放送日期分数，依次为：同一天、1周内、1个月内、同一年、相差一年
+date_scores = 3, 2, 1, 0.5, 0.2
+##--retry-failures 扩大搜索时使用的放宽后的日期分数
+retry_date_scores = 3, 3, 2, 1.5, 1
+
+
+[TraktSource]
+##trakt_source.py 直接从Trakt API获取记录（需要填写[API]中的trakt_client_id和trakt_access_token），每次只下载上次同步之后的新记录
+##获取的列表，多个用逗号分隔：history（观看历史）、watchlist（想看列表）
+lists = history
+
+##输出文件名，每次同步会覆盖为本次的新记录，转换观看历史时把[Files]中的input_csv设为history_csv
+history_csv = trakt_history.csv
+watchlist_csv = trakt_watchlist.csv
+
+##同步进度文件，记录每个列表已同步到的时间，删除后下次重新下载全部记录
+state_file = trakt_sync_state.json
+
+##同时下载的页数（每页100条）
+page_workers = 4
+
+
+[SyncDaemon]
+##sync_daemon.py 持续同步：定期获取Trakt新的观看历史，转换后自动导入Bangumi（使用上面[TraktSource]和下面[BangumiMigrate]的设置）
+##每轮同步的间隔(分钟)，最小为1
+interval_minutes = 10
+
+##true false
+##是否在转换后自动导入Bangumi，为false时只转换
+auto_import = true
+
+##每轮同步结果的记录文件
+state_file = sync_daemon_state.json
+
+
+[BangumiMigrate]
+##必填项
+##Bangumi API访问令牌
+## https://next.bgm.tv/demo/access-token
+access_token = 请输入你的Bangumi访问令牌
+
+##必填项
+##Bangumi导入文件名
+input_csv = bangumi_export.csv
+
+##API请求间隔时间(秒)，所有请求之间的最小间隔，支持小数
+wait_time = 0.5
+
+##同时进行的请求数
+max_workers = 4
+
+##请求失败（网络错误、限流、服务器错误）时的最大重试次数
+max_retries = 3
+
+##true false
+##是否启用断点续传，根据导入日志(import_journal_*.csv)跳过已完成的条目
+resume = true
+
+##导入统计（请求延迟、状态码、重试、吞吐量）输出到控制台的间隔(秒)，0为只在结束时输出
+metrics_interval = 30
+
+##true false
+##是否标记全部集数为看过（使用的是"看到"）
+##为true时将最后一集标记"看到"实现全部标记看过
+##为false时使用csv文件中的"看到"数值标记
+auto_complete = true
+
+'''
+        
+        # 直接写入包含注释的完整文件内容
+        with open(CONFIG_PATH, 'w', encoding='utf-8') as configfile:
+            configfile.write(config_content)
+    
+    # 读取配置文件
+    config.read(CONFIG_PATH, encoding='utf-8')
+    
+    # 确保Settings部分存在
+    if 'Settings' not in config:
+        config['Settings'] = {}
+    
+    # 确保watch_status设置存在
+    if 'watch_status' not in config['Settings']:
+        config['Settings']['watch_status'] = '看过'
+        with open(CONFIG_PATH, 'w', encoding='utf-8') as configfile:
+            config.write(configfile)
+    
+    # 旧配置文件没有 [Matching] 时使用默认评分参数
+    if 'Matching' not in config:
+        config['Matching'] = {}
+
+    return config
+
+# 全局配置对象
+CONFIG = read_config()
+
+def retry_on_network_error(max_retries=2, base_delay=1):
+    """
+    装饰器函数，用于在网络错误时进行重试
+    :param max_retries: 最大重试次数
+    :param base_delay: 基础延迟时间（秒）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            retries = 0
+            while retries < max_retries:
+                try:
+                    return func(*args, **kwargs)
+                except (requests.exceptions.Timeout, 
+                        requests.exceptions.ConnectionError,
+                        requests.exceptions.RequestException) as e:
+                    retries += 1
+                    if retries >= max_retries:
+                        log_error(f"网络错误，已达到最大重试次数 {max_retries}，放弃尝试: {str(e)}")
+                        raise
+                    
+                    wait_time = base_delay * (2 ** (retries - 1))  # 指数退避策略
+                    log_error(f"网络错误: {str(e)}，将在 {wait_time} 秒后重试 ({retries}/{max_retries-1})...")
+                    time.sleep(wait_time)
+            return None
+        return wrapper
+    return decorator
+
+class ResponseCache:
+    """
+    本次运行内的API响应缓存，键为去掉 api_key 的URL。
+    同一URL只请求一次：第一个请求者负责请求，并发的其他请求者等待同一个 Future 的结果；
+    请求抛出异常或返回 None（make_api_request 遇到429限流、网络错误等）时不缓存，
+    已在等待的请求者得到同一个结果，之后的请求者重新请求。
+    attach() 映射数据库后，内存中没有的响应先从数据库读取（未超过 ttl 秒），新请求到的非空响应写回数据库。
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store = None
+        self.ttl = 0
+
+    def attach(self, store, ttl):
+        self.store = store if ttl > 0 else None
+        self.ttl = ttl
+
+    @staticmethod
+    def key(url):
+        return re.sub(r'([?&])api_key=[^&]*&?', r'\1', url).rstrip('?&')
+
+    def get(self, key, fetch):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+        store = self.store
+        try:
+            result = store.load_response(key, self.ttl) if store else None
+            if result is None:
+                result = fetch()
+                if store and result is not None:
+                    store.save_response(key, result)
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(key, None)
+            future.set_exception(e)
+            raise
+        if result is None:
+            self.discard(key)
+        future.set_result(result)
+        return result
+
+    def discard(self, key):
+        with self._lock:
+            self._futures.pop(key, None)
+
+RESPONSE_CACHE = ResponseCache()
+
+# API地址（call_budget_check.py 会替换为本地模拟服务器）
+TMDB_API_BASE = "https://api.themoviedb.org/3"
+TRAKT_API_BASE = "https://api.trakt.tv"
+BANGUMI_API_BASE = "https://api.bgm.tv"
+
+# 实际发出的请求数（不含缓存命中），按 TMDB/Trakt/Bangumi 分别统计
+API_CALLS = collections.Counter()
+
+def api_name(url):
+    if url.startswith(TMDB_API_BASE):
+        return "TMDB"
+    if url.startswith(TRAKT_API_BASE):
+        return "Trakt"
+    if url.startswith(BANGUMI_API_BASE):
+        return "Bangumi"
+    return "其他"
+
+# 当前条目各阶段的耗时（秒），只统计转换主线程，后台提前获取的耗时不计入
+ROW_STAGES = threading.local()
+
+@contextlib.contextmanager
+def row_stage(name):
+    """记录一个处理阶段的耗时，同名阶段累加，写入慢条目日志"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = getattr(ROW_STAGES, "times", None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+class RequestLimiter:
+    """线程安全的请求间隔限制：每次请求前调用 wait()，保证请求之间至少间隔 interval 秒"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_at)
+            self._next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+# 所有TMDB请求（包括后台提前获取）共用的限速
+TMDB_LIMITER = RequestLimiter(CONFIG['Settings'].getfloat('tmdb_interval', fallback=0.05))
+
+def make_api_request(url, headers=None, timeout=10):
+    """发送API请求（经过 RESPONSE_CACHE，同一URL本次运行只请求一次）"""
+    return RESPONSE_CACHE.get(ResponseCache.key(url), lambda: fetch_api_request(url, headers, timeout))
+
+@retry_on_network_error(max_retries=3, base_delay=1)
+def fetch_api_request(url, headers=None, timeout=10):
+    """
+    发送API请求并处理响应
+    :param url: 请求URL
+    :param headers: 请求头
+    :param timeout: 超时时间（秒）
+    :return: 响应JSON或None
+    """
+    if headers is None:
+        headers = {}
+
+    name = api_name(url)
+    if name == "TMDB":
+        TMDB_LIMITER.wait()
+    API_CALLS[name] += 1
+    response = requests.get(url, headers=headers, timeout=timeout)
+    
+    # 检查状态码
+    if response.status_code != 200:
+        log_error(f"API请求失败，状态码: {response.status_code}，正在重试")
+        if response.status_code >= 500:  # 服务器错误，可能是临时的
+            raise requests.exceptions.RequestException(f"服务器错误: {response.status_code}")
+        return None  # 客户端错误或其他错误，不重试
+    
+    # 检查内容类型
+    content_type = response.headers.get('Content-Type', '')
+    if 'application/json' not in content_type.lower():
+        log_error(f"API返回了非JSON格式 (Content-Type: {content_type})")
+        # 如果响应是HTML，给出更明确的提示
+        if response.text.strip().startswith('<!DOCTYPE html>') or response.text.strip().startswith('<html'):
+            log_error("API返回了HTML页面而不是JSON数据，可能API端点已更改或服务暂时不可用")
+        return None
+    
+    # 检查响应内容是否为空
+    if not response.text.strip():
+        log_error("API返回空响应，可能是搜索条件无效")
+        return None  # 空响应，可能是合法的"无结果"，不重试
+    
+    try:
+        data = response.json()
+        return data
+    except json.JSONDecodeError as e:
+        log_error(f"JSON解析错误: {str(e)}, 响应内容: {response.text[:100]}...")
+        raise requests.exceptions.RequestException(f"JSON解析错误: {str(e)}")
+    
+    # 避免API速率限制
+    time.sleep(0.3)
+
+def get_trakt_data(trakt_id):
+    """通过Trakt API获取影视数据"""
+    # 从配置文件获取Trakt Client ID
+    trakt_client_id = CONFIG['API'].get('trakt_client_id', '')
+    
+    if not trakt_client_id or trakt_client_id == '请输入你的Trakt Client ID':
+        log_error("Trakt Client ID未配置，无法获取Trakt数据")
+        return None
+    
+    url = f"{TRAKT_API_BASE}/shows/{trakt_id}" if trakt_id else None
+    
+    if not url:
+        return None
+        
+    headers = {
+        "Content-Type": "application/json",
+        "trakt-api-version": "2",
+        "trakt-api-key": trakt_client_id
+    }
+    
+    try:
+        # 尝试获取剧集数据
+        show_data = make_api_request(url, headers, timeout=10)
+        
+        if show_data:
+            log_print(f"成功获取剧集数据: {show_data.get('title')}")
+            
+            # 从Trakt获取TMDB ID
+            tmdb_id = show_data.get("ids", {}).get("tmdb")
+            if tmdb_id:
+                # 使用TMDB ID获取详细信息
+                return get_tmdb_details(tmdb_id, "tv")
+            else:
+                log_error(f"Trakt剧集数据中没有TMDB ID")
+        else:
+            # 尝试获取电影数据
+            movie_url = f"{TRAKT_API_BASE}/movies/{trakt_id}"
+            movie_data = make_api_request(movie_url, headers, timeout=10)
+            
+            if movie_data:
+                log_print(f"成功获取电影数据: {movie_data.get('title')}")
+                
+                # 从Trakt获取TMDB ID
+                tmdb_id = movie_data.get("ids", {}).get("tmdb")
+                if tmdb_id:
+                    # 使用TMDB ID获取详细信息
+                    return get_tmdb_details(tmdb_id, "movie")
+                else:
+                    log_error(f"Trakt电影数据中没有TMDB ID")
+    except Exception as e:
+        log_error(f"Trakt API请求失败: {str(e)}")
+    
+    return None
+
+def get_tmdb_data(imdb_id):
+    """通过 TMDB API 获取影视数据"""
+    # 从配置文件获取TMDB API密钥
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    url = f"{TMDB_API_BASE}/find/{imdb_id}?api_key={tmdb_api_key}&external_source=imdb_id"
+    
+    try:
+        data = make_api_request(url, timeout=10)
+        
+        if data is None:
+            log_error(f"在TMDB中找不到imdb ID为{imdb_id}的作品")
+            return None
+            
+        # TMDB的find接口会返回电影或电视剧的结果
+        movie_results = data.get("movie_results", [])
+        tv_results = data.get("tv_results", [])
+        
+        if movie_results:
+            result = movie_results[0]
+            tmdb_id = result.get("id")
+            # 获取更详细的电影数据
+            return get_tmdb_details(tmdb_id, "movie")
+        elif tv_results:
+            result = tv_results[0]
+            tmdb_id = result.get("id")
+            # 获取更详细的电视剧数据
+            return get_tmdb_details(tmdb_id, "tv")
+        else:
+            log_error(f"在TMDB中找不到imdb ID为{imdb_id}的作品")
+            return None
+    except Exception as e:
+        log_error(f"TMDB API请求失败: {str(e)}")
+        return None
+
+def get_tmdb_details(tmdb_id, media_type):
+    """获取TMDB详细信息"""
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    url = f"{TMDB_API_BASE}/{media_type}/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=release_dates,content_ratings"
+    
+    try:
+        data = make_api_request(url, timeout=10)
+        
+        if data is None:
+            return None
+            
+        # 获取发布日期
+        released = None
+        if media_type == "movie":
+            released = data.get("release_date")
+        else:  # tv
+            released = data.get("first_air_date")
+        
+        # 获取制作国家
+        country = "unknown"
+        country_name = "未知"
+        production_countries = data.get("production_countries", [])
+        if production_countries:
+            country = production_countries[0].get("iso_3166_1", "unknown").lower()
+            country_name = production_countries[0].get("name", "未知")
+        
+        # 获取年份
+        year = None
+        if released:
+            year = int(released.split("-")[0])
+        
+        return {
+            "title": data.get("title") if media_type == "movie" else data.get("name"),
+            "released": released,
+            "country": country,
+            "country_name": country_name,
+            "year": year,
+            "tmdb_id": tmdb_id,
+            "media_type": media_type,
+            "imdb_id": data.get("imdb_id"),
+            "original_title": data.get("original_title") if media_type == "movie" else data.get("original_name")
+        }
+    except Exception as e:
+        log_error(f"获取TMDB详情失败: {str(e)}")
+        return None
+
+def get_tmdb_details_auto(tmdb_id):
+    """
+    通过tmdb_id自动判断类型查找详细信息（movie/tv）
+    优先movie，再tv（movie找不到再试tv）
+    """
+    detail = get_tmdb_details(tmdb_id, "movie")
+    if detail and detail.get("title"):
+        return detail
+    # 如果movie查不到，尝试tv
+    detail = get_tmdb_details(tmdb_id, "tv")
+    if detail and detail.get("title"):
+        return detail
+    return None
+
+# TMDB 的 append_to_response 一次最多附加 20 项
+TMDB_MAX_APPEND = 20
+
+def get_tmdb_seasons(tmdb_id, number_of_seasons=None):
+    """
+    一次请求获取剧集所有季的放送日期和日文名：/tv/{id}?language=ja&append_to_response=season/1,season/2,...
+    返回 {季号: {"air_date", "name", "episode_count"}}，同一剧集的各季共用一次请求（经过 RESPONSE_CACHE）。
+    """
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    if not number_of_seasons:
+        # 候选详情里没有季数时，使用与候选查询相同的详情URL（已缓存）
+        detail = make_api_request(f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}", timeout=10)
+        number_of_seasons = (detail or {}).get("number_of_seasons") or 0
+    if not number_of_seasons:
+        return {}
+    appended = ",".join(f"season/{n}" for n in range(1, min(number_of_seasons, TMDB_MAX_APPEND) + 1))
+    url = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja&append_to_response={appended}"
+    try:
+        data = make_api_request(url, timeout=10)
+    except Exception as e:
+        log_error(f"获取TMDB分季信息失败: {str(e)}")
+        return {}
+    if not data:
+        return {}
+
+    seasons = {}
+    # 基本信息里的 seasons 列表包含所有季（超过附加上限的季也有放送日期）
+    for item in data.get("seasons", []):
+        if item.get("season_number") is not None:
+            seasons[item["season_number"]] = {
+                "air_date": item.get("air_date"),
+                "name": item.get("name"),
+                "episode_count": item.get("episode_count"),
+            }
+    for n in range(1, min(number_of_seasons, TMDB_MAX_APPEND) + 1):
+        detail = data.get(f"season/{n}")
+        if not detail:
+            continue
+        episodes = detail.get("episodes") or []
+        # 季的放送日期缺失时用第一集的放送日期
+        air_date = detail.get("air_date") or next((ep.get("air_date") for ep in episodes if ep.get("air_date")), None)
+        seasons[n] = {
+            "air_date": air_date,
+            "name": detail.get("name"),
+            "episode_count": len(episodes) or seasons.get(n, {}).get("episode_count"),
+        }
+    return seasons
+
+def get_season_search_data(tmdb_data, season):
+    """剧集候选 + 季号 → 以该季放送日期替换 released/year 的候选副本，用于按日期匹配Bangumi中分开收录的各季"""
+    try:
+        season_number = int(season)
+    except (TypeError, ValueError):
+        return None
+    tmdb_id = tmdb_data.get("id") or tmdb_data.get("tmdb_id")
+    if season_number < 1 or not tmdb_id:
+        return None
+    info = get_tmdb_seasons(tmdb_id, tmdb_data.get("number_of_seasons")).get(season_number)
+    if not info or not info.get("air_date"):
+        return None
+    log_print(f"TMDB第{season_number}季: {info.get('name')}, 放送日期: {info['air_date']}, 集数: {info.get('episode_count')}")
+    return dict(tmdb_data, released=info["air_date"], year=int(info["air_date"][:4]), season_name=info.get("name"))
+
+def get_imdb_from_tmdb(tmdb_id, media_type='movie'):
+    """
+    通过tmdb id查imdb id，用于反查再走老流程
+    """
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    url = f"{TMDB_API_BASE}/{media_type}/{tmdb_id}?api_key={tmdb_api_key}"
+    try:
+        data = make_api_request(url, timeout=10)
+        if data and "imdb_id" in data and data["imdb_id"]:
+            return data["imdb_id"]
+    except Exception as e:
+        log_error(f"用tmdb id查imdb id失败: {str(e)}")
+    return None
+
+def get_japanese_title(tmdb_data):
+    """
+    自动用movie或tv接口，根据tmdb_data内容和类型，抓取日文标题（如果有）。
+    优先判断类型，如果没法判断则movie和tv都查一遍。
+    """
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    tmdb_id = tmdb_data.get('id') or tmdb_data.get('tmdb_id')
+    media_type = tmdb_data.get('media_type') or tmdb_data.get('type')
+
+    # 没有id直接返回None
+    if not tmdb_id:
+        return None
+
+    jp_title = None
+
+    # 先按类型查
+    if media_type == "tv" or (tmdb_data.get("name") and not tmdb_data.get("title")):
+        url = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp = make_api_request(url, timeout=10)
+        if resp and resp.get("name"):
+            jp_title = resp["name"]
+    elif media_type == "movie" or (tmdb_data.get("title") and not tmdb_data.get("name")):
+        url = f"{TMDB_API_BASE}/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp = make_api_request(url, timeout=10)
+        if resp and resp.get("title"):
+            jp_title = resp["title"]
+    else:
+        # 类型没法确定，两种都查
+        url_tv = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        url_movie = f"{TMDB_API_BASE}/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp_tv = make_api_request(url_tv, timeout=10)
+        resp_movie = make_api_request(url_movie, timeout=10)
+        if resp_tv and resp_tv.get("name"):
+            jp_title = resp_tv["name"]
+        elif resp_movie and resp_movie.get("title"):
+            jp_title = resp_movie["title"]
+
+    return jp_title
+
+def get_tmdb_japanese_title(tmdb_id, media_type):
+    """从TMDB获取日文标题"""
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    
+    url = f"{TMDB_API_BASE}/{media_type}/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+    try:
+        data = make_api_request(url, timeout=10)
+        
+        if data is None:
+            return None
+            
+        # 尝试获取日文标题
+        japanese_title = data.get("title") if media_type == "movie" else data.get("name")
+        if japanese_title and is_japanese(japanese_title):
+            return japanese_title
+        
+        # 如果主标题不是日文，检查alternative_titles
+        alt_titles_url = f"{TMDB_API_BASE}/{media_type}/{tmdb_id}/alternative_titles?api_key={tmdb_api_key}"
+        alt_data = make_api_request(alt_titles_url, timeout=10)
+        
+        if alt_data is None:
+            return None
+            
+        titles_key = "titles" if media_type == "movie" else "results"
+        for title_obj in alt_data.get(titles_key, []):
+            if title_obj.get("iso_3166_1") == "JP":
+                return title_obj.get("title") if media_type == "movie" else title_obj.get("name")
+    except Exception as e:
+        log_error(f"TMDB API请求失败: {str(e)}")
+    
+    return None
+
+def get_japanese_title(tmdb_data):
+    """
+    自动用movie或tv接口，根据tmdb_data内容和类型，抓取日文标题（如果有）。
+    优先判断类型，如果没法判断则movie和tv都查一遍。
+    """
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    tmdb_id = tmdb_data.get('id') or tmdb_data.get('tmdb_id')
+    media_type = tmdb_data.get('media_type') or tmdb_data.get('type')
+
+    # 没有id直接返回None
+    if not tmdb_id:
+        return None
+
+    jp_title = None
+
+    # 先按类型查
+    if media_type == "tv" or (tmdb_data.get("name") and not tmdb_data.get("title")):
+        url = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp = make_api_request(url, timeout=10)
+        if resp and resp.get("name"):
+            jp_title = resp["name"]
+    elif media_type == "movie" or (tmdb_data.get("title") and not tmdb_data.get("name")):
+        url = f"{TMDB_API_BASE}/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp = make_api_request(url, timeout=10)
+        if resp and resp.get("title"):
+            jp_title = resp["title"]
+    else:
+        # 类型没法确定，两种都查
+        url_tv = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        url_movie = f"{TMDB_API_BASE}/movie/{tmdb_id}?api_key={tmdb_api_key}&language=ja"
+        resp_tv = make_api_request(url_tv, timeout=10)
+        resp_movie = make_api_request(url_movie, timeout=10)
+        if resp_tv and resp_tv.get("name"):
+            jp_title = resp_tv["name"]
+        elif resp_movie and resp_movie.get("title"):
+            jp_title = resp_movie["title"]
+
+    return jp_title
+
+
+def get_best_tmdb_candidates(imdb_id=None, tmdb_id=None, csv_title=None):
+    """
+    综合IMDB ID或TMDB ID，返回优先级排序的tmdb候选详情列表（带评分）。
+    优先尝试movie、tv、find所有接口，返回所有有title/name的条目和其相似度评分。
+    """
+    from difflib import SequenceMatcher
+    tmdb_api_key = CONFIG['API']['tmdb_api_key']
+    results = []
+
+    # 1. 通过IMDB ID找tmdb（movie/tv/find）
+    if imdb_id:
+        url_find = f"{TMDB_API_BASE}/find/{imdb_id}?api_key={tmdb_api_key}&external_source=imdb_id"
+        data_find = make_api_request(url_find, timeout=10)
+        if data_find:
+            for key in ["movie_results", "tv_results"]:
+                for item in data_find.get(key, []):
+                    if item.get("id"):
+                        tmdb_type = "movie" if key == "movie_results" else "tv"
+                        url_detail = f"{TMDB_API_BASE}/{tmdb_type}/{item['id']}?api_key={tmdb_api_key}"
+                        detail = make_api_request(url_detail, timeout=10)
+                        if detail and (detail.get("title") or detail.get("name")):
+                            results.append(detail)
+    # 2. 通过TMDB ID查movie
+    if tmdb_id:
+        url_movie = f"{TMDB_API_BASE}/movie/{tmdb_id}?api_key={tmdb_api_key}"
+        data_movie = make_api_request(url_movie, timeout=10)
+        if data_movie and data_movie.get("title"):
+            results.append(data_movie)
+        url_tv = f"{TMDB_API_BASE}/tv/{tmdb_id}?api_key={tmdb_api_key}"
+        data_tv = make_api_request(url_tv, timeout=10)
+        if data_tv and data_tv.get("name"):
+            results.append(data_tv)
+        # find接口也查一下
+        url_find = f"{TMDB_API_BASE}/find/{tmdb_id}?api_key={tmdb_api_key}&external_source=tmdb_id"
+        data_find = make_api_request(url_find, timeout=10)
+        if data_find:
+            for key in ["movie_results", "tv_results"]:
+                for item in data_find.get(key, []):
+                    if item.get("id"):
+                        tmdb_type = "movie" if key == "movie_results" else "tv"
+                        url_detail = f"{TMDB_API_BASE}/{tmdb_type}/{item['id']}?api_key={tmdb_api_key}"
+                        detail = make_api_request(url_detail, timeout=10)
+                        if detail and (detail.get("title") or detail.get("name")):
+                            results.append(detail)
+
+    # 3. 去重（用id+type+title去重）
+    seen = set()
+    unique_results = []
+    for item in results:
+        key = f"{item.get('id')}_{item.get('media_type', item.get('type', ''))}_{item.get('title', item.get('name', ''))}"
+        if key not in seen:
+            unique_results.append(item)
+            seen.add(key)
+
+    # 4. 给每个候选打分
+    def tmdb_title(item):
+        return item.get('title') or item.get('name') or ''
+    candidates = []
+    if csv_title:
+        for item in unique_results:
+            score = SequenceMatcher(None, csv_title.lower(), tmdb_title(item).lower()).ratio()
+            candidates.append((score, item))
+        candidates.sort(reverse=True, key=lambda x: x[0])
+    else:
+        # 没有csv_title就不打分
+        candidates = [(1.0, item) for item in unique_results]
+    return candidates
+
+def rate_tmdb_candidate(item, csv_title):
+    """
+    根据和csv标题的相似度评分，越高越优先
+    """
+    from difflib import SequenceMatcher
+    tmdb_title = item.get('title') or item.get('name') or ''
+    return SequenceMatcher(None, csv_title.lower(), tmdb_title.lower()).ratio()
+
+
+def get_country_name(tmdb_data):
+    """
+    智能获取TMDB条目的制作地区中/英文名。
+    优先 origin_country，再 production_countries，支持movie和tv。
+    """
+    country_code = None
+    country_name = "未知"
+    # tv类型优先
+    if tmdb_data.get("origin_country"):
+        codes = tmdb_data["origin_country"]
+        if isinstance(codes, list) and codes:
+            country_code = codes[0]
+    # movie类型
+    if not country_code and tmdb_data.get("production_countries"):
+        prod = tmdb_data["production_countries"]
+        if isinstance(prod, list) and prod:
+            country_code = prod[0].get("iso_3166_1")
+            country_name = prod[0].get("name", "未知")
+    # 补充用 ISO 国家码映射
+    code_map = {
+        "JP": "Japan", "US": "United States of America", "CN": "China", "KR": "South Korea", "GB": "United Kingdom", "FR": "France",
+    }
+    if country_code:
+        country_name = code_map.get(country_code.upper(), country_code)
+    return country_name
+
+def get_media_type(tmdb_data):
+    """
+    智能获取条目类型，仅返回"tv"或"movie"。
+    "Scripted"等非标准类型一律当tv处理。
+    """
+    mtype = tmdb_data.get("media_type") or tmdb_data.get("type")
+    if mtype in ["tv", "movie"]:
+        return mtype
+    if mtype and mtype.lower() == "scripted":
+        return "tv"
+    if tmdb_data.get("name") and not tmdb_data.get("title"):
+        return "tv"
+    if tmdb_data.get("title") and not tmdb_data.get("name"):
+        return "movie"
+    return "unknown"
+
+
+def is_japanese(text):
+    """简单判断文本是否含有日文字符"""
+    # 日文字符范围（平假名、片假名、汉字部分范围）
+    japanese_pattern = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]')
+    return bool(japanese_pattern.search(text))
+
+def search_bangumi(title, japanese_title, released, year=None, record=None, wide=False, extra_titles=()):
+    """
+    通过 Bangumi API 搜索匹配的条目，优先使用日文标题。
+    record 为列表时追加本次搜索的参数和原始结果，供 --rematch 离线重新评分。
+    wide 为 True 时（--retry-failures 重试未匹配条目）额外搜索 extra_titles 和去掉括号、季号、副标题的标题变体，
+    并使用放宽日期窗口的评分参数。
+    """
+    results = []
+    
+    # 预处理标题，替换特殊符号为空格
+    def clean_title(title_str):
+        if not title_str:
+            return title_str
+        # 替换特殊符号为空格
+        cleaned = re.sub(r'[/\\:*?"<>|&#+\-\.,;=@!%\(\)\[\]\{\}]', ' ', title_str)
+        # 合并多个空格为单个空格
+        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
+        return cleaned
+    
+    # 1. 首先尝试使用日文标题搜索
+    if japanese_title and japanese_title != title:
+        # 处理标题中的特殊符号
+        clean_jp_title = clean_title(japanese_title)
+        encoded_jp_title = urllib.parse.quote(clean_jp_title)
+        
+        log_print(f"使用清理后的日文标题搜索: '{clean_jp_title}'")
+        jp_results = _search_bangumi_api(encoded_jp_title)
+        
+        if jp_results:
+            log_print(f"使用日文标题'{clean_jp_title}'搜索到 {len(jp_results)} 个结果")
+            results.extend(jp_results)
+        
+        # 尝试日文标题拆分简化搜索
+        if not jp_results and (japanese_title.find(':') > 0 or japanese_title.find('：') > 0 or 
+                              japanese_title.find('-') > 0 or japanese_title.find('～') > 0 or
+                              japanese_title.find('〜') > 0 or ' ' in japanese_title):
+            # 处理日文常见的分隔符
+            main_jp_title = japanese_title
+            for sep in [':', '：', '-', '～', '〜']:
+                if sep in main_jp_title:
+                    main_jp_title = main_jp_title.split(sep)[0]
+            
+            # 单独处理空格，因为空格可能是标题本身的一部分
+            # 只有当其他分隔符都不存在时，才考虑用空格分割
+            if main_jp_title == japanese_title and ' ' in japanese_title:
+                # 有些日文标题格式是"主标题 副标题"
+                main_jp_title = japanese_title.split(' ')[0]
+            
+            main_jp_title = clean_title(main_jp_title.strip())
+            
+            if main_jp_title != clean_jp_title:
+                log_print(f"尝试使用简化日文标题: {main_jp_title}")
+                encoded_simple_jp_title = urllib.parse.quote(main_jp_title)
+                simple_jp_results = _search_bangumi_api(encoded_simple_jp_title)
+                if simple_jp_results:
+                    log_print(f"使用简化日文标题'{main_jp_title}'搜索到 {len(simple_jp_results)} 个结果")
+                    results.extend(simple_jp_results)
+    
+    # 2. 然后使用英文标题搜索
+    clean_en_title = clean_title(title)
+    encoded_title = urllib.parse.quote(clean_en_title)
+    
+    log_print(f"使用清理后的英文标题搜索: '{clean_en_title}'")
+    eng_results = _search_bangumi_api(encoded_title)
+    
+    if eng_results:
+        log_print(f"使用英文标题'{clean_en_title}'搜索到 {len(eng_results)} 个结果")
+        results.extend(eng_results)
+    
+    # 3. 如果仍无结果，尝试英文标题拆分
+    if not results and (title.find(':') > 0 or title.find('-') > 0 or ' ' in title):
+        main_title = title
+        for sep in [':', '-']:
+            if sep in main_title:
+                main_title = main_title.split(sep)[0]
+        
+        # 如果标题中有空格，且没有其他分隔符，考虑第一个空格前的部分
+        if main_title == title and ' ' in title and len(title.split(' ')) > 1:
+            # 避免过度简化短标题
+            words = title.split(' ')
+            if len(words) > 2:  # 至少有三个词的标题才考虑简化
+                main_title = ' '.join(words[:2])  # 取前两个词
+        
+        main_title = clean_title(main_title.strip())
+        
+        if main_title != clean_en_title and len(main_title) > 3:  # 确保简化后的标题不会太短
+            log_print(f"尝试使用简化英文标题: {main_title}")
+            encoded_simple_title = urllib.parse.quote(main_title)
+            simple_results = _search_bangumi_api(encoded_simple_title)
+            if simple_results:
+                log_print(f"使用简化英文标题'{main_title}'搜索到 {len(simple_results)} 个结果")
+                results.extend(simple_results)
+    
+    # 4. 扩大搜索：其他标题变体（已搜索过的标题会直接命中缓存）
+    if wide:
+        for variant in wide_title_variants([title, japanese_title, *extra_titles], clean_title):
+            log_print(f"扩大搜索，尝试标题变体: {variant}")
+            variant_results = _search_bangumi_api(urllib.parse.quote(variant))
+            if variant_results:
+                log_print(f"使用标题变体'{variant}'搜索到 {len(variant_results)} 个结果")
+                results.extend(variant_results)
+
+    if record is not None:
+        record.append({"title": title, "japanese_title": japanese_title, "released": released, "year": year,
+                       "wide": wide, "results": results})
+
+    # 处理搜索结果
+    if results:
+        return _process_bangumi_results(results, title, japanese_title, released, year, wide_params() if wide else None)
+    
+    return None, None, None, None, 0.0  # 添加相似度分数作为返回值
+
+def wide_title_variants(titles, clean_title):
+    """扩大搜索用的标题变体：完整标题、去掉括号内容、去掉季号/Part后缀、分隔符前的主标题"""
+    variants = []
+    for t in titles:
+        if not t:
+            continue
+        no_brackets = re.sub(r'[\(（\[【].*?[\)）\]】]', ' ', t)
+        no_season = re.sub(r'\s*(season\s*\d+|\d+(st|nd|rd|th)\s+season|part\s*\d+|第\s*\S+?\s*[期季部])\s*$', '', no_brackets, flags=re.I)
+        main = re.split(r'[:：～〜]|\s-\s', no_season)[0]
+        for variant in (t, no_brackets, no_season, main):
+            variant = clean_title(variant)
+            # 与英文标题拆分相同，过短的英文变体不搜索
+            if variant and len(variant) > (1 if is_japanese(variant) else 3) and variant not in variants:
+                variants.append(variant)
+    return variants
+
+def _search_bangumi_api(encoded_title):
+    """调用Bangumi API进行搜索（结果经过 RESPONSE_CACHE，同一剧集的不同季共用搜索结果）"""
+    url = f"{BANGUMI_API_BASE}/search/subject/{encoded_title}?type=2,6&responseGroup=small"
+    with row_stage(f"Bangumi搜索'{urllib.parse.unquote(encoded_title)}'"):
+        results = RESPONSE_CACHE.get(url, lambda: _fetch_bangumi_search(url, encoded_title))
+    return [] if results is None else results
+
+def _fetch_bangumi_search(url, encoded_title):
+    """请求Bangumi搜索，请求出错时返回 None（不缓存），无结果时返回空列表"""
+    headers = {
+        "User-Agent": "wan0ge/Trakt-to-Bangumi(https://github.com/wan0ge/Trakt-to-Bangumi)",
+        "Accept": "application/json"
+    }
+    
+    try:
+        API_CALLS["Bangumi"] += 1
+        response = requests.get(url, headers=headers, timeout=10)
+        
+        # 检查响应状态码
+        if response.status_code != 200:
+            log_error(f"Bangumi API返回了非200状态码: {response.status_code}")
+            return None
+            
+        # 检查内容类型
+        content_type = response.headers.get('Content-Type', '')
+        if 'application/json' not in content_type.lower():
+            log_error(f"Bangumi API返回了非JSON格式 (Content-Type: {content_type})")
+            return []
+            
+        # 检查是否为空响应
+        if not response.text or response.text.isspace():
+            log_error(f"Bangumi API搜索无结果: '{encoded_title}'")
+            return []
+            
+        # 尝试解析JSON
+        try:
+            data = response.json()
+        except json.JSONDecodeError as e:
+            # 如果返回的不是有效的JSON格式
+            if response.text.strip().startswith('<!DOCTYPE html>') or response.text.strip().startswith('<html'):
+                log_error(f"Bangumi API返回了HTML而不是JSON (可能是网站而不是API响应)")
+            else:
+                log_error(f"Bangumi API返回了无效的JSON格式: {str(e)}")
+            return []
+        
+        # 处理有效的JSON响应
+        if isinstance(data, dict) and "list" in data:
+            return data["list"]
+        elif isinstance(data, list):
+            return data
+        else:
+            # 空结果但格式正确
+            if not data:
+                log_error(f"Bangumi API搜索无结果: '{encoded_title}'")
+                return []
+            log_error(f"Bangumi API返回了意外的数据结构：{type(data)}")
+            return []
+            
+    except requests.exceptions.RequestException as e:
+        log_error(f"Bangumi API请求出错: {str(e)}")
+        return None
+    except Exception as e:
+        log_error(f"处理Bangumi API响应时出错: {str(e)}")
+        return None
+            
+    except Exception as e:
+        # Only show generic error for non-JSON parsing errors
+        if not isinstance(e, json.JSONDecodeError):
+            log_error(f"Bangumi API请求出错: {str(e)}")
+        return []
+
+def load_match_params():
+    """从配置文件 [Matching] 读取评分参数（--rematch 时修改这些参数即可离线重新评分）"""
+    section = CONFIG['Matching']
+    date_scores = [float(x) for x in section.get('date_scores', '3, 2, 1, 0.5, 0.2').split(',') if x.strip()]
+    retry_date_scores = [float(x) for x in section.get('retry_date_scores', '3, 3, 2, 1.5, 1').split(',') if x.strip()]
+    return {
+        "match_threshold": section.getfloat('match_threshold', fallback=2.5),
+        "title_weight": section.getfloat('title_weight', fallback=5.0),
+        "year_bonus": section.getfloat('year_bonus', fallback=2.0),
+        # 依次为: 同一天、1周内、1个月内、同一年、相差一年
+        "date_scores": (date_scores + [0.0] * 5)[:5],
+        # --retry-failures 扩大搜索时使用，放宽日期窗口
+        "retry_date_scores": (retry_date_scores + [0.0] * 5)[:5],
+    }
+
+MATCH_PARAMS = load_match_params()
+
+def wide_params(params=None):
+    """扩大搜索时的评分参数：日期分数换成 retry_date_scores"""
+    params = params or MATCH_PARAMS
+    return dict(params, date_scores=params["retry_date_scores"])
+
+def score_bangumi_item(item, title, japanese_title, released, year, params=None):
+    """计算单个Bangumi搜索结果的匹配分数，返回 (分数, 标题相似度)"""
+    params = params or MATCH_PARAMS
+    bgm_title = item.get("name", "")
+    bgm_cn_title = item.get("name_cn", "")
+    bgm_date = item.get("air_date", item.get("date", ""))
+
+    score = 0
+
+    # 1. 标题匹配分数
+    en_similarity = check_title_similarity(title, bgm_title, bgm_cn_title)
+    jp_similarity = 0
+    if japanese_title:
+        jp_similarity = check_title_similarity(japanese_title, bgm_title, bgm_cn_title)
+
+    # 取最高的标题相似度
+    title_similarity = max(en_similarity, jp_similarity)
+    score += title_similarity * params["title_weight"]  # 标题相似度权重加大
+
+    # 2. 日期匹配分数
+    if bgm_date and released:
+        score += calculate_date_score(released, bgm_date, params["date_scores"])
+
+    # 3. 年份匹配额外加分
+    if year and bgm_date and len(bgm_date) >= 4 and bgm_date[:4] == str(year):
+        score += params["year_bonus"]
+
+    return score, title_similarity
+
+def _process_bangumi_results(results, title, japanese_title, released, year, params=None, verbose=True):
+    """处理Bangumi搜索结果并找出最佳匹配"""
+    params = params or MATCH_PARAMS
+    best_match = None
+    best_score = 0
+    best_similarity = 0  # 保存最佳匹配的相似度
+    bgm_cn_title = None
+    
+    for item in results:
+        bgm_id = item.get("id")
+        bgm_cn_title = item.get("name_cn", "")
+        
+        if verbose:
+            log_print(f"评估条目: ID={bgm_id}, 标题={item.get('name', '')}, 中文标题={bgm_cn_title}, 日期={item.get('air_date', item.get('date', ''))}")
+        
+        # 计算匹配分数
+        score, title_similarity = score_bangumi_item(item, title, japanese_title, released, year, params)
+        
+        if verbose:
+            log_print(f"条目 {bgm_id} 的匹配分数: {score} (标题相似度: {title_similarity})")
+        
+        # 更新最佳匹配
+        if score > best_score:
+            best_score = score
+            best_similarity = title_similarity  # 保存相似度
+            best_match = item
+    
+    # 如果最佳分数达到阈值
+    if best_match and best_score >= params["match_threshold"]:  # 调整阈值可以控制匹配的严格程度
+        if verbose:
+            log_print(f"找到最佳匹配: ID={best_match.get('id')}, Bangumi中文标题: {bgm_cn_title}, 相似度={best_score}")
+		
+        return (
+            best_match.get("id"),
+            best_match.get("name"),
+            best_match.get("name_cn", ""),
+            best_match.get("air_date", best_match.get("date", "")),  # 返回Bangumi的放送日期
+            best_similarity  # 返回最高标题相似度
+        )
+    
+    if verbose:
+        log_print(f"未找到足够可信的匹配项 (最高分数: {best_score})")
+    return None, None, None, None, 0.0
+
+def check_title_similarity(source_title, bgm_title, bgm_cn_title):
+    """检查标题相似度"""
+    from difflib import SequenceMatcher
+    
+    # 如果任一标题为空，返回0
+    if not source_title or (not bgm_title and not bgm_cn_title):
+        return 0
+    
+    # 计算与英文标题的相似度
+    similarity1 = SequenceMatcher(None, source_title.lower(), bgm_title.lower()).ratio()
+    
+    # 计算与中文标题的相似度（如果有）
+    similarity2 = 0
+    if bgm_cn_title:
+        similarity2 = SequenceMatcher(None, source_title.lower(), bgm_cn_title.lower()).ratio()
+    
+    # 返回最高相似度
+    return max(similarity1, similarity2)
+
+def calculate_date_score(tmdb_date, bgm_date, scores=None):
+    """计算日期匹配分数，日期越接近分数越高，scores 依次为同一天、1周内、1个月内、同一年、相差一年的分数"""
+    exact, week, month, same_year, next_year = scores or MATCH_PARAMS["date_scores"]
+    try:
+        tmdb_dt = datetime.datetime.strptime(tmdb_date, "%Y-%m-%d")
+        bgm_dt = datetime.datetime.strptime(bgm_date, "%Y-%m-%d")
+        diff = abs((tmdb_dt - bgm_dt).days)
+        
+        # 完全匹配（默认3分）
+        if diff == 0:
+            return exact
+        # 1周内（默认2分）
+        elif diff <= 7:
+            return week
+        # 1个月内（默认1分）
+        elif diff <= 30:
+            return month
+        # 同一年（默认0.5分）
+        elif tmdb_dt.year == bgm_dt.year:
+            return same_year
+        # 相差一年（默认0.2分）
+        elif abs(tmdb_dt.year - bgm_dt.year) == 1:
+            return next_year
+        # 其他情况得0分
+        else:
+            return 0
+    except:
+        return 0
+
+def get_bangumi_details(bgm_id):
+    """获取Bangumi条目详细信息"""
+    url = f"{BANGUMI_API_BASE}/subject/{bgm_id}?responseGroup=large"
+    
+    headers = {
+        "User-Agent": "wan0ge/Trakt-to-Bangumi(https://github.com/wan0ge/Trakt-to-Bangumi)",
+        "Accept": "application/json"
+    }
+    
+    try:
+        data = make_api_request(url, headers, timeout=10)
+        return data
+    except Exception as e:
+        log_error(f"获取Bangumi详情失败: {str(e)}")
+        return None
+
+def load_pre_deduper(fieldnames, input_csv):
+    """根据配置读取去重用的旧文件，返回 dedup.RowDeduper，未启用或没有可用旧文件时返回 None"""
+    if not CONFIG['Settings'].getboolean('pre_dedup', fallback=False):
+        return None
+    sources = [s.strip() for s in CONFIG['Settings'].get('pre_dedup_sources', '').split(',') if s.strip()]
+    old_paths = [p for p in dedup.expand_sources(sources)
+                 if os.path.abspath(p) != os.path.abspath(input_csv)]
+    if not old_paths or not fieldnames:
+        log_print("转换前去重: 未找到可用的旧文件，跳过去重")
+        return None
+    log_print(f"转换前去重: 正在读取 {len(old_paths)} 个旧文件...")
+    # 反向项目的转换文件列结构不同，借助成功日志的对照表按IMDB/TMDB/Trakt/Bangumi ID比对
+    identity_paths = [p for p in old_paths if dedup.CROSS_PLATFORM_OLD.match(os.path.basename(p))]
+    column_paths = [p for p in old_paths if p not in identity_paths]
+    try:
+        crosswalk = None
+        if identity_paths:
+            crosswalk_dirs = ['.'] + [os.path.dirname(os.path.abspath(p)) for p in identity_paths]
+            crosswalk = dedup.load_crosswalk(crosswalk_dirs)
+        deduper = dedup.RowDeduper(fieldnames, column_paths, identity_paths, crosswalk,
+                                   dedup.file_type_hint(input_csv), new_path=input_csv)
+    except Exception as e:
+        log_error(f"转换前去重读取旧文件出错，跳过去重: {str(e)}")
+        return None
+    if not deduper.filters and not deduper.identity:
+        log_print("转换前去重: 旧文件与输入文件没有可比对的列，跳过去重")
+        return None
+    log_print(f"转换前去重: 共读取 {len(deduper)} 条旧记录")
+    return deduper
+
+SEASON_COLUMNS = ("season", "season_number")
+EPISODE_COLUMNS = ("episode", "episode_number", "number")
+
+def watched_episode_count(episodes):
+    """
+    "看到"的集数：取看过的最大集数，sync_daemon.py 每轮只获取新看的几集，按不同集数计会让进度倒退；
+    集数不是数字时按看过的不同集数计，没有集数记录时为空
+    """
+    if not episodes:
+        return ""
+    try:
+        return str(max(int(float(episode)) for episode in episodes))
+    except ValueError:
+        return str(len(episodes))
+
+def update_export_rows(path, rows_by_id):
+    """用 rows_by_id 中的内容替换输出文件中相同Bangumi ID的行（保持原有顺序），先写临时文件再替换"""
+    tmp_path = path + ".tmp"
+    with open(path, newline='', encoding='utf-8') as src, open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader, None)
+        if header:
+            writer.writerow(header)
+        for row in reader:
+            if row and row[0] in rows_by_id:
+                row = [rows_by_id[row[0]].get(column, "") for column in EXPORT_COLUMNS] + row[len(EXPORT_COLUMNS):]
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+
+def aggregate_rows(reader, pre_deduper=None):
+    """
+    把逐集的观看记录按 剧集+季 合并为一组（电影和没有季/集列的文件按ID合并），每组只匹配一次。
+    返回 (分组列表, 原始记录数, 转换前去重跳过数)，每组包含首条记录、季、看过的集数和最近观看时间。
+    """
+    fieldnames = reader.fieldnames or []
+    season_col = next((c for c in SEASON_COLUMNS if c in fieldnames), None)
+    episode_col = next((c for c in EPISODE_COLUMNS if c in fieldnames), None)
+    groups = {}
+    total_rows = 0
+    deduped_rows = 0
+    for row in reader:
+        total_rows += 1
+        if pre_deduper and pre_deduper.is_duplicate(row):
+            deduped_rows += 1
+            continue
+        season = (row.get(season_col) or "").strip() if season_col else ""
+        imdb_id = (row.get("imdb") or "").strip()
+        tmdb_id = (row.get("tmdb") or "").strip()
+        trakt_id = (row.get("trakt") or "").strip()
+        if imdb_id:
+            key = ("imdb", imdb_id, season)
+        elif tmdb_id:
+            key = ("tmdb", tmdb_id, season)
+        elif trakt_id:
+            key = ("trakt", trakt_id, season)
+        elif row.get("title"):
+            key = ("title", row["title"], season)
+        else:
+            # 没有任何ID和标题的记录无法合并，单独处理
+            key = ("row", total_rows)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"row": row, "season": season, "episodes": set(), "watched_at": "", "rows": 0,
+                                   "key": key, "index": total_rows}
+        group["rows"] += 1
+        if episode_col:
+            episode = (row.get(episode_col) or "").strip()
+            if episode:
+                group["episodes"].add(episode)
+        watched_at = row.get("watched_at") or ""
+        if watched_at > group["watched_at"]:
+            group["watched_at"] = watched_at
+    return list(groups.values()), total_rows, deduped_rows
+
+def match_row(imdb_id, tmdb_id, trakt_id, csv_title, season="", wide=False):
+    """
+    查询TMDB候选并依次在Bangumi中搜索匹配，有季号的剧集按该季放送日期匹配，返回结果字典：
+    bangumi_id, bgm_jp_title, bgm_cn_title, bgm_air_date, similarity, country_name, media_type, tmdb_data, tmdb_id, failure_reason,
+    attempts（每次Bangumi搜索的参数、原始结果和对应的TMDB候选信息，写入候选日志）。
+    wide 为 True 时每次Bangumi搜索都扩大搜索（--retry-failures 重试未匹配条目）。
+    """
+    tmdb_data = None
+    failure_reason = ""
+
+    # --------- 智能优选TMDB详情 ---------
+    # 新增多候选兜底逻辑
+    tmdb_candidates = []
+    if imdb_id and imdb_id.strip():
+        log_print(f"正在使用IMDB ID处理: {imdb_id} (标题: {csv_title})")
+        with row_stage("TMDB候选"):
+            tmdb_candidates = get_best_tmdb_candidates(imdb_id=imdb_id, csv_title=csv_title)
+    elif tmdb_id and tmdb_id.strip():
+        log_print(f"没有IMDB ID，使用TMDB ID综合查movie/tv/find详情后优选: {tmdb_id} (标题: {csv_title})")
+        with row_stage("TMDB候选"):
+            tmdb_candidates = get_best_tmdb_candidates(tmdb_id=tmdb_id, csv_title=csv_title)
+    elif trakt_id and trakt_id.strip():
+        log_print(f"IMDB/TMDB ID均为空，尝试使用Trakt ID: {trakt_id} (标题: {csv_title})")
+        with row_stage("TMDB候选"):
+            tmdb_data = get_trakt_data(trakt_id)
+        tmdb_candidates = [(1.0, tmdb_data)] if tmdb_data else []
+    else:
+        failure_reason = "无有效ID字段"
+        tmdb_candidates = []
+
+    # 如果没有TMDB候选，启用兜底
+    if not tmdb_candidates:
+        tmdb_candidates = [(1.0, {
+            "title": csv_title,
+            "released": None,
+            "country": "unknown",
+            "country_name": "未知",
+            "year": None,
+            "tmdb_id": None,
+            "media_type": "unknown"
+        })]
+
+    # ------ 在这里加打印候选日志 ------
+    log_print(f"共获取到 {len(tmdb_candidates)} 个TMDB候选：")
+    for idx, (score, item) in enumerate(tmdb_candidates, 1):
+        main_title = item.get('title') or item.get('name')
+        media_type = get_media_type(item)
+        year = item.get('release_date') or item.get('first_air_date') or item.get('year')
+        candidate_id = item.get('id') or item.get('tmdb_id')
+        log_print(
+            f"  [{idx}] score={score:.3f} | type={media_type} | id={candidate_id} | year={year} | title='{main_title}'"
+        )
+    # ----------------------------------
+
+    # 按优先级依次尝试Bangumi搜索
+    # 多候选兜底Bangumi优选逻辑，确保不会重复二次匹配
+    bangumi_id = None
+    bgm_jp_title = None
+    bgm_cn_title = None
+    bgm_air_date = None
+    similarity = 0.0
+    attempts = []
+
+    for idx, (score, tmdb_data) in enumerate(tmdb_candidates):
+        main_title = tmdb_data.get("title") or tmdb_data.get("name")
+        country_name = get_country_name(tmdb_data)
+        media_type = get_media_type(tmdb_data)
+        with row_stage("日文标题"):
+            japanese_title = get_japanese_title(tmdb_data)
+        if season and media_type == "tv":
+            # Bangumi 按季分开收录，用该季的放送日期评分，同一剧集的搜索结果各季共用
+            with row_stage("分季信息"):
+                tmdb_data = get_season_search_data(tmdb_data, season) or tmdb_data
+        log_print(f"[候选{idx+1}] TMDB标题: 英文='{main_title}', 日文='{japanese_title}', score={score:.3f}, 制作地区='{country_name}', TMDB类型='{media_type}'")
+        # 只要有一个Bangumi结果就立即停止后续
+        released, year = tmdb_data.get("released"), tmdb_data.get("year")
+        if wide and not released:
+            # 扩大搜索时也用TMDB原始详情中的上映/首播日期评分
+            released = tmdb_data.get("release_date") or tmdb_data.get("first_air_date") or None
+            year = year or (released[:4] if released else None)
+        bangumi_id, bgm_jp_title, bgm_cn_title, bgm_air_date, similarity = search_bangumi(
+            main_title,
+            japanese_title,
+            released,
+            year,
+            record=attempts,
+            wide=wide,
+            extra_titles=(tmdb_data.get("original_title"), csv_title)
+        )
+        attempts[-1].update(candidate_context(tmdb_data, country_name, media_type))
+        if bangumi_id:
+            break
+
+    # 只有当所有TMDB候选都没有搜到Bangumi时，再用CSV原始标题兜底一次
+    if not bangumi_id and csv_title:
+        log_error(f"所有TMDB候选都未在Bangumi找到匹配，尝试用CSV原始标题兜底: {csv_title}")
+        bangumi_id, bgm_jp_title, bgm_cn_title, bgm_air_date, similarity = search_bangumi(
+            csv_title,
+            None,
+            None,
+            None,
+            record=attempts,
+            wide=wide
+        )
+        attempts[-1].update(candidate_context(tmdb_data, country_name, media_type))
+
+    return {
+        "bangumi_id": bangumi_id,
+        "bgm_jp_title": bgm_jp_title,
+        "bgm_cn_title": bgm_cn_title,
+        "bgm_air_date": bgm_air_date,
+        "similarity": similarity,
+        "country_name": country_name,
+        "media_type": media_type,
+        "tmdb_data": tmdb_data,
+        # 输入没有TMDB ID时记录最后尝试的候选ID，供日志和去重对照表使用
+        "tmdb_id": tmdb_id or tmdb_data.get('id') or tmdb_data.get('tmdb_id'),
+        "failure_reason": failure_reason,
+        "attempts": attempts,
+    }
+
+def candidate_context(tmdb_data, country_name, media_type):
+    """Bangumi搜索所属TMDB候选的信息，离线重新评分时用于生成输出行"""
+    return {
+        "country_name": country_name,
+        "media_type": media_type,
+        "country": tmdb_data.get("country", "unknown"),
+        "tmdb_id": tmdb_data.get('id') or tmdb_data.get('tmdb_id'),
+    }
+
+def prefetch_tmdb(imdb_id, tmdb_id, csv_title, season=""):
+    """
+    后台提前请求条目的TMDB候选、日文标题和分季信息，结果存入 RESPONSE_CACHE，
+    之后 match_row 处理到该条目时直接使用缓存（请求仍在进行时会等待同一个结果）。
+    """
+    try:
+        if imdb_id and imdb_id.strip():
+            candidates = get_best_tmdb_candidates(imdb_id=imdb_id, csv_title=csv_title)
+        elif tmdb_id and tmdb_id.strip():
+            candidates = get_best_tmdb_candidates(tmdb_id=tmdb_id, csv_title=csv_title)
+        else:
+            return
+        for _, item in candidates:
+            get_japanese_title(item)
+            item_id = item.get("id") or item.get("tmdb_id")
+            if season and item_id and get_media_type(item) == "tv":
+                get_tmdb_seasons(item_id, item.get("number_of_seasons"))
+    except Exception as e:
+        logging.debug(f"提前获取TMDB信息失败（处理到该条目时会重新请求）: {imdb_id or tmdb_id}, {str(e)}")
+
+def read_processed_ids(log_path, id_sets, label, skip_unknown=False, bangumi_ids=None):
+    """
+    读取成功/失败日志，把 (ID, 季) 加入已处理集合；没有"季"列的旧日志按整部作品处理。
+    bangumi_ids 不为 None 时同时记录成功日志中每个 ("imdb"/"tmdb"/"trakt", ID, 季) 匹配到的Bangumi ID。
+    """
+    processed_imdb_ids, processed_tmdb_ids, processed_trakt_ids = id_sets
+    with open(log_path, newline='', encoding='utf-8') as existing_log:
+        reader = csv.reader(existing_log)
+        headers = next(reader)  # 读取表头
+
+        # 检查表头是否包含Trakt ID/TMDB ID/季列
+        trakt_index = headers.index("原Trakt ID") if "原Trakt ID" in headers else -1
+        tmdb_index = headers.index("原TMDB ID") if "原TMDB ID" in headers else -1
+        season_index = headers.index("季") if "季" in headers else -1
+        bangumi_index = headers.index("匹配Bangumi ID") if "匹配Bangumi ID" in headers else -1
+
+        def valid(row, index):
+            return 0 <= index < len(row) and row[index] and not (skip_unknown and row[index] == "unknown")
+
+        for row in reader:
+            if row and len(row) > 0:  # 确保有数据
+                season = row[season_index] if 0 <= season_index < len(row) else ""
+                # 添加IMDB ID到已处理集合
+                if valid(row, 0):
+                    processed_imdb_ids.add((row[0], season))
+                if valid(row, tmdb_index):
+                    processed_tmdb_ids.add((row[tmdb_index], season))
+                # 添加Trakt ID到已处理集合(如果表头包含Trakt ID列)
+                if valid(row, trakt_index):
+                    processed_trakt_ids.add((row[trakt_index], season))
+                if bangumi_ids is not None and valid(row, bangumi_index):
+                    for kind, index in (("imdb", 0), ("tmdb", tmdb_index), ("trakt", trakt_index)):
+                        if valid(row, index):
+                            bangumi_ids[(kind, row[index], season)] = row[bangumi_index]
+
+    log_print(f"从{label}中读取到 {len(processed_imdb_ids)} 个已处理的IMDB ID")
+    log_print(f"从{label}中读取到 {len(processed_trakt_ids)} 个已处理的Trakt ID")
+
+def bangumi_category(media_type, country, is_new_format):
+    """输出文件的"类型"列"""
+    if is_new_format:
+        # 新规则：只有“动画”“电影”
+        return "电影" if media_type == "movie" else "动画"
+    # 旧规则，按国家与类型判断（如：日本tv、movie等分开）
+    if country == "jp":
+        return "动画"
+    return "剧集" if media_type == "tv" else "电影"
+
+def format_watched_date(watched_at):
+    """观看时间转为 YYYY-MM-DD，无法解析时原样返回"""
+    try:
+        return datetime.datetime.fromisoformat(watched_at.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+    except:
+        return watched_at
+
+# ---------------------- 映射数据库 -----------------------
+# 所有匹配成功的条目按 IMDB ID、TMDB 类型+ID、Trakt 类型+ID（有季号时加 #S季号）保存到 sqlite，
+# 以后任何文件再遇到同一条目时在请求 TMDB/Bangumi 之前直接得到结果。
+# 同一数据库也保存API响应（RESPONSE_CACHE 的持久层，超过 cache_ttl_days 天的响应重新请求），
+# 并可导出为压缩快照文件，在其他机器上导入或合并。
+MAPPING_COLUMNS = ["bangumi_id", "jp_title", "cn_title", "air_date", "similarity", "country_name", "media_type"]
+SNAPSHOT_FORMAT = "trakt-to-bangumi-snapshot"
+SNAPSHOT_VERSION = 1
+
+class MappingDB:
+    def __init__(self, path):
+        self.path = path
+        # 后台提前获取的线程也会通过 RESPONSE_CACHE 读写响应，所有访问都经过 _lock
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS mappings (
+            key TEXT PRIMARY KEY, bangumi_id TEXT NOT NULL, jp_title TEXT, cn_title TEXT, air_date TEXT,
+            similarity REAL, country_name TEXT, media_type TEXT, updated_at REAL)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS imported_logs (
+            path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, body TEXT NOT NULL, fetched_at REAL NOT NULL)""")
+        self.conn.commit()
+
+    @staticmethod
+    def keys(imdb_id, tmdb_id, trakt_id, season="", media_type=None):
+        """返回条目的映射键列表；类型未知时 TMDB/Trakt 键的类型为 None，查询时两种类型都查"""
+        suffix = f"#S{season}" if season else ""
+        keys = []
+        if imdb_id and imdb_id.startswith("tt"):
+            keys.append(f"imdb:{imdb_id}{suffix}")
+        for kind, value in (("tmdb", tmdb_id), ("trakt", trakt_id)):
+            value = str(value or "").strip()
+            if value and value not in ("unknown", "None", "0"):
+                if media_type in ("tv", "movie"):
+                    keys.append(f"{kind}:{media_type}:{value}{suffix}")
+                else:
+                    keys.append((f"{kind}:tv:{value}{suffix}", f"{kind}:movie:{value}{suffix}"))
+        return keys
+
+    def lookup(self, imdb_id, tmdb_id, trakt_id, season="", media_type=None):
+        """按 IMDB → TMDB → Trakt 的顺序查找，类型未知且两种类型指向不同条目时视为未找到"""
+        for key in self.keys(imdb_id, tmdb_id, trakt_id, season, media_type):
+            options = key if isinstance(key, tuple) else (key,)
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(MAPPING_COLUMNS)} FROM mappings WHERE key IN ({', '.join('?' * len(options))})",
+                    options).fetchall()
+            if rows and len({row[0] for row in rows}) == 1:
+                return dict(zip(MAPPING_COLUMNS, rows[0]))
+        return None
+
+    def store(self, keys, mapping, commit=True, replace=True, updated_at=None):
+        """
+        保存映射。replace=True 时直接覆盖；replace=False 时只补充没有的键；
+        replace="merge" 时按快照合并规则：相似度高的优先，相似度相同时较新的优先。
+        """
+        now = updated_at or time.time()
+        values = [mapping.get(col) for col in MAPPING_COLUMNS]
+        columns = ', '.join(MAPPING_COLUMNS)
+        placeholders = '?' + ', ?' * len(MAPPING_COLUMNS)
+        if replace == "merge":
+            sql = (f"INSERT INTO mappings (key, {columns}, updated_at) VALUES ({placeholders}, ?) "
+                   f"ON CONFLICT(key) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in MAPPING_COLUMNS)}, "
+                   "updated_at = excluded.updated_at "
+                   "WHERE COALESCE(excluded.similarity, 0) > COALESCE(mappings.similarity, 0) "
+                   "OR (COALESCE(excluded.similarity, 0) = COALESCE(mappings.similarity, 0) "
+                   "AND COALESCE(excluded.updated_at, 0) > COALESCE(mappings.updated_at, 0))")
+        else:
+            verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+            sql = f"{verb} INTO mappings (key, {columns}, updated_at) VALUES ({placeholders}, ?)"
+        with self._lock:
+            for key in keys:
+                if isinstance(key, tuple):
+                    continue
+                self.conn.execute(sql, [key] + values + [now])
+            if commit:
+                self.conn.commit()
+
+    def forget(self, keys, bangumi_id):
+        """删除这些键中仍指向 bangumi_id 的映射"""
+        with self._lock:
+            for key in keys:
+                if not isinstance(key, tuple):
+                    self.conn.execute("DELETE FROM mappings WHERE key = ? AND bangumi_id = ?", (key, str(bangumi_id)))
+            self.conn.commit()
+
+    def load_response(self, key, ttl):
+        """读取未过期的API响应，没有或已过期时返回 None"""
+        with self._lock:
+            row = self.conn.execute("SELECT body, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if not row or time.time() - row[1] > ttl:
+            return None
+        return json.loads(row[0])
+
+    def save_response(self, key, body, fetched_at=None, merge=False):
+        """保存API响应；merge=True 时只在比已有响应新时覆盖"""
+        sql = "INSERT INTO responses (key, body, fetched_at) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET body = excluded.body, fetched_at = excluded.fetched_at"
+        if merge:
+            sql += " WHERE excluded.fetched_at > responses.fetched_at"
+        with self._lock:
+            self.conn.execute(sql, (key, body if isinstance(body, str) else json.dumps(body, ensure_ascii=False),
+                                    fetched_at or time.time()))
+            self.conn.commit()
+
+    def import_success_logs(self, directory="."):
+        """导入目录中新增或有变化的 success_log_*.csv（首次使用时即导入全部历史日志）"""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(directory, "success_log_*.csv"))):
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            with self._lock:
+                row = self.conn.execute("SELECT size, mtime_ns FROM imported_logs WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                continue
+            try:
+                with open(path, newline='', encoding='utf-8') as f:
+                    for log_row in csv.DictReader(f):
+                        bangumi_id = (log_row.get("匹配Bangumi ID") or "").strip()
+                        if not bangumi_id:
+                            continue
+                        try:
+                            similarity = float(log_row.get("相似度") or 0)
+                        except ValueError:
+                            similarity = 0.0
+                        media_type = log_row.get("TMDB类型") or None
+                        keys = self.keys(log_row.get("原IMDB ID", ""), log_row.get("原TMDB ID", ""),
+                                         log_row.get("原Trakt ID", ""), log_row.get("季") or "", media_type)
+                        self.store(keys, {
+                            "bangumi_id": bangumi_id,
+                            "jp_title": log_row.get("匹配日文标题"),
+                            "cn_title": log_row.get("匹配中文标题"),
+                            "air_date": None,
+                            "similarity": similarity,
+                            "country_name": log_row.get("制作地区"),
+                            "media_type": media_type,
+                        }, commit=False, replace=False)
+                        imported += 1
+            except (OSError, UnicodeError, csv.Error) as e:
+                log_error(f"导入成功日志到映射数据库失败: {path}, {str(e)}")
+                continue
+            with self._lock:
+                self.conn.execute("INSERT OR REPLACE INTO imported_logs (path, size, mtime_ns) VALUES (?, ?, ?)",
+                                  (path, st.st_size, st.st_mtime_ns))
+                self.conn.commit()
+        if imported:
+            log_print(f"映射数据库: 从成功日志导入 {imported} 条匹配记录")
+
+    def export_snapshot(self, path):
+        """导出全部映射和API响应为 gzip 压缩的 JSON 快照，返回 (映射数, 响应数)"""
+        with self._lock:
+            mappings = self.conn.execute(f"SELECT key, {', '.join(MAPPING_COLUMNS)}, updated_at FROM mappings").fetchall()
+            responses = self.conn.execute("SELECT key, body, fetched_at FROM responses").fetchall()
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "mappings": [dict(zip(["key"] + MAPPING_COLUMNS + ["updated_at"], row)) for row in mappings],
+            "responses": [{"key": key, "body": json.loads(body), "fetched_at": fetched_at} for key, body, fetched_at in responses],
+        }
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return len(mappings), len(responses)
+
+    def import_snapshot(self, path):
+        """按合并规则导入快照：映射相似度高的优先、相同时较新的优先，响应较新的优先，返回 (映射数, 响应数)"""
+        snapshot = load_snapshot(path)
+        for item in snapshot["mappings"]:
+            self.store([item["key"]], item, commit=False, replace="merge", updated_at=item.get("updated_at"))
+        with self._lock:
+            self.conn.commit()
+        for item in snapshot["responses"]:
+            self.save_response(item["key"], item["body"], item.get("fetched_at"), merge=True)
+        return len(snapshot["mappings"]), len(snapshot["responses"])
+
+    def subject_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(DISTINCT bangumi_id) FROM mappings").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+def load_snapshot(path):
+    """读取并校验快照文件"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"不是有效的快照文件: {path}")
+    if snapshot.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本 {snapshot.get('version')} 高于当前支持的版本 {SNAPSHOT_VERSION}，请更新脚本: {path}")
+    snapshot.setdefault("mappings", [])
+    snapshot.setdefault("responses", [])
+    return snapshot
+
+def open_mapping_db():
+    """按配置打开映射数据库并导入新的成功日志，未配置时返回 None"""
+    path = CONFIG['Files'].get('mapping_db', '').strip()
+    if not path:
+        return None
+    try:
+        db = MappingDB(path)
+        db.import_success_logs()
+    except (sqlite3.Error, OSError) as e:
+        log_error(f"打开映射数据库失败，本次不使用: {str(e)}")
+        return None
+    log_print(f"映射数据库: {path}，已有 {db.subject_count()} 个Bangumi条目")
+    return db
+
+def run_snapshot_command(export_path=None, import_paths=(), merge_paths=()):
+    """
+    快照命令：--import-snapshot 按合并规则导入到本地映射数据库，--export-snapshot 导出本地数据库；
+    --merge-snapshots 输出 输入... 不使用本地数据库，直接把多个快照合并成一个。
+    """
+    try:
+        if merge_paths:
+            output, inputs = merge_paths[0], merge_paths[1:]
+            db = MappingDB(":memory:")
+            for path in inputs:
+                mappings, responses = db.import_snapshot(path)
+                log_print(f"读取快照 {path}: 映射 {mappings} 条，API响应 {responses} 条")
+            mappings, responses = db.export_snapshot(output)
+            log_print(f"合并后的快照已写入 {output}: 映射 {mappings} 条，API响应 {responses} 条")
+            db.close()
+            return True
+        db = open_mapping_db()
+        if db is None:
+            log_error("配置文件中未设置 mapping_db 或无法打开映射数据库")
+            return False
+        for path in import_paths:
+            mappings, responses = db.import_snapshot(path)
+            log_print(f"已导入快照 {path}: 映射 {mappings} 条，API响应 {responses} 条")
+        if export_path:
+            mappings, responses = db.export_snapshot(export_path)
+            log_print(f"快照已导出到 {export_path}: 映射 {mappings} 条，API响应 {responses} 条")
+        db.close()
+        return True
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        log_error(f"快照操作失败: {str(e)}")
+        return False
+
+# ---------------------- 映射数据库结束 -----------------------
+
+# ---------------------- 分片转换 -----------------------
+# 大量记录可以拆成 N 个分片，在多个进程或多台机器上分别转换（--shard i/N），最后用 --merge N 合并。
+# 分片按条目ID的稳定哈希分配，同一剧集的各季总在同一分片；分片输出文件最后多一列"输入序号"，合并时按输入顺序排列。
+
+def shard_suffix(shard):
+    return f"_shard{shard[0]}-{shard[1]}"
+
+def shard_path(path, shard):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}{shard_suffix(shard)}{ext}"
+
+def shard_of(group, count):
+    """按条目ID（不含季）计算稳定哈希，决定该条目属于哪个分片"""
+    key = group["key"]
+    canonical = f"{key[0]}:{key[1]}"
+    return zlib.crc32(canonical.encode("utf-8")) % count
+
+def parse_shard(value):
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("格式应为 i/N，例如 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("分片序号应满足 0 <= i < N")
+    return index, count
+
+def merge_shards(timestamp, count):
+    """
+    合并 N 个分片的结果：输出文件按输入顺序合并并去除重复的Bangumi ID（已在输出文件中的ID也跳过），
+    成功/失败日志追加到当天的日志中，合并完成后删除分片文件。
+    """
+    output_csv = CONFIG['Files']['output_csv']
+    shards = [(i, count) for i in range(count)]
+    missing = [shard_path(output_csv, shard) for shard in shards if not os.path.exists(shard_path(output_csv, shard))]
+    if missing:
+        log_error(f"缺少分片输出文件，无法合并: {', '.join(missing)}")
+        return False
+
+    # 所有分片都为空（没有表头）时使用标准表头，避免在新的输出文件中写入空行
+    header = EXPORT_COLUMNS
+    rows = []
+    for shard in shards:
+        with open(shard_path(output_csv, shard), newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            shard_header = next(reader, None)
+            if shard_header:
+                header = shard_header[:-1]
+            for row in reader:
+                if row:
+                    rows.append((int(row[-1]), row[:-1]))
+    rows.sort(key=lambda item: item[0])
+
+    seen_ids = set()
+    if os.path.exists(output_csv):
+        with open(output_csv, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            seen_ids = {row[0] for row in reader if row}
+    merged = 0
+    with open(output_csv, 'a', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        if outfile.tell() == 0:
+            writer.writerow(header)
+        for _, row in rows:
+            if row[0] in seen_ids:
+                continue
+            seen_ids.add(row[0])
+            writer.writerow(row)
+            merged += 1
+    log_print(f"合并 {count} 个分片: {len(rows)} 条结果，去除重复后写入 {merged} 条到 {output_csv}")
+
+    for log_name in (f"success_log_{timestamp}.csv", f"failure_log_{timestamp}.csv", f"slow_rows_{timestamp}.csv"):
+        shard_logs = [shard_path(log_name, shard) for shard in shards if os.path.exists(shard_path(log_name, shard))]
+        if not shard_logs:
+            continue
+        with open(log_name, 'a', newline='', encoding='utf-8') as target:
+            writer = csv.writer(target)
+            for i, shard_log in enumerate(shard_logs):
+                with open(shard_log, newline='', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    log_header = next(reader, None)
+                    if i == 0 and target.tell() == 0 and log_header:
+                        writer.writerow(log_header)
+                    writer.writerows(row for row in reader if row)
+        log_print(f"合并日志: {', '.join(shard_logs)} -> {log_name}")
+        for shard_log in shard_logs:
+            os.remove(shard_log)
+    candidates_log = f"candidates_log_{timestamp}.jsonl"
+    shard_logs = [shard_path(candidates_log, shard) for shard in shards if os.path.exists(shard_path(candidates_log, shard))]
+    if shard_logs:
+        with open(candidates_log, 'a', encoding='utf-8') as target:
+            for shard_log in shard_logs:
+                with open(shard_log, encoding='utf-8') as f:
+                    target.writelines(f)
+                os.remove(shard_log)
+    for shard in shards:
+        os.remove(shard_path(output_csv, shard))
+    return True
+
+def run_shard_jobs(timestamp, count, profile=False):
+    """
+    在本机启动 N 个子进程分别转换一个分片，全部完成后合并。
+    每个进程各自限速，子进程的TMDB请求间隔放大 N 倍，N 个进程合计仍不超过 tmdb_interval 限定的频率
+    """
+    tmdb_interval = TMDB_LIMITER.interval * count
+    log_print(f"启动 {count} 个分片进程（每个进程TMDB请求间隔 {tmdb_interval:g} 秒）...")
+    procs = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--shard", f"{i}/{count}", "--timestamp", timestamp,
+                          "--tmdb-interval", repr(tmdb_interval)]
+                         + (["--profile"] if profile else []),
+                         stdout=subprocess.DEVNULL)
+        for i in range(count)
+    ]
+    codes = [proc.wait() for proc in procs]
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        log_error(f"分片进程 {failed} 异常退出，未合并，可重新运行对应分片后使用 --merge {count} 合并")
+        return False
+    return merge_shards(timestamp, count)
+
+# ---------------------- 分片转换结束 -----------------------
+
+# ---------------------- 失败条目重试 -----------------------
+# --retry-failures 只重新处理当天失败日志中的条目：处理异常（多为网络错误）直接重试，
+# 未找到匹配项的扩大搜索（更多标题变体、放宽日期窗口）后重试，结果按正常流程写入输出文件和日志。
+
+def failure_key(imdb_id, trakt_id, title, season):
+    """失败日志行与输入条目的对应键：有IMDB/Trakt ID时按ID，否则按标题"""
+    imdb_id = "" if imdb_id == "unknown" else (imdb_id or "")
+    trakt_id = "" if trakt_id == "unknown" else (trakt_id or "")
+    return (imdb_id, trakt_id, "" if imdb_id or trakt_id else (title or ""), season or "")
+
+def log_season(header):
+    """按表头取日志行的"季"，没有"季"列的旧日志返回空（整部作品），不能用最后一列（旧日志的最后一列是TMDB类型）"""
+    index = header.index("季") if header and "季" in header else -1
+    return lambda row: row[index] if 0 <= index < len(row) else ""
+
+def log_file_season(path):
+    if not os.path.exists(path):
+        return log_season(None)
+    with open(path, newline='', encoding='utf-8') as f:
+        return log_season(next(csv.reader(f), None))
+
+def group_failure_key(group):
+    row = group["row"]
+    return failure_key(row.get("imdb", ""), row.get("trakt", ""), row.get("title", ""), group["season"])
+
+def classify_failure(reason, title):
+    """按失败原因分类：retry 直接重试，wide 扩大搜索后重试，None 不重试"""
+    if reason.startswith("处理异常"):
+        return "retry"
+    if "未找到Bangumi匹配项" in reason:
+        return "wide"
+    # 无有效ID字段：只能用标题扩大搜索
+    return "wide" if title and title != "unknown" else None
+
+def retry_failures(timestamp):
+    """读取当天失败日志，分类后只重新处理可以重试的条目"""
+    failure_log = f"failure_log_{timestamp}.csv"
+    if not os.path.exists(failure_log):
+        log_error(f"失败日志 {failure_log} 不存在")
+        return False
+    retry = {}
+    counts = {"retry": 0, "wide": 0, None: 0}
+    with open(failure_log, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        season_of = log_season(next(reader, None))
+        for row in reader:
+            if len(row) < 5:
+                continue
+            kind = classify_failure(row[4], row[3])
+            counts[kind] += 1
+            if kind:
+                retry[failure_key(row[0], row[2], row[3], season_of(row))] = kind
+    log_print(f"失败日志 {failure_log}: 处理异常直接重试 {counts['retry']} 条，未匹配扩大搜索 {counts['wide']} 条，无法重试 {counts[None]} 条")
+    if not retry:
+        return True
+    convert_csv(timestamp, interactive=False, retry=retry)
+    return True
+
+# ---------------------- 失败条目重试结束 -----------------------
+
+# ---------------------- 离线重新匹配 -----------------------
+# 转换时每个实际请求过API的条目都会把每次Bangumi搜索的参数和原始结果写入 candidates_log_日期.jsonl，
+# --rematch 按配置文件 [Matching] 中的参数离线重新评分，只改写结果有变化的条目，并生成差异报告 rematch_diff_日期.csv。
+# 只能使用当时实际进行过的搜索：原先靠前的候选已经匹配成功时，后面的候选和CSV标题兜底搜索没有记录。
+
+def record_key(record):
+    return (record.get("imdb", ""), record.get("tmdb_input", ""), record.get("trakt", ""), record.get("season", ""))
+
+def rescore_record(record, params):
+    """按新参数重新评分一条候选记录，返回 (bangumi_id, 日文标题, 中文标题, 放送日期, 相似度, 对应的搜索记录)"""
+    for attempt in record["attempts"]:
+        if not attempt["results"]:
+            continue
+        bangumi_id, jp_title, cn_title, air_date, similarity = _process_bangumi_results(
+            attempt["results"], attempt["title"], attempt["japanese_title"], attempt["released"], attempt["year"],
+            wide_params(params) if attempt.get("wide") else params, verbose=False)
+        if bangumi_id:
+            # 离线不请求Bangumi详情，没有放送日期时直接使用TMDB日期
+            return str(bangumi_id), jp_title, cn_title, air_date or attempt["released"], similarity, attempt
+    return None, None, None, None, 0.0, (record["attempts"][-1] if record["attempts"] else {})
+
+def rewrite_csv(path, drop, extra_rows):
+    """重写CSV：去掉 drop(row) 为真的行，在末尾追加 extra_rows，先写临时文件再替换"""
+    if not os.path.exists(path):
+        return
+    tmp_path = path + ".tmp"
+    with open(path, newline='', encoding='utf-8') as src, open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader, None)
+        if header:
+            writer.writerow(header)
+        writer.writerows(row for row in reader if row and not drop(row))
+        writer.writerows(extra_rows)
+    os.replace(tmp_path, path)
+
+def success_log_ids():
+    """当前目录所有成功日志（包括之前各天的）中仍在使用的Bangumi ID"""
+    ids = set()
+    for path in glob.glob("success_log_*.csv"):
+        with open(path, newline='', encoding='utf-8') as f:
+            ids.update((row.get("匹配Bangumi ID") or "").strip() for row in csv.DictReader(f))
+    ids.discard("")
+    return ids
+
+def rematch(timestamp):
+    """按当前 [Matching] 参数离线重新评分当天候选日志中的条目，改写输出文件和当天日志"""
+    output_csv = CONFIG['Files']['output_csv']
+    watch_status = CONFIG['Settings']['watch_status']
+    candidates_log = f"candidates_log_{timestamp}.jsonl"
+    success_log = f"success_log_{timestamp}.csv"
+    failure_log = f"failure_log_{timestamp}.csv"
+    diff_report = f"rematch_diff_{timestamp}.csv"
+    if not os.path.exists(candidates_log):
+        log_error(f"候选日志 {candidates_log} 不存在，只能重新匹配转换时保存过候选的条目")
+        return False
+
+    # 同一条目重复转换时以最后一次为准
+    records = {}
+    with open(candidates_log, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record_key(record)] = record
+    params = load_match_params()
+    log_print(f"离线重新匹配: {len(records)} 个条目，评分参数: {params}")
+
+    changes = []
+    for record in records.values():
+        new = rescore_record(record, params)
+        old_id = str(record["bangumi_id"]) if record.get("bangumi_id") else None
+        if new[0] != old_id:
+            changes.append((record, old_id, new))
+
+    with open(diff_report, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "季", "原Bangumi ID", "新Bangumi ID", "新匹配中文标题", "原相似度", "新相似度"])
+        for record, old_id, (new_id, _, cn_title, _, similarity, _) in changes:
+            writer.writerow([record["imdb"], record["tmdb_input"], record["trakt"], record["title"], record["season"],
+                             old_id or "", new_id or "", cn_title or "", f"{record.get('similarity') or 0:.3f}", f"{similarity:.3f}"])
+    if not changes:
+        log_print(f"所有条目的匹配结果都没有变化，差异报告: {diff_report}")
+        return True
+
+    # 改写当天日志：去掉有变化条目的旧记录，追加新结果
+    changed_keys = {(r["imdb"], r["trakt"], r["title"], r["season"]) for r, _, _ in changes}
+    success_rows, failure_rows = [], []
+    for record, _, (new_id, jp_title, cn_title, _, similarity, attempt) in changes:
+        tmdb_id = record["tmdb_input"] or attempt.get("tmdb_id") or ""
+        country_name = attempt.get("country_name", "未知")
+        media_type = attempt.get("media_type", "unknown")
+        if new_id:
+            success_rows.append([record["imdb"], tmdb_id, record["trakt"], record["title"], new_id, jp_title, cn_title,
+                                 f"{similarity:.3f}", country_name, media_type, record["season"]])
+        else:
+            failure_rows.append([record["imdb"], tmdb_id, record["trakt"], record["title"], "未找到Bangumi匹配项",
+                                 country_name, media_type, record["season"]])
+    for log_path, log_rows in ((success_log, success_rows), (failure_log, failure_rows)):
+        season_of = log_file_season(log_path)
+        rewrite_csv(log_path, lambda row: (row[0], row[2], row[3], season_of(row)) in changed_keys, log_rows)
+
+    # 改写输出文件：旧ID只有在不再被任何条目引用时才删除，新ID不在输出文件中时追加。
+    # 引用来源：候选日志中的条目（按变化后的结果）、改写后的当天成功日志（包括映射数据库命中和跳过已有ID的条目），
+    # 以及之前各天的成功日志（累计输出文件中之前转换写入的行）
+    changed_records = {id(record) for record, _, _ in changes}
+    referenced_ids = {str(r["bangumi_id"]) for r in records.values() if r.get("bangumi_id") and id(r) not in changed_records}
+    referenced_ids |= {new[0] for _, _, new in changes if new[0]}
+    referenced_ids |= success_log_ids()
+    removed_ids = {old_id for _, old_id, _ in changes if old_id and old_id not in referenced_ids}
+    existing_ids = set()
+    if os.path.exists(output_csv):
+        with open(output_csv, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            existing_ids = {row[0] for row in reader if row} - removed_ids
+    output_rows = []
+    for record, _, (new_id, jp_title, cn_title, air_date, _, attempt) in changes:
+        if not new_id or new_id in existing_ids:
+            continue
+        existing_ids.add(new_id)
+        category = bangumi_category(attempt.get("media_type"), attempt.get("country", "unknown"),
+                                    bool(record["imdb"] or record["tmdb_input"] or record["trakt"]))
+        output_rows.append([new_id, category, cn_title, jp_title, air_date, "", "", "", record["watched_eps"], watch_status,
+                            "", "", "", "", record["watched_at"], attempt.get("country_name", "未知")])
+    rewrite_csv(output_csv, lambda row: row[0] in removed_ids, output_rows)
+
+    # 同步映射数据库，避免之后的转换继续使用旧结果
+    mapping_db = open_mapping_db()
+    if mapping_db:
+        for record, old_id, (new_id, jp_title, cn_title, air_date, similarity, attempt) in changes:
+            media_type = attempt.get("media_type")
+            keys = MappingDB.keys(record["imdb"], record["tmdb_input"] or attempt.get("tmdb_id"), record["trakt"], record["season"], media_type)
+            if old_id:
+                mapping_db.forget(keys, old_id)
+            if new_id:
+                mapping_db.store(keys, {"bangumi_id": new_id, "jp_title": jp_title, "cn_title": cn_title, "air_date": air_date,
+                                        "similarity": similarity, "country_name": attempt.get("country_name"), "media_type": media_type})
+        mapping_db.close()
+
+    # 候选日志记录新结果，下次重新匹配以此为基准
+    for record, _, (new_id, _, _, _, similarity, attempt) in changes:
+        record.update(bangumi_id=new_id, similarity=similarity, tmdb_id=record["tmdb_input"] or attempt.get("tmdb_id"))
+    with open(candidates_log + ".tmp", 'w', encoding='utf-8') as f:
+        for record in records.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(candidates_log + ".tmp", candidates_log)
+
+    matched = sum(1 for _, old_id, new in changes if new[0] and not old_id)
+    unmatched = sum(1 for _, old_id, new in changes if old_id and not new[0])
+    log_print(f"\n重新匹配完成！共 {len(changes)} 个条目结果变化：")
+    log_print(f"- 新匹配成功: {matched}")
+    log_print(f"- 改为其他条目: {len(changes) - matched - unmatched}")
+    log_print(f"- 不再匹配: {unmatched}")
+    log_print(f"- 输出文件删除 {len(removed_ids)} 条，新增 {len(output_rows)} 条")
+    log_print(f"- 差异报告: {diff_report}")
+    return True
+
+# ---------------------- 离线重新匹配结束 -----------------------
+
+def log_slow_row(path, row, season, elapsed, stages):
+    """把耗时超过 slow_row_seconds 的条目写入慢条目日志，各阶段按耗时从多到少排列，"其他"为评分、写文件和请求间隔等"""
+    breakdown = sorted(stages.items(), key=lambda item: item[1], reverse=True)
+    breakdown.append(("其他", max(elapsed - sum(stages.values()), 0.0)))
+    breakdown = "; ".join(f"{name}={seconds:.2f}" for name, seconds in breakdown)
+    title = row.get("title", "")
+    log_print(f"慢条目: {title}{f' 第{season}季' if season else ''} 耗时 {elapsed:.2f} 秒（{breakdown}）")
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as slow_file:
+        writer = csv.writer(slow_file)
+        if new_file:
+            writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "季", "总耗时(秒)", "各阶段耗时(秒)"])
+        writer.writerow([row.get("imdb", ""), row.get("tmdb", ""), row.get("trakt", ""), title, season,
+                         f"{elapsed:.2f}", breakdown])
+
+# 输出文件（Bangumi导入格式）的列
+EXPORT_COLUMNS = ["ID", "类型", "中文", "日文", "放送", "排名", "评分", "话数", "看到", "状态", "标签", "我的评价", "我的简评", "私密", "更新时间", "制作地区"]
+
+def convert_csv(timestamp, shard=None, interactive=True, retry=None, on_row=None):
+    """
+    转换CSV文件为Bangumi导入格式，实时写入结果，并跳过重复项。
+    shard 为 (i, N) 时只处理属于第 i 个分片的条目，结果写入带分片后缀的输出和日志文件；
+    interactive 为 False 时不等待按键、不打开结果文件；
+    retry 为 {failure_key: "retry"/"wide"} 时只重新处理这些失败条目（见 retry_failures）；
+    on_row 为每个新写入输出文件的结果行调用一次，参数为 {列名: 值}（见 convert_and_import）。
+    """
+    # 从配置文件读取输入输出文件名
+    input_csv = CONFIG['Files']['input_csv']
+    output_csv = CONFIG['Files']['output_csv']
+
+    # 从配置文件读取自定义的观看状态
+    watch_status = CONFIG['Settings']['watch_status']
+    log_print(f"使用自定义观看状态: {watch_status}")
+
+    # 创建当天的日志文件名
+    success_log = f"success_log_{timestamp}.csv"
+    failure_log = f"failure_log_{timestamp}.csv"
+    candidates_log = f"candidates_log_{timestamp}.jsonl"
+    slow_log = f"slow_rows_{timestamp}.csv"
+    # 分片运行时也读取当天已合并的日志，合并过的条目不再重复处理
+    merged_logs = []
+    if shard:
+        merged_logs = [success_log, failure_log]
+        output_csv = shard_path(output_csv, shard)
+        success_log = shard_path(success_log, shard)
+        failure_log = shard_path(failure_log, shard)
+        candidates_log = shard_path(candidates_log, shard)
+        slow_log = shard_path(slow_log, shard)
+        log_print(f"分片模式: 第 {shard[0]} 片，共 {shard[1]} 片")
+
+    if not os.path.exists(input_csv):
+        log_error(f"文件 {input_csv} 不存在！")
+        if interactive:
+            input("按任意键退出...")
+        return
+
+    # 读取已存在的输出文件，收集已处理的Bangumi ID
+    processed_bangumi_ids = set()
+    # Bangumi ID -> 输出行，已导出的条目看到的集数增加时据此更新进度
+    exported_rows = {}
+    if os.path.exists(output_csv):
+        try:
+            with open(output_csv, newline='', encoding='utf-8') as existing_file:
+                reader = csv.reader(existing_file)
+                next(reader)  # 跳过表头
+                for row in reader:
+                    if row and row[0]:  # 确保有ID
+                        processed_bangumi_ids.add(row[0])
+                        exported_rows[row[0]] = dict(zip(EXPORT_COLUMNS, row))
+            log_print(f"从输出文件中读取到 {len(processed_bangumi_ids)} 个已处理的Bangumi ID")
+        except Exception as e:
+            log_error(f"读取已存在的输出文件时出错: {str(e)}")
+
+    # 读取已存在的成功/失败日志，收集已处理的 (IMDB/TMDB/Trakt ID, 季)
+    processed_imdb_ids = set()
+    processed_trakt_ids = set()
+    processed_tmdb_ids = set()
+    id_sets = (processed_imdb_ids, processed_tmdb_ids, processed_trakt_ids)
+    # ("imdb"/"tmdb"/"trakt", ID, 季) -> 成功日志中匹配到的Bangumi ID
+    logged_bangumi_ids = {}
+    skipped_items = 0
+
+    # 支持后续从日志自动恢复
+    for log_path in [success_log] + merged_logs[:1]:
+        if os.path.exists(log_path):
+            try:
+                read_processed_ids(log_path, id_sets, "成功日志", bangumi_ids=logged_bangumi_ids)
+            except Exception as e:
+                log_error(f"读取已存在的成功日志时出错: {str(e)}")
+
+    # 读取已存在的失败日志，也将其中的IMDB ID和Trakt ID加入已处理集合
+    for log_path in [failure_log] + merged_logs[1:]:
+        if os.path.exists(log_path):
+            try:
+                read_processed_ids(log_path, id_sets, "失败日志", skip_unknown=True)
+            except Exception as e:
+                log_error(f"读取已存在的失败日志时出错: {str(e)}")
+
+    mapping_db = open_mapping_db()
+    if mapping_db:
+        RESPONSE_CACHE.attach(mapping_db, CONFIG['Settings'].getfloat('cache_ttl_days', fallback=30) * 86400)
+    type_hint = dedup.file_type_hint(input_csv)
+
+    # 初始化输出文件，如果不存在则写入表头
+    if not os.path.exists(output_csv):
+        with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(EXPORT_COLUMNS + (["输入序号"] if shard else []))
+
+    # 初始化成功日志文件，如果不存在则写入表头
+    if not os.path.exists(success_log):
+        with open(success_log, 'w', newline='', encoding='utf-8') as success_file:
+            success_writer = csv.writer(success_file)
+            success_writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "匹配Bangumi ID", "匹配日文标题", "匹配中文标题", "相似度", "制作地区", "TMDB类型", "季"])
+
+    # 初始化失败日志文件，如果不存在则写入表头
+    if not os.path.exists(failure_log):
+        with open(failure_log, 'w', newline='', encoding='utf-8') as failure_file:
+            failure_writer = csv.writer(failure_file)
+            failure_writer.writerow(["原IMDB ID", "原TMDB ID", "原Trakt ID", "原标题", "失败原因", "制作地区", "TMDB类型", "季"])
+
+    # 读取输入文件并按 剧集+季 合并逐集记录，用于进度跟踪
+    try:
+        with open(input_csv, newline='', encoding='utf-8') as infile:
+            reader = csv.DictReader(infile)
+            pre_deduper = load_pre_deduper(reader.fieldnames, input_csv)
+            groups, total_rows, deduped_rows = aggregate_rows(reader, pre_deduper)
+    except Exception as e:
+        log_error(f"读取CSV文件出错: {str(e)}")
+        groups, total_rows, deduped_rows = [], 0, 0
+    if shard:
+        groups = [group for group in groups if shard_of(group, shard[1]) == shard[0]]
+    if retry is not None:
+        groups = [group for group in groups if group_failure_key(group) in retry]
+        # 待重试的条目从失败日志中移除并重新处理，结果按正常流程写入
+        retried = {group_failure_key(group) for group in groups}
+        season_of = log_file_season(failure_log)
+        rewrite_csv(failure_log, lambda row: failure_key(row[0], row[2], row[3], season_of(row)) in retried, [])
+        for group in groups:
+            row = group["row"]
+            for id_set, column in zip(id_sets, ("imdb", "tmdb", "trakt")):
+                # 旧日志没有"季"列，记录为 (ID, "")，同样要移除
+                id_set.discard((row.get(column, ""), group["season"]))
+                id_set.discard((row.get(column, ""), ""))
+        log_print(f"重试失败条目: 在输入文件中找到 {len(groups)} 个")
+    total_items = len(groups)
+    log_print(f"共找到 {total_rows} 条记录，合并为 {total_items} 个条目需要处理")
+    if deduped_rows:
+        log_print(f"转换前去重: 跳过旧文件中已有的记录 {deduped_rows} 条")
+
+    # -------- 合并跳过提示相关变量 --------
+    last_skip_reason = None
+    last_skip_start = None
+    last_skip_count = 0
+    # ---------------------------------------
+
+    processed_items = 0
+    successful_matches = 0
+    slow_row_seconds = CONFIG['Settings'].getfloat('slow_row_seconds', fallback=10)
+
+    progress_updates = {}
+
+    def raise_progress(bangumi_id, watched_eps, watched_at):
+        """已导出的条目看到的集数增加时更新输出行的"看到"（与已导出的进度取较大值）并交给导入，返回是否有更新"""
+        exported = exported_rows.get(str(bangumi_id)) if bangumi_id else None
+        if not exported or not watched_eps:
+            return False
+        try:
+            if int(watched_eps) <= int(float(exported.get("看到") or 0)):
+                return False
+        except ValueError:
+            return False
+        exported["看到"] = watched_eps
+        exported["更新时间"] = format_watched_date(watched_at) or exported.get("更新时间", "")
+        progress_updates[str(bangumi_id)] = exported
+        if on_row:
+            on_row(dict(exported))
+        return True
+
+    def logged_bangumi_id(row, season):
+        for kind in ("imdb", "tmdb", "trakt"):
+            value = row.get(kind, "")
+            if value:
+                bangumi_id = logged_bangumi_ids.get((kind, value, season)) or logged_bangumi_ids.get((kind, value, ""))
+                if bangumi_id:
+                    return bangumi_id
+        return None
+
+    def is_processed(row, season):
+        """返回条目在日志中已处理的 (ID类型, ID)，未处理时返回 None，按 IMDB、TMDB、Trakt 的顺序检查"""
+        # 没有"季"列的旧日志记录为 (ID, "")，表示整部作品已处理，与任何季都匹配
+        for kind, label, ids in (("imdb", "IMDB", processed_imdb_ids), ("tmdb", "TMDB", processed_tmdb_ids),
+                                 ("trakt", "Trakt", processed_trakt_ids)):
+            value = row.get(kind, "")
+            if value and ((value, season) in ids or (value, "") in ids):
+                return label, value
+        return None
+
+    # 提前获取后面 prefetch_rows 个条目的TMDB信息，与当前条目的Bangumi搜索重叠进行
+    prefetch_rows = CONFIG['Settings'].getint('prefetch_rows', fallback=3)
+    prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_rows) if prefetch_rows > 0 else None
+    next_prefetch = 1
+
+    for group in groups:
+        processed_items += 1
+        row = group["row"]
+        season = group["season"]
+
+        if prefetch_pool:
+            while next_prefetch < len(groups) and next_prefetch < processed_items + prefetch_rows:
+                ahead = groups[next_prefetch]
+                known = mapping_db and mapping_db.lookup(ahead["row"].get("imdb", ""), ahead["row"].get("tmdb", ""),
+                                                         ahead["row"].get("trakt", ""), ahead["season"], type_hint)
+                if not known and not is_processed(ahead["row"], ahead["season"]):
+                    prefetch_pool.submit(prefetch_tmdb, ahead["row"].get("imdb", ""), ahead["row"].get("tmdb", ""),
+                                         ahead["row"].get("title", ""), ahead["season"])
+                next_prefetch += 1
+
+        try:
+            imdb_id = row.get("imdb", "")  # 兼容有imdb字段
+            tmdb_id = row.get("tmdb", "")  # 新增：tmdb字段
+            trakt_id = row.get("trakt", "")  # 使用"trakt"字段
+            watched_at = group["watched_at"]  # 同组中最近一次观看时间
+            csv_title = row.get("title", "")  # 使用CSV中的标题作为备选
+            watched_eps = watched_episode_count(group["episodes"])
+            if season:
+                log_title = f"{csv_title} 第{season}季"
+            else:
+                log_title = csv_title
+
+            # 检查是否已处理过（可加去重判定）
+            processed = is_processed(row, season)
+            skip_item = processed is not None
+            skip_reason = ""
+            if skip_item:
+                skip_reason = f"跳过已处理的{processed[0]} ID: {processed[1]}"
+                if season:
+                    skip_reason += f" 第{season}季"
+            # 已处理的条目看到的集数增加（持续同步中继续观看）时不再跳过，也不重新匹配，只更新进度
+            raised_id = logged_bangumi_id(row, season) if skip_item else None
+            if raised_id and raise_progress(raised_id, watched_eps, watched_at):
+                skip_item = False
+            else:
+                raised_id = None
+
+            # -------- 合并输出跳过提示 --------
+            if skip_item:
+                # 只按"跳过类型+具体ID"合并，不包含编号
+                if skip_reason == last_skip_reason:
+                    last_skip_count += 1
+                else:
+                    if last_skip_reason is not None:
+                        if last_skip_count > 1:
+                            log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
+                        else:
+                            log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
+                    last_skip_reason = skip_reason
+                    last_skip_start = processed_items
+                    last_skip_count = 1
+                skipped_items += 1
+                continue
+
+            # 每当要真正处理新内容（非跳过）时，先输出累计跳过提示
+            if last_skip_reason is not None:
+                if last_skip_count > 1:
+                    log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
+                else:
+                    log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
+                last_skip_reason = None
+                last_skip_start = None
+                last_skip_count = 0
+
+            log_print(f"\n处理进度: [{processed_items}/{total_items}]")
+            if raised_id:
+                successful_matches += 1
+                log_print(f"{log_title} 已匹配为 Bangumi ID {raised_id}，看到的集数增加到 {watched_eps}，更新进度")
+                continue
+            if group["rows"] > 1:
+                log_print(f"合并了 {group['rows']} 条观看记录: {log_title}，看过 {watched_eps or '未知'} 集")
+
+            ROW_STAGES.times = {}
+            row_start = time.perf_counter()
+            wide = bool(retry) and retry.get(group_failure_key(group)) == "wide"
+            mapped = mapping_db.lookup(imdb_id, tmdb_id, trakt_id, season, type_hint) if mapping_db else None
+            if mapped:
+                log_print(f"映射数据库中已有: {log_title} -> Bangumi ID {mapped['bangumi_id']}，不再请求API")
+                result = {
+                    "bangumi_id": mapped["bangumi_id"],
+                    "bgm_jp_title": mapped["jp_title"],
+                    "bgm_cn_title": mapped["cn_title"],
+                    "bgm_air_date": mapped["air_date"],
+                    "similarity": mapped["similarity"] or 0.0,
+                    "country_name": mapped["country_name"] or "未知",
+                    "media_type": mapped["media_type"] or "unknown",
+                    "tmdb_data": {"released": mapped["air_date"]},
+                    "tmdb_id": tmdb_id,
+                    "failure_reason": "",
+                }
+            else:
+                result = match_row(imdb_id, tmdb_id, trakt_id, csv_title, season, wide=wide)
+                # 保存原始候选和搜索结果，之后可以用 --rematch 修改评分参数离线重新匹配
+                with open(candidates_log, 'a', encoding='utf-8') as cand_file:
+                    cand_file.write(json.dumps({
+                        "imdb": imdb_id, "tmdb_input": tmdb_id, "trakt": trakt_id, "title": csv_title, "season": season,
+                        "watched_eps": watched_eps, "watched_at": format_watched_date(watched_at),
+                        "bangumi_id": result["bangumi_id"], "similarity": result["similarity"],
+                        "tmdb_id": result["tmdb_id"], "attempts": result["attempts"],
+                    }, ensure_ascii=False) + "\n")
+            bangumi_id = result["bangumi_id"]
+            bgm_jp_title = result["bgm_jp_title"]
+            bgm_cn_title = result["bgm_cn_title"]
+            bgm_air_date = result["bgm_air_date"]
+            similarity = result["similarity"]
+            country_name = result["country_name"]
+            media_type = result["media_type"]
+            tmdb_data = result["tmdb_data"]
+            tmdb_id = result["tmdb_id"]
+
+            if not bangumi_id:
+                failure_reason = result["failure_reason"] or ("未找到Bangumi匹配项（已扩大搜索）" if wide else "未找到Bangumi匹配项")
+                log_error(f"仍未找到 Bangumi 匹配项，记录失败日志。")
+
+                with open(failure_log, 'a', newline='', encoding='utf-8') as failure_file:
+                    failure_writer = csv.writer(failure_file)
+                    failure_writer.writerow([imdb_id, tmdb_id, trakt_id, csv_title, failure_reason, country_name, media_type, season])
+
+                if imdb_id:
+                    processed_imdb_ids.add((imdb_id, season))
+                if tmdb_id:
+                    processed_tmdb_ids.add((tmdb_id, season))
+                if trakt_id:
+                    processed_trakt_ids.add((trakt_id, season))
+                continue
+
+            if bangumi_id in processed_bangumi_ids:
+                if raise_progress(bangumi_id, watched_eps, watched_at):
+                    # 已导出的条目看到的集数增加，只更新进度
+                    successful_matches += 1
+                    log_print(f"{log_title} 的 Bangumi ID {bangumi_id} 已在输出文件中，看到的集数增加到 {watched_eps}，更新进度")
+                else:
+                    skip_msg = f"跳过已处理的Bangumi ID: {bangumi_id}"
+                    if skip_msg == last_skip_reason:
+                        last_skip_count += 1
+                    else:
+                        if last_skip_reason is not None:
+                            if last_skip_count > 1:
+                                log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
+                            else:
+                                log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
+                        last_skip_reason = skip_msg
+                        last_skip_start = processed_items
+                        last_skip_count = 1
+                    skipped_items += 1
+
+                with open(success_log, 'a', newline='', encoding='utf-8') as success_file:
+                    success_writer = csv.writer(success_file)
+                    success_writer.writerow([
+                        imdb_id, tmdb_id, trakt_id, csv_title, bangumi_id, bgm_jp_title, bgm_cn_title,
+                        f"{similarity:.3f}", country_name, media_type, season
+                    ])
+                if imdb_id:
+                    processed_imdb_ids.add((imdb_id, season))
+                if tmdb_id:
+                    processed_tmdb_ids.add((tmdb_id, season))
+                if trakt_id:
+                    processed_trakt_ids.add((trakt_id, season))
+                continue
+
+            # 每当要真正处理新内容（非跳过）时，先输出累计跳过提示（保证Bangumi ID跳过也能合并输出）
+            if last_skip_reason is not None:
+                if last_skip_count > 1:
+                    log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items-1}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
+                else:
+                    log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
+                last_skip_reason = None
+                last_skip_start = None
+                last_skip_count = 0
+
+            # Bangumi 放送日期补全
+            if not bgm_air_date:
+                log_print("未从搜索结果获取到Bangumi放送日期，尝试获取详细信息...")
+                with row_stage("Bangumi详情"):
+                    bgm_details = get_bangumi_details(bangumi_id)
+                if bgm_details:
+                    bgm_air_date = bgm_details.get("air_date", "")
+                    log_print(f"从Bangumi详情获取到放送日期: {bgm_air_date}")
+
+            # 如果仍然没有Bangumi放送日期，则使用TMDB日期作为备选
+            if not bgm_air_date:
+                log_print("未获取到Bangumi放送日期，使用TMDB日期作为备选")
+                bgm_air_date = tmdb_data.get("released")
+
+            successful_matches += 1
+
+            if mapping_db:
+                mapping_db.store(MappingDB.keys(imdb_id, tmdb_id, trakt_id, season, media_type), {
+                    "bangumi_id": str(bangumi_id),
+                    "jp_title": bgm_jp_title,
+                    "cn_title": bgm_cn_title,
+                    "air_date": bgm_air_date,
+                    "similarity": similarity,
+                    "country_name": country_name,
+                    "media_type": media_type,
+                })
+
+            # 记录成功日志
+            with open(success_log, 'a', newline='', encoding='utf-8') as success_file:
+                success_writer = csv.writer(success_file)
+                success_writer.writerow([
+                    imdb_id, tmdb_id, trakt_id, csv_title, bangumi_id, bgm_jp_title, bgm_cn_title,
+                    f"{similarity:.3f}", country_name, media_type, season
+                ])
+
+            processed_bangumi_ids.add(bangumi_id)
+            if imdb_id:
+                processed_imdb_ids.add((imdb_id, season))
+            if tmdb_id:
+                processed_tmdb_ids.add((tmdb_id, season))
+            if trakt_id:
+                processed_trakt_ids.add((trakt_id, season))
+
+            category = bangumi_category(media_type, tmdb_data.get("country", "unknown"), bool(imdb_id or tmdb_id or trakt_id))
+
+            # 格式化观看日期 (如果需要转换格式)
+            formatted_watched_at = format_watched_date(watched_at)
+
+            # 实时写入匹配结果到输出文件（看到=同组看过的不同集数）
+            export_row = [bangumi_id, category, bgm_cn_title, bgm_jp_title, bgm_air_date, "", "", "", watched_eps, watch_status, "", "", "", "", formatted_watched_at, country_name]
+            with open(output_csv, 'a', newline='', encoding='utf-8') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(export_row + ([group["index"]] if shard else []))
+            exported_rows[str(bangumi_id)] = {column: "" if value is None else str(value) for column, value in zip(EXPORT_COLUMNS, export_row)}
+            if on_row:
+                on_row(dict(exported_rows[str(bangumi_id)]))
+
+            log_print(f"成功转换并写入: {log_title} -> Bangumi: {bgm_cn_title}, 放送日期: {bgm_air_date}, 制作地区: {country_name}, TMDB类型: {media_type}")
+
+            # 显示当前进度和匹配率
+            current_match_rate = (successful_matches / (processed_items - skipped_items) * 100) if (processed_items - skipped_items) > 0 else 0
+            log_print(f"当前匹配率: {current_match_rate:.2f}% ({successful_matches}/{processed_items - skipped_items})")
+
+            time.sleep(0.3)  # 避免 API 速率限制
+
+        except Exception as e:
+            log_error(f"转换时出错: {str(e)}")
+            with open(failure_log, 'a', newline='', encoding='utf-8') as failure_file:
+                failure_writer = csv.writer(failure_file)
+                failure_writer.writerow([
+                    row.get('imdb', 'unknown'),
+                    row.get('tmdb', 'unknown'),
+                    row.get('trakt', 'unknown'),
+                    row.get('title', 'unknown'),
+                    f"处理异常: {str(e)}",
+                    row.get('country_name', '未知'),
+                    row.get('media_type', 'unknown'),
+                    season
+                ])
+            with open('error_log.txt', 'a', encoding='utf-8') as error_log:
+                error_log.write(f"处理失败 [{processed_items}/{total_items}]: IMDB ID={row.get('imdb', 'unknown')}, TMDB ID={row.get('tmdb', 'unknown')}, Trakt ID={row.get('trakt', 'unknown')}, 标题={row.get('title', 'unknown')}, 季={season}, 错误: {str(e)}\n")
+                import traceback
+                error_log.write(traceback.format_exc() + "\n\n")
+            if row.get('imdb'):
+                processed_imdb_ids.add((row.get('imdb'), season))
+            if row.get('tmdb'):
+                processed_tmdb_ids.add((row.get('tmdb'), season))
+            if row.get('trakt'):
+                processed_trakt_ids.add((row.get('trakt'), season))
+        finally:
+            stages, ROW_STAGES.times = getattr(ROW_STAGES, "times", None), None
+            if stages is not None and slow_row_seconds > 0:
+                elapsed = time.perf_counter() - row_start
+                if elapsed >= slow_row_seconds:
+                    log_slow_row(slow_log, row, season, elapsed, stages)
+
+    if prefetch_pool:
+        # 取消还没开始的提前获取并等待正在进行的结束，之后才能关闭映射数据库、统计请求数，
+        # 持续同步时也不会有上一轮的请求混进下一轮
+        prefetch_pool.shutdown(wait=True, cancel_futures=True)
+    if mapping_db:
+        RESPONSE_CACHE.attach(None, 0)
+        mapping_db.close()
+    if progress_updates:
+        update_export_rows(output_csv, progress_updates)
+
+    # 循环结束补输出
+    if last_skip_reason is not None:
+        if last_skip_count > 1:
+            log_print(f"处理进度: [{last_skip_start}/{total_items}~{processed_items}/{total_items}] - {last_skip_reason} ×{last_skip_count}")
+        else:
+            log_print(f"处理进度: [{last_skip_start}/{total_items}] - {last_skip_reason}")
+
+    # 总结
+    final_match_rate = (successful_matches / (total_items - skipped_items) * 100) if (total_items - skipped_items) > 0 else 0
+    log_print(f"\n处理完成！")
+    log_print(f"- 原始记录数: {total_rows}")
+    log_print(f"- 转换前去重: {deduped_rows}")
+    log_print(f"- 总条目数: {total_items}")
+    log_print(f"- 跳过条目: {skipped_items}")
+    log_print(f"- 实际处理: {total_items - skipped_items}")
+    log_print(f"- 成功匹配: {successful_matches}")
+    if progress_updates:
+        log_print(f"- 更新进度: {len(progress_updates)}")
+    log_print(f"- 失败条目: {total_items - skipped_items - successful_matches}")
+    log_print(f"- 最终匹配率: {final_match_rate:.2f}%")
+    log_print(f"- API请求数: TMDB {API_CALLS['TMDB']}, Trakt {API_CALLS['Trakt']}, Bangumi {API_CALLS['Bangumi']}（缓存命中 {RESPONSE_CACHE.hits}）")
+    log_print(f"\n输出文件:")
+    log_print(f"- Bangumi导入CSV: {output_csv}")
+    log_print(f"- 成功匹配日志: {success_log}")
+    log_print(f"- 失败匹配日志: {failure_log}")
+
+    if not interactive:
+        return
+
+    # 打开结果文件以便用户查看
+    try:
+        if os.name == 'nt':
+            os.system(f'start "" "{output_csv}"')
+        elif os.name == 'posix':
+            if os.system('which open > /dev/null') == 0:
+                os.system(f'open "{output_csv}"')
+            else:
+                os.system(f'xdg-open "{output_csv}" 2>/dev/null')
+    except:
+        pass
+
+    log_print("\n处理完成。按任意键退出...")
+    input()
+
+# ---------------------- 转换的同时导入 -----------------------
+# --import 把每个新匹配的条目通过队列直接交给 BangumiMigrate-Csv-Pro.py 的导入调度器，
+# 不必等全部转换完成再运行导入脚本，输出文件和日志照常写入
+
+def load_importer():
+    """加载 BangumiMigrate-Csv-Pro.py（文件名带连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(
+        "bangumi_migrate", os.path.join(os.path.dirname(os.path.abspath(__file__)), "BangumiMigrate-Csv-Pro.py"))
+    importer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(importer)
+    # 导入脚本的具名日志器只记录导入相关的内容，转换过程仍 print 到控制台并写入本脚本的日志
+    importer.setup_logging()
+    return importer
+
+def convert_and_import(timestamp, importer, import_config):
+    """
+    转换的同时导入：TMDB/Bangumi搜索的等待与收藏、进度请求重叠进行。
+    本次转换写入或更新进度的条目随转换逐个提交；输出文件中之前已有的条目在转换结束后提交（导入日志会跳过已完成的），
+    其中本次已经提交过的Bangumi ID不再提交，避免同一条目同时运行两个导入任务、旧行的"看到"覆盖新进度。
+    """
+    output_csv = CONFIG['Files']['output_csv']
+    existing = []
+    if os.path.exists(output_csv):
+        with open(output_csv, newline='', encoding='utf-8') as f:
+            existing = list(csv.DictReader(f))
+    pending = queue.Queue()
+
+    def rows():
+        submitted = set()
+        for row in iter(pending.get, None):
+            submitted.add(row.get("ID"))
+            yield row
+        for row in existing:
+            if row.get("ID") not in submitted:
+                yield row
+
+    worker = threading.Thread(target=importer.import_rows, name="Importer",
+                              args=(import_config, rows(), importer.journal_path_for(os.path.abspath(output_csv))))
+    worker.start()
+    try:
+        convert_csv(timestamp, interactive=False, on_row=pending.put)
+    finally:
+        pending.put(None)
+        log_print("转换结束，等待导入完成...")
+        worker.join()
+
+# ---------------------- 转换的同时导入结束 -----------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trakt-to-Bangumi 转换工具")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N", help="只转换第 i 个分片（共 N 片，i 从 0 开始），结果写入分片文件")
+    parser.add_argument("--merge", type=int, metavar="N", help="合并 N 个分片的结果到输出文件和当天日志")
+    parser.add_argument("--jobs", type=int, metavar="N", help="在本机启动 N 个分片进程并行转换，完成后自动合并")
+    parser.add_argument("--tmdb-interval", type=float, metavar="SECONDS", help="TMDB请求的最小间隔（秒），覆盖配置文件的 tmdb_interval（--jobs 启动分片进程时自动传入）")
+    parser.add_argument("--timestamp", help="日志文件日期（默认今天，格式 YYYYMMDD），分片和合并需一致")
+    parser.add_argument("--retry-failures", action="store_true", help="只重新处理当天失败日志中的条目，未匹配的扩大搜索范围")
+    parser.add_argument("--rematch", action="store_true", help="按配置文件 [Matching] 的评分参数离线重新匹配当天候选日志中的条目，不请求API")
+    parser.add_argument("--export-snapshot", metavar="FILE", help="把映射数据库中的映射和API响应导出为快照文件")
+    parser.add_argument("--import-snapshot", metavar="FILE", nargs="+", help="把快照文件合并导入映射数据库")
+    parser.add_argument("--merge-snapshots", metavar="FILE", nargs="+", help="输出文件 输入文件...：把多个快照合并为一个")
+    parser.add_argument("--profile", action="store_true", help="性能分析：结束时写入 profile_*.prof（cProfile）和 profile_*.folded（火焰图）")
+    parser.add_argument("--import", dest="stream_import", action="store_true", help="转换的同时导入Bangumi（使用配置文件 [BangumiMigrate] 的设置）")
+    args = parser.parse_args()
+    if args.stream_import and (args.jobs or args.shard):
+        parser.error("--import 不能与 --jobs、--shard 同时使用")
+    if args.tmdb_interval is not None:
+        TMDB_LIMITER.interval = args.tmdb_interval
+    if args.profile:
+        profiling.start_profiling("Trakt-to-Bangumi" + (shard_suffix(args.shard) if args.shard else ""))
+    # ====== 时间戳只生成一次 ======
+    timestamp = args.timestamp or datetime.datetime.now().strftime("%Y%m%d")
+
+    if args.shard:
+        convert_csv(timestamp, shard=args.shard, interactive=False)
+        logging.info('========== 脚本结束 ==========')
+        sys.exit(0)
+    if args.merge:
+        ok = merge_shards(timestamp, args.merge)
+        logging.info('========== 脚本结束 ==========')
+        sys.exit(0 if ok else 1)
+    if args.retry_failures:
+        ok = retry_failures(timestamp)
+        logging.info('========== 脚本结束 ==========')
+        sys.exit(0 if ok else 1)
+    if args.rematch:
+        ok = rematch(timestamp)
+        logging.info('========== 脚本结束 ==========')
+        sys.exit(0 if ok else 1)
+    if args.export_snapshot or args.import_snapshot or args.merge_snapshots:
+        if args.merge_snapshots and len(args.merge_snapshots) < 2:
+            parser.error("--merge-snapshots 需要一个输出文件和至少一个输入文件")
+        ok = run_snapshot_command(args.export_snapshot, args.import_snapshot or (), args.merge_snapshots or ())
+        logging.info('========== 脚本结束 ==========')
+        sys.exit(0 if ok else 1)
+
+    print("欢迎使用 Trakt-to-Bangumi 转换工具 v6.5")
+    print("https://github.com/wan0ge/Trakt-to-Bangumi")
+    print("-" * 60)
+    print("本工具将把 Trakt 导出的观看记录转换为 Bangumi 可导入格式")
+    print("请确保已在 config.ini 文件中设置了正确的 TMDB API Key 和输入文件名")
+    print(f"当前输入文件名为: {CONFIG['Files']['input_csv']}")
+    print(f"当前观看状态设定为: {CONFIG['Settings']['watch_status']}")
+    print("可用的观看状态: 想看、看过、在看、搁置、抛弃")
+    if args.stream_import:
+        print("转换的同时导入Bangumi，导入设置见 config.ini 的 [BangumiMigrate] 部分")
+    print("-" * 60)
+    confirm = input("确定要继续吗？输入 y 并回车继续，其他键退出：")
+    if confirm.lower() != 'y':
+        print("用户取消，程序退出。")
+        logging.info('========== 脚本结束 ==========')
+        exit(0)
+
+    if args.jobs and args.jobs > 1:
+        run_shard_jobs(timestamp, args.jobs, profile=args.profile)
+    elif args.stream_import:
+        importer = load_importer()
+        import_config = importer.load_config()
+        if importer.check_config(import_config):
+            convert_and_import(timestamp, importer, import_config)
+        log_print("\n处理完成。按任意键退出...")
+        input()
+    else:
+        convert_csv(timestamp)
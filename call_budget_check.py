@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+API请求数检查：用本地模拟的 TMDB/Trakt/Bangumi 服务器运行 Trakt-to-Bangumi.py 的 match_row，
+检查每个典型场景实际发出的请求数是否与 CALL_BUDGETS 一致，不一致时以非0退出码结束。
+修改 get_best_tmdb_candidates、get_japanese_title、search_bangumi 等函数后运行：
+
+    python call_budget_check.py
+
+请求数有意变化（比如新增了一次必要的查询）时，确认后更新 CALL_BUDGETS。
+"""
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 场景 -> (match_row 参数, 期望匹配的Bangumi ID, 期望请求数)
+CALL_BUDGETS = {
+    "只有IMDB ID":     (("tt0000101", "", "", "Frieren"), 301, {"TMDB": 3, "Trakt": 0, "Bangumi": 2}),
+    "只有TMDB ID":     (("", "101", "", "Frieren"), 301, {"TMDB": 4, "Trakt": 0, "Bangumi": 2}),
+    "只有Trakt ID":    (("", "", "5101", "Frieren"), 301, {"TMDB": 2, "Trakt": 1, "Bangumi": 2}),
+    "只有标题":        (("", "", "", "葬送のフリーレン"), 301, {"TMDB": 0, "Trakt": 0, "Bangumi": 1}),
+    "日文标题命中":    (("tt0000102", "", "", "Bocchi the Rock!"), 302, {"TMDB": 3, "Trakt": 0, "Bangumi": 2}),
+    "拆分日文标题命中": (("tt0000103", "", "", "Attack on Titan The Final Season"), 303, {"TMDB": 3, "Trakt": 0, "Bangumi": 3}),
+    "无匹配":          (("tt0000104", "", "", "Unknown Show"), None, {"TMDB": 3, "Trakt": 0, "Bangumi": 2}),
+}
+
+# 模拟数据：TMDB剧集 {id: (英文名, 日文名, 首播日期)}，Bangumi条目 {搜索词: [条目]}
+TMDB_SHOWS = {
+    101: ("Frieren", "葬送のフリーレン", "2023-09-29"),
+    102: ("Bocchi the Rock!", "ぼっち・ざ・ろっく！", "2022-10-09"),
+    103: ("Attack on Titan The Final Season", "進撃の巨人 The Final Season", "2020-12-07"),
+    104: ("Unknown Show", "謎の番組", "2021-01-01"),
+}
+TRAKT_SHOWS = {5101: 101}
+BANGUMI_SUBJECTS = {
+    "葬送のフリーレン": [{"id": 301, "name": "葬送のフリーレン", "name_cn": "葬送的芙莉莲", "air_date": "2023-09-29"}],
+    "Frieren": [{"id": 301, "name": "葬送のフリーレン", "name_cn": "葬送的芙莉莲", "air_date": "2023-09-29"}],
+    "ぼっち・ざ・ろっく！": [{"id": 302, "name": "ぼっち・ざ・ろっく！", "name_cn": "孤独摇滚！", "air_date": "2022-10-09"}],
+    "進撃の巨人": [{"id": 303, "name": "進撃の巨人 The Final Season", "name_cn": "进击的巨人 最终季", "air_date": "2020-12-07"}],
+}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """按路径前缀 /tmdb、/trakt、/bgm 模拟三个API，只实现 Trakt-to-Bangumi.py 用到的接口"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        parts = [urllib.parse.unquote(p) for p in parsed.path.strip("/").split("/")]
+        body = None
+        if parts[0] == "tmdb":
+            body = self.tmdb(parts[1:], query)
+        elif parts[0] == "trakt" and len(parts) == 3 and parts[1] == "shows" and int(parts[2]) in TRAKT_SHOWS:
+            body = {"title": TMDB_SHOWS[TRAKT_SHOWS[int(parts[2])]][0], "ids": {"tmdb": TRAKT_SHOWS[int(parts[2])]}}
+        elif parts[0] == "bgm" and len(parts) == 4 and parts[1:3] == ["search", "subject"]:
+            body = {"list": BANGUMI_SUBJECTS.get(parts[3], [])}
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+            return
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def tmdb(self, parts, query):
+        if parts[0] == "find" and query.get("external_source") == ["imdb_id"]:
+            show_id = int(parts[1][2:]) if parts[1].startswith("tt") else 0
+            return {"movie_results": [], "tv_results": [{"id": show_id}] if show_id in TMDB_SHOWS else []}
+        if parts[0] == "find":
+            return {"movie_results": [], "tv_results": []}
+        if parts[0] == "tv" and int(parts[1]) in TMDB_SHOWS:
+            name, ja_name, first_air_date = TMDB_SHOWS[int(parts[1])]
+            if len(parts) == 3 and parts[2] == "alternative_titles":
+                return {"results": []}
+            data = {"id": int(parts[1]), "name": ja_name if query.get("language") == ["ja"] else name,
+                    "original_name": ja_name, "first_air_date": first_air_date,
+                    "production_countries": [{"iso_3166_1": "JP", "name": "Japan"}]}
+            return data
+        return None
+
+def load_converter(base_url):
+    """在临时目录中导入 Trakt-to-Bangumi.py（配置和日志文件写在临时目录），API地址指向模拟服务器"""
+    os.chdir(tempfile.mkdtemp(prefix="call_budget_"))
+    sys.path.insert(0, SCRIPT_DIR)
+    spec = importlib.util.spec_from_file_location("trakt_to_bangumi", os.path.join(SCRIPT_DIR, "Trakt-to-Bangumi.py"))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    logging.disable(logging.CRITICAL)
+    module.TMDB_API_BASE = f"{base_url}/tmdb"
+    module.TRAKT_API_BASE = f"{base_url}/trakt"
+    module.BANGUMI_API_BASE = f"{base_url}/bgm"
+    module.CONFIG['API']['tmdb_api_key'] = "budget-check"
+    module.CONFIG['API']['trakt_client_id'] = "budget-check"
+    module.TMDB_LIMITER.interval = 0
+    return module
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    converter = load_converter(f"http://127.0.0.1:{server.server_address[1]}")
+
+    failed = 0
+    print(f"{'场景':<14}{'TMDB':>10}{'Trakt':>10}{'Bangumi':>10}  结果")
+    for scenario, (args, expected_id, budget) in CALL_BUDGETS.items():
+        converter.RESPONSE_CACHE = converter.ResponseCache()
+        converter.API_CALLS.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = converter.match_row(*args)
+        calls = {name: converter.API_CALLS[name] for name in budget}
+        problems = [f"{name} {calls[name]}≠{budget[name]}" for name in budget if calls[name] != budget[name]]
+        matched = int(result["bangumi_id"]) if result["bangumi_id"] else None
+        if matched != expected_id:
+            problems.append(f"匹配到 {matched}，应为 {expected_id}")
+        failed += bool(problems)
+        cells = "".join(f"{f'{calls[name]}/{budget[name]}':>10}" for name in ("TMDB", "Trakt", "Bangumi"))
+        print(f"{scenario:<14}{cells}  {'; '.join(problems) or 'OK'}")
+
+    server.shutdown()
+    if failed:
+        print(f"\n{failed} 个场景的请求数或匹配结果与预期不一致")
+        sys.exit(1)
+    print("\n所有场景的请求数都符合预期")
+
+if __name__ == "__main__":
+    main()
@@ -1,381 +1,1378 @@
-# -*- coding: utf-8 -*-
-import csv
-import os
-import shlex
-import logging
-import shutil
-import re
-import difflib
-from datetime import date, datetime
-
-# 日志配置
-title = 'dedup.log'
-logging.basicConfig(
-    filename=title,
-    filemode='a',
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    level=logging.INFO
-)
-logging.info('脚本启动')
-
-# 可选依赖：用于更智能的编码检测
-try:
-    import chardet
-    logging.info('检测到 chardet，可进行高级编码检测')
-except ImportError:
-    chardet = None
-    logging.info('未安装 chardet，仅使用 BOM 检测')
-
-
-def detect_encoding(path, sample_size=8192):
-    logging.info(f'开始检测编码: {path}')
-    try:
-        with open(path, 'rb') as f:
-            raw = f.read(sample_size)
-    except Exception as e:
-        logging.error(f'读取文件二进制失败: {path}, 错误: {e}')
-        return 'utf-8'
-    # BOM 检测
-    boms = [
-        (b"\xff\xfe\x00\x00", 'utf-32'),
-        (b"\x00\x00\xfe\xff", 'utf-32-be'),
-        (b"\xff\xfe", 'utf-16'),
-        (b"\xfe\xff", 'utf-16-be'),
-        (b"\xef\xbb\xbf", 'utf-8-sig'),
-    ]
-    for bom, enc in boms:
-        if raw.startswith(bom):
-            logging.info(f'检测到 BOM 编码: {enc} ({path})')
-            return enc
-    if chardet:
-        result = chardet.detect(raw)
-        enc = result.get('encoding')
-        logging.info(f'chardet 检测结果: {enc}, 置信度: {result.get("confidence")}')
-        if enc and enc.lower() != 'ascii':
-            return enc
-    return 'utf-8'
-
-
-# 新增：获取新旧文件共同且非忽略的列名
-def get_common_cols(headers):
-    """
-    输入多个header（如[新, 旧1, 旧2]），返回它们共同拥有且不在ignore_cols的列名（顺序按新文件header顺序）。
-    """
-    sets = [set(h) for h in headers]
-    common = set.intersection(*sets)
-    #这里可以自定义需要忽略的值，内容以逗号隔开，例如"watched_at"（imdb文件观看时间值） "看到"（Bangumi进度值） ,"","" 
-    ignore_cols = {"中文","日文","放送","排名","评分","话数","标签","我的评价","我的简评","私密","更新时间","watched_at"}
-    common = [col for col in headers[0] if col in common and col not in ignore_cols]
-    return common
-
-# 修改：deduplicate 支持指定用哪些列去比对
-def deduplicate(old_paths, encoding, use_cols):
-    keys = set()
-    for p in old_paths:
-        logging.info(f'读取旧文件: {p}')
-        with open(p, newline='', encoding=encoding) as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            # 找出当前旧文件header中共同需要对比的列索引
-            col_indices = [i for i, col in enumerate(header) if col in use_cols]
-            for row in reader:
-                keys.add(tuple(row[i] for i in col_indices))
-        logging.info(f'累计键数: {len(keys)}')
-    return keys
-
-# 修改：filter_new_lines 也只比对用共同列
-def filter_new_lines(new_path, keys, encoding, use_cols):
-    logging.info(f'过滤新文件: {new_path}')
-    with open(new_path, 'r', encoding=encoding, newline='') as f:
-        lines = f.readlines()
-    reader = csv.reader(lines)
-    header = next(reader)
-    raw_header = ''.join(lines[:reader.line_num]).lstrip('\ufeff')
-    col_indices = [i for i, col in enumerate(header) if col in use_cols]
-
-    kept = []
-    prev = reader.line_num
-    for row in reader:
-        curr = reader.line_num
-        record = ''.join(lines[prev:curr])
-        prev = curr
-        key = tuple(row[i] for i in col_indices)
-        if key not in keys:
-            kept.append(record)
-    logging.info(f'保留行数: {len(kept)}')
-    return raw_header, kept
-
-# 修改：主流程中自动获得共同列并传递
-def process_batch_auto(old_paths, new_path):
-    logging.info('模式1: 自动模式开始处理')
-    enc_new = detect_encoding(new_path)
-    enc_old = detect_encoding(old_paths[0])
-    # 1. 先读取新旧文件header
-    with open(new_path, encoding=enc_new) as f:
-        header_new = next(csv.reader(f))
-    headers_old = []
-    for op in old_paths:
-        with open(op, encoding=enc_old) as f:
-            headers_old.append(next(csv.reader(f)))
-    # 2. 求新旧文件共同列
-    use_cols = get_common_cols([header_new] + headers_old)
-    # 3. 按共同列做去重
-    keys = deduplicate(old_paths, enc_old, use_cols)
-    header, kept = filter_new_lines(new_path, keys, enc_new, use_cols)
-
-    # 输出结果文件
-    ds = f"{date.today().month:02d}.{date.today().day:02d}"
-    base = os.path.splitext(os.path.basename(new_path))[0]
-    out_name = f"{base}_New_{ds}.csv"
-    out_path = os.path.join(os.path.dirname(new_path), out_name)
-    with open(out_path, 'w', encoding=enc_new, newline='') as f:
-        f.write(header)
-        f.writelines(kept)
-    print(f"去重完成: {out_path}")
-    logging.info(f'生成去重文件: {out_path} (编码:{enc_new})')
-
-    # 移动或重命名原文件到 dedup 目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    de_dup_dir = os.path.join(script_dir, "dedup")
-    os.makedirs(de_dup_dir, exist_ok=True)
-    stem = os.path.splitext(os.path.basename(new_path))[0]
-    if re.search(r"(?:_\d{2}\.\d{2})$|(?:_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$", stem):
-        dest_name = os.path.basename(new_path)
-    else:
-        ctime = os.path.getctime(new_path)
-        dt = datetime.fromtimestamp(ctime)
-        ct_suffix = f"{dt.month:02d}.{dt.day:02d}"
-        ext = os.path.splitext(new_path)[1]
-        dest_name = f"{stem}_{ct_suffix}{ext}"
-    dest = os.path.join(de_dup_dir, dest_name)
-    shutil.move(new_path, dest)
-    os.utime(dest, None)
-    print(f"已移动原文件到: {dest}")
-    logging.info(f'原文件移动/重命名: {dest_name}')
-
-def process_batch_manual(old_paths, new_path):
-    logging.info('模式2: 手动模式开始处理')
-    enc_new = detect_encoding(new_path)
-    enc_old = detect_encoding(old_paths[0])
-    # 1. 先读取新旧文件header
-    with open(new_path, encoding=enc_new) as f:
-        header_new = next(csv.reader(f))
-    headers_old = []
-    for op in old_paths:
-        with open(op, encoding=enc_old) as f:
-            headers_old.append(next(csv.reader(f)))
-    # 2. 求新旧文件共同列
-    use_cols = get_common_cols([header_new] + headers_old)
-    # 3. 按共同列做去重
-    keys = deduplicate(old_paths, enc_old, use_cols)
-    header, kept = filter_new_lines(new_path, keys, enc_new, use_cols)
-
-    # 输出结果文件
-    ds = f"{date.today().month:02d}.{date.today().day:02d}"
-    base = os.path.splitext(os.path.basename(new_path))[0]
-    out_name = f"{base}_New_{ds}.csv"
-    out_path = os.path.join(os.path.dirname(new_path), out_name)
-    with open(out_path, 'w', encoding=enc_new, newline='') as f:
-        f.write(header)
-        f.writelines(kept)
-    print(f"去重完成: {out_path}")
-    logging.info(f'手动模式生成去重文件: {out_path}')
-
-def auto_select_files():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    logging.info(f'模式1日志调试: dedup 目录自动选择，脚本目录={script_dir}')
-    de_dup_dir = os.path.join(script_dir, "dedup")
-    if not os.path.isdir(de_dup_dir):
-        os.makedirs(de_dup_dir, exist_ok=True)
-        print(f"未找到目录: {de_dup_dir}，已自动创建。请将旧文件放入后重试。")
-        logging.info(f'已创建缺失目录: {de_dup_dir}')
-        return []
-
-    old_files = [os.path.join(de_dup_dir, f) for f in os.listdir(de_dup_dir) if f.lower().endswith('.csv')]
-    new_files = [os.path.join(script_dir, f) for f in os.listdir(script_dir)
-                 if f.lower().endswith('.csv') and "_New_" not in f]
-
-    if not old_files:
-        print(f"在目录 {de_dup_dir} 中未找到任何 CSV 文件，请先放入旧文件。")
-        return []
-    if not new_files:
-        print(f"在脚本目录未找到任何新 CSV 文件。")
-        return []
-
-    # 基于相似度匹配新旧文件
-    def clean(name):
-        s = name
-        # 去除 MM.DD 日期后缀
-        s = re.sub(r'_(\d{2}\.\d{2})$', '', s)
-        # 去除完整时间戳后缀 YYYY-MM-DD_HH-MM-SS
-        s = re.sub(r'_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$', '', s)
-        # 去除带点的数字序号后缀，如 _9 或 _2 或 _09.04
-        s = re.sub(r'_[0-9]+(?:\.[0-9]+)*$', '', s)
-        # 去除纯数字点数字后缀，如 1.12 或 2.3.4
-        s = re.sub(r'[0-9]+(?:\.[0-9]+)+$', '', s)
-        return s
-
-    mapping = {}
-    threshold = 0.85
-    for old in old_files:
-        key = clean(os.path.splitext(os.path.basename(old))[0])
-        best_ratio, best_new = 0, None
-        for new in new_files:
-            new_key = clean(os.path.splitext(os.path.basename(new))[0])
-            ratio = difflib.SequenceMatcher(None, key, new_key).ratio()
-            if ratio > best_ratio or (
-               ratio == best_ratio and os.path.getmtime(new) > os.path.getmtime(best_new or new)
-            ):
-                best_ratio, best_new = ratio, new
-        if best_ratio >= threshold:
-            mapping.setdefault(best_new, []).append(old)
-            logging.info(f'匹配成功: {old} -> {best_new}, 相似度 {best_ratio:.2f}')
-        else:
-            logging.info(f'旧文件 {old} 无匹配的新文件 (最高相似度 {best_ratio:.2f})')
-    return [(olds, new) for new, olds in mapping.items()]
-
-def auto_select_special():
-    """特殊模式：扫描脚本所在目录的特定新文件，并在兄弟文件夹根目录中扫描特定旧文件"""
-    logging.info('模式3: 进入特殊模式 auto_select_special')
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    parent_dir = os.path.dirname(script_dir)
-    folder = os.path.basename(script_dir)
-    # 根据脚本目录选择不同的新文件模式
-    if folder == "Bangumi to Trakt":
-        sibling = "Trakt To Bangumi"
-        # 仅匹配 Bangumi 相关文件
-        new_patterns = [
-            re.compile(r".*Bangumi.*\.csv", re.IGNORECASE)
-        ]
-    elif folder == "Trakt To Bangumi":
-        sibling = "Bangumi to Trakt"
-        # 仅匹配 export_*_(history|watchlist).* 文件
-        new_patterns = [
-            re.compile(r"export_(?:movies|shows|episodes)_(?:history|watchlist).*\.csv", re.IGNORECASE)
-        ]
-    else:
-        logging.error(f'未知脚本目录名称: {folder}')
-        print(f"未知脚本目录名称: {folder}")
-        return []
-    sibling_root = os.path.join(parent_dir, sibling)
-    logging.info(f'特殊模式目录信息: script_dir={script_dir}, sibling_root={sibling_root}')
-    if not os.path.isdir(sibling_root):
-        logging.error(f'未找到目录: {sibling_root}')
-        print(f"未找到目录: {sibling_root}")
-        return []
-
-    # 匹配新文件
-    logging.info(f'使用的新文件匹配正则: {[p.pattern for p in new_patterns]}')
-    new_files = [os.path.join(script_dir, f) for f in os.listdir(script_dir)
-                 if any(pat.match(f) for pat in new_patterns) and "_New_" not in f]
-    logging.info(f'匹配到的新文件: {new_files}')
-    if not new_files:
-        logging.warning('未找到符合条件的新文件。')
-        print("未找到符合条件的新文件。")
-        return []
-
-    # 匹配旧文件：根据当前目录选择不同的旧文件
-    old_files = []
-    if folder == "Bangumi to Trakt":
-        # 在 sibling_root 中匹配 bangumi_export.csv
-        logging.info('特殊模式: 匹配旧文件 bangumi_export.csv')
-        for f in os.listdir(sibling_root):
-            if re.match(r"bangumi_export\.csv$", f, re.IGNORECASE):
-                old_files.append(os.path.join(sibling_root, f))
-    else:  # Trakt To Bangumi
-        logging.info('特殊模式: 匹配旧文件 trakt_formatted.csv 和 temp_trakt_formatted.csv')
-        for fname in ["trakt_formatted.csv", "temp_trakt_formatted.csv"]:
-            path = os.path.join(sibling_root, fname)
-            if os.path.isfile(path):
-                old_files.append(path)
-    logging.info(f'匹配到的旧文件: {old_files}')
-    if not old_files:
-        logging.warning('未找到符合条件的旧文件。')
-        print("未找到符合条件的旧文件。")
-        return []
-
-    # 多对一：所有新文件共用同一组旧文件
-    pairs = [(old_files, new) for new in new_files]
-    logging.info(f'特殊模式匹配完成: {pairs}')
-    return pairs
-
-
-def main():
-    print("欢迎使用 Bangumi-to-Trakt 、 Trakt-to-Bangumi 项目专用去重脚本 v8.9")
-    print("https://github.com/wan0ge/Bangumi-to-Trakt")
-    print("https://github.com/wan0ge/Trakt-to-Bangumi")
-    print("-" * 60)
-    print("请选择模式")
-    print("模式1: 自动选择文件：根据dedup文件夹内的旧文件自动选择脚本目录的新文件 去重后自动移动原至dedup")
-    print("模式2: 手动选择文件：手动输入新旧文件路径，支持拖拽，多个旧文件用空格或逗号分隔，不移动原文件")
-    print("模式3: 特殊选择模式：自动选择脚本目录特定新文件，并在兄弟文件夹匹配特定旧文件（使用反向项目对面平台转换后的文件作为旧文件去重）")
-    print("-" * 60)
-
-    while True:
-        mode = input("选择模式 (1=自动, 2=手动, 3=特殊, 其他退出): ").strip()
-        if mode == '1':
-            logging.info('用户选择模式1')
-            pairs = auto_select_files()
-            if not pairs:
-                print("文件选择失败，返回模式选择。")
-                continue
-            print("检测到以下待处理文件对：")
-            for i, (olds, new) in enumerate(pairs, 1):
-                print(f"  {i}. 旧文件:")
-                for old in olds:
-                    print(f"    {old}")
-                print(f"    新文件: {new}")
-            if input("全部确认并去重? (y/n): ").strip().lower() == 'y':
-                for olds, new in pairs:
-                    try:
-                        process_batch_auto(olds, new)
-                    except Exception as e:
-                        print(f"{olds} -> {new} 处理失败: {e}")
-
-        elif mode == '2':
-            logging.info('用户选择模式2')
-            inp = input("输入旧文件列表 (空格或逗号分隔): ").strip()
-            if not inp:
-                break
-            old_paths = shlex.split(inp.replace(',', ' '))
-            new_path = input("输入新文件路径: ").strip().strip("'\"")
-            if not new_path:
-                break
-            print(f"准备去重:\n  旧文件: {old_paths}\n  新文件: {new_path}")
-            if input("确认? (y/n): ").strip().lower() == 'y':
-                try:
-                    process_batch_manual(old_paths, new_path)
-                except Exception as e:
-                    print(f"失败: {e}")
-
-        elif mode == '3':
-            logging.info('用户选择模式3')
-            pairs = auto_select_special()
-            if not pairs:
-                print("文件选择失败，返回模式选择。")
-                continue
-            print("检测到以下待处理文件对：")
-            for i, (olds, new) in enumerate(pairs, 1):
-                print(f"  {i}. 旧文件:")
-                for old in olds:
-                    print(f"    {old}")
-                print(f"    新文件: {new}")
-            if input("全部确认并去重? (y/n): ").strip().lower() == 'y':
-                for olds, new in pairs:
-                    try:
-                        process_batch_manual(olds, new)
-                    except Exception as e:
-                        print(f"{olds} -> {new} 处理失败: {e}")
-        else:
-            break
-
-        if input("继续下一批? (y/n): ").strip().lower() != 'y':
-            break
-
-    print("结束")
-    logging.info('脚本结束')
-
-
-if __name__ == '__main__':
-    main()
+# -*- coding: utf-8 -*-
+import csv
+import codecs
+import mmap
+import os
+import shlex
+import logging
+import shutil
+import re
+import difflib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import heapq
+import io
+import json
+import tempfile
+from array import array
+from datetime import date, datetime
+from itertools import accumulate
+
+# 日志配置：只在作为脚本运行时写入 dedup.log，被其他脚本导入时沿用调用方的日志设置
+title = 'dedup.log'
+
+def setup_logging():
+    logging.basicConfig(
+        filename=title,
+        filemode='a',
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO
+    )
+
+# 可选依赖：用于更智能的编码检测
+try:
+    import chardet
+except ImportError:
+    chardet = None
+
+
+def detect_encoding(path, sample_size=8192):
+    logging.info(f'开始检测编码: {path}')
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read(sample_size)
+    except Exception as e:
+        logging.error(f'读取文件二进制失败: {path}, 错误: {e}')
+        return 'utf-8'
+    # BOM 检测
+    boms = [
+        (b"\xff\xfe\x00\x00", 'utf-32'),
+        (b"\x00\x00\xfe\xff", 'utf-32-be'),
+        (b"\xff\xfe", 'utf-16'),
+        (b"\xfe\xff", 'utf-16-be'),
+        (b"\xef\xbb\xbf", 'utf-8-sig'),
+    ]
+    for bom, enc in boms:
+        if raw.startswith(bom):
+            logging.info(f'检测到 BOM 编码: {enc} ({path})')
+            return enc
+    if chardet:
+        result = chardet.detect(raw)
+        enc = result.get('encoding')
+        logging.info(f'chardet 检测结果: {enc}, 置信度: {result.get("confidence")}')
+        if enc and enc.lower() != 'ascii':
+            return enc
+    return 'utf-8'
+
+
+# 新增：获取新旧文件共同且非忽略的列名
+def get_common_cols(headers):
+    """
+    输入多个header（如[新, 旧1, 旧2]），返回它们共同拥有且不在ignore_cols的列名（顺序按新文件header顺序）。
+    """
+    sets = [set(h) for h in headers]
+    common = set.intersection(*sets)
+    #这里可以自定义需要忽略的值，内容以逗号隔开，例如"watched_at"（imdb文件观看时间值） "看到"（Bangumi进度值） ,"","" 
+    ignore_cols = {"中文","日文","放送","排名","评分","话数","标签","我的评价","我的简评","私密","更新时间","watched_at"}
+    common = [col for col in headers[0] if col in common and col not in ignore_cols]
+    return common
+
+# 旧文件键集合预计占用的内存上限（MB），超过时自动改用磁盘外排序模式去重，内存较小的机器可以调低
+MEMORY_BUDGET_MB = 512
+
+# 比对列的值之间的分隔符（不会出现在正常CSV内容中）
+KEY_SEPARATOR = '\x1f'
+MASK64 = (1 << 64) - 1
+
+def key_indices(header, use_cols):
+    """返回 use_cols 中每一列在 header 中的下标，不存在的列为 None"""
+    positions = {}
+    for i, col in enumerate(header):
+        positions.setdefault(col, i)
+    return [positions.get(col) for col in use_cols]
+
+def row_key(row, col_indices):
+    """按 use_cols 的顺序取出比对列的值（去除首尾空白），保证新旧文件列顺序不同也能对上"""
+    return [row[i].strip() if i is not None and i < len(row) else '' for i in col_indices]
+
+def key_fingerprint(values):
+    """把比对列的值归一化后计算 128 位 blake2b 指纹，返回 (高64位, 低64位)"""
+    value = int.from_bytes(hashlib.blake2b(KEY_SEPARATOR.join(values).encode('utf-8'), digest_size=16).digest(), 'big')
+    return value >> 64, value & MASK64
+
+class KeyStore:
+    """
+    紧凑的旧文件键集合：每个键只保存 128 位指纹，放在两个 array('Q') 组成的开放寻址哈希表中
+    （按低64位定位槽位，线性探测，装载率不超过一半），成员判断只需一次探测序列，平均一两个槽位。
+    每个键约占 32~64 字节，而完整字符串元组的 set 每个键要数百字节；空槽用 (0, 0) 表示。
+    两个不同的键只有在 128 位指纹完全相同时才会被误判为重复。
+    """
+    MIN_CAPACITY = 1024
+
+    def __init__(self, expected=0):
+        capacity = self.MIN_CAPACITY
+        while capacity < expected * 2:
+            capacity *= 2
+        self._allocate(capacity)
+        self.count = 0
+        self.has_zero = False
+
+    def _allocate(self, capacity):
+        self.hi = array('Q', bytes(8 * capacity))
+        self.lo = array('Q', bytes(8 * capacity))
+        self.mask = capacity - 1
+
+    def add(self, fingerprint):
+        h, l = fingerprint
+        if not (h or l):
+            # 全0指纹与空槽无法区分，单独记录
+            if not self.has_zero:
+                self.has_zero = True
+                self.count += 1
+            return
+        hi, lo, mask = self.hi, self.lo, self.mask
+        i = l & mask
+        while True:
+            x = lo[i]
+            if x == l:
+                if hi[i] == h:
+                    return
+            elif not x and not hi[i]:
+                break
+            i = (i + 1) & mask
+        hi[i] = h
+        lo[i] = l
+        self.count += 1
+        if self.count * 2 > mask + 1:
+            self._grow()
+
+    def _grow(self):
+        """容量翻倍后重新放入所有键，只在两个表之间复制，不产生整数列表"""
+        old_hi, old_lo = self.hi, self.lo
+        self._allocate(len(old_hi) * 2)
+        self.count = int(self.has_zero)
+        self._insert_slots(old_hi, old_lo)
+
+    def _insert_slots(self, src_hi, src_lo):
+        for h, l in zip(src_hi, src_lo):
+            if h or l:
+                self.add((h, l))
+
+    def update(self, other):
+        """合并另一个 KeyStore 的全部键"""
+        self._insert_slots(other.hi, other.lo)
+        if other.has_zero:
+            self.add((0, 0))
+        return self
+
+    def __contains__(self, fingerprint):
+        h, l = fingerprint
+        if not (h or l):
+            return self.has_zero
+        hi, lo, mask = self.hi, self.lo, self.mask
+        i = l & mask
+        while True:
+            x = lo[i]
+            if x == l:
+                if hi[i] == h:
+                    return True
+            elif not x and not hi[i]:
+                return False
+            i = (i + 1) & mask
+
+    def __len__(self):
+        return self.count
+
+def is_byte_safe(encoding):
+    """判断编码中引号和换行是否只以单字节出现（UTF-16/32 以外的常见编码都满足），满足时可直接在字节流中切分记录"""
+    return not codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32'))
+
+def iter_record_spans(buf, start=0):
+    """从 start 开始，在字节缓冲区中逐条返回CSV记录的 (起始, 结束) 位置，引号内的换行不算记录结束"""
+    size = len(buf)
+    while start < size:
+        scan = start
+        quotes = 0
+        while True:
+            nl = buf.find(b'\n', scan)
+            end = size if nl == -1 else nl + 1
+            quotes += buf[scan:end].count(b'"')
+            scan = end
+            if quotes % 2 == 0 or end == size:
+                break
+        yield start, end
+        start = end
+
+def parse_record(text):
+    """解析单条CSV记录，不含引号的记录直接按逗号拆分"""
+    if '"' not in text:
+        return text.rstrip('\r\n').split(',')
+    return next(csv.reader([text]), [])
+
+# 按块解析记录时每块读取的字节数
+RECORD_CHUNK_SIZE = 1 << 22
+
+def iter_chunk_rows(buf, start, encoding):
+    """
+    从 start 开始按块解析字节缓冲区中的CSV记录，逐条返回 (记录结束位置, 字段列表)。
+    块的边界在字节层面确定：用 rfind 退到块内最后一个换行，引号数为奇数（边界落在引号内）时继续退到上一个换行；
+    整块一次性解码后交给同一个 csv.reader，记录结束位置由 reader.line_num 和每行字节长度的累加值换算，
+    不再逐条查找换行、切片和解码。
+    """
+    size = len(buf)
+    chunk_size = RECORD_CHUNK_SIZE
+    while start < size:
+        stop = min(size, start + chunk_size)
+        if stop < size:
+            stop = buf.rfind(b'\n', start, stop) + 1
+        chunk = buf[start:stop] if stop > start else b''
+        quotes = chunk.count(b'"')
+        while quotes % 2 and start < stop < size:
+            cut = chunk.rfind(b'\n', 0, len(chunk) - 1) + 1
+            quotes -= chunk.count(b'"', cut)
+            chunk = chunk[:cut]
+            stop = start + cut
+        if stop <= start:
+            # 一条记录比整块还长，扩大块重新读取
+            chunk_size *= 2
+            continue
+        lines = chunk.split(b'\n')
+        # 第 n 行的结束位置 = 前 n 行的长度 + n 个换行；最后一段没有换行
+        ends = list(accumulate(map(len, lines)))
+        ends[-1] -= 1
+        reader = csv.reader(io.StringIO(chunk.decode(encoding), newline='\n'))
+        for row in reader:
+            n = reader.line_num
+            yield start + ends[n - 1] + n, row
+        start = stop
+
+# ---------- 旧文件键索引缓存 ----------
+# 每个旧文件按 (比对列, 编码) 缓存一份指纹哈希表索引，文件未变化时直接读取索引，不再解析CSV
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.dedup_index')
+INDEX_VERSION = 3
+# 估算行数时抽样读取的字节数
+INDEX_SAMPLE_SIZE = 65536
+# 校验文件内容时每次读取的字节数
+HASH_CHUNK_SIZE = 1 << 20
+
+def index_path(path, encoding, use_cols):
+    ident = KEY_SEPARATOR.join([os.path.abspath(path), encoding] + list(use_cols))
+    name = os.path.basename(path)
+    return os.path.join(INDEX_DIR, f"{name}.{hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16]}.idx")
+
+def content_hash(f, start, end):
+    """
+    计算文件 [start, end) 区间全部内容的哈希，用于在 mtime 变化时确认内容是否相同。
+    不能只抽样开头和结尾：中间同长度的修改（比如改了一位ID）会让索引过期而察觉不到。
+    """
+    h = hashlib.sha1()
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        h.update(chunk)
+        remaining -= len(chunk)
+    return h.hexdigest()
+
+def read_index(idx_path):
+    """读取索引文件，返回 (元数据, KeyStore)，不存在或损坏时返回 (None, None)"""
+    try:
+        with open(idx_path, 'rb') as f:
+            meta = json.loads(f.readline().decode('utf-8'))
+            if meta.get('version') != INDEX_VERSION:
+                return None, None
+            capacity = meta['capacity']
+            if capacity < KeyStore.MIN_CAPACITY or capacity & (capacity - 1):
+                return None, None
+            store = KeyStore()
+            store.hi, store.lo = array('Q'), array('Q')
+            store.hi.frombytes(f.read(capacity * 8))
+            store.lo.frombytes(f.read(capacity * 8))
+            if len(store.hi) != capacity or len(store.lo) != capacity:
+                return None, None
+            store.mask = capacity - 1
+            store.count = meta['count']
+            store.has_zero = bool(meta.get('has_zero'))
+        return meta, store
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+def write_index(idx_path, meta, store):
+    """写入索引文件（先写临时文件再替换，避免中断时留下损坏的索引）"""
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    meta = dict(meta, version=INDEX_VERSION, count=len(store), capacity=len(store.hi), has_zero=store.has_zero)
+    tmp = idx_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8') + b'\n')
+        f.write(store.hi.tobytes())
+        f.write(store.lo.tobytes())
+    os.replace(tmp, idx_path)
+
+def scan_file_keys(path, encoding, use_cols, store, offset=0, col_indices=None):
+    """解析旧文件（或从 offset 开始的追加部分），把键指纹加入 store，返回使用的列索引"""
+    if offset and is_byte_safe(encoding):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for _, row in iter_chunk_rows(mm, offset, encoding):
+                store.add(key_fingerprint(row_key(row, col_indices)))
+        return col_indices
+    with open(path, newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        # 找出当前旧文件header中共同需要对比的列索引（按 use_cols 顺序）
+        col_indices = key_indices(header, use_cols)
+        for row in reader:
+            store.add(key_fingerprint(row_key(row, col_indices)))
+    return col_indices
+
+def load_file_keys(path, encoding, use_cols):
+    """
+    获取单个旧文件的键索引：
+    大小和修改时间都没变 → 直接使用索引；只有修改时间变化 → 完整哈希确认内容相同后使用；
+    文件只在末尾追加了内容（原有部分的完整哈希不变） → 只解析追加部分；其他情况 → 重新完整解析并更新索引。
+    """
+    idx_path = index_path(path, encoding, use_cols)
+    st = os.stat(path)
+    meta, store = read_index(idx_path)
+    with open(path, 'rb') as f:
+        if meta:
+            if meta['size'] == st.st_size and meta['mtime_ns'] == st.st_mtime_ns:
+                logging.info(f'使用旧文件索引: {path} ({len(store)} 个键)')
+                return store
+            if meta['size'] == st.st_size and content_hash(f, 0, st.st_size) == meta['hash']:
+                logging.info(f'旧文件修改时间变化但内容未变，使用索引: {path}')
+                write_index(idx_path, dict(meta, mtime_ns=st.st_mtime_ns), store)
+                return store
+            appended = (
+                meta['size'] < st.st_size and meta.get('ends_newline')
+                and content_hash(f, 0, meta['size']) == meta['hash']
+                and is_byte_safe(encoding)
+            )
+            if appended:
+                logging.info(f'旧文件有追加内容，增量更新索引: {path} (从第 {meta["size"]} 字节开始)')
+                scan_file_keys(path, encoding, use_cols, store, meta['size'], meta['col_indices'])
+                write_index(idx_path, dict(meta, size=st.st_size, mtime_ns=st.st_mtime_ns,
+                                           hash=content_hash(f, 0, st.st_size),
+                                           ends_newline=_ends_with_newline(f, st.st_size)), store)
+                return store
+
+        logging.info(f'读取旧文件并建立索引: {path}')
+        store = KeyStore()
+        col_indices = scan_file_keys(path, encoding, use_cols, store)
+        write_index(idx_path, {
+            'path': os.path.abspath(path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'hash': content_hash(f, 0, st.st_size),
+            'ends_newline': _ends_with_newline(f, st.st_size),
+            'col_indices': col_indices,
+        }, store)
+    return store
+
+def _ends_with_newline(f, size):
+    if size == 0:
+        return False
+    f.seek(size - 1)
+    return f.read(1) == b'\n'
+
+# 修改：deduplicate 支持指定用哪些列去比对，每个旧文件使用缓存的指纹索引，
+# 同一组旧文件的索引边读取边合并成一个 KeyStore，成员判断只查一个哈希表，与旧文件数量无关
+def deduplicate(old_paths, encoding, use_cols):
+    merged = None
+    for p in old_paths:
+        try:
+            store = load_file_keys(p, encoding, use_cols)
+        except OSError as e:
+            logging.error(f'旧文件索引读写失败，直接解析: {p}, 错误: {e}')
+            store = KeyStore()
+            scan_file_keys(p, encoding, use_cols, store)
+        merged = store if merged is None else merged.update(store)
+        logging.info(f'累计键数: {len(merged)}')
+    return merged if merged is not None else KeyStore()
+
+# 修改：filter_new_lines 流式过滤，只比对共同列，保留的记录原样写入输出文件
+def filter_new_lines(new_path, out_path, keys, encoding, use_cols):
+    logging.info(f'过滤新文件: {new_path}')
+    if is_byte_safe(encoding) and os.path.getsize(new_path) > 0:
+        kept = _filter_mmap(new_path, out_path, keys, encoding, use_cols)
+    else:
+        kept = _filter_text(new_path, out_path, keys, encoding, use_cols)
+    logging.info(f'保留行数: {kept}')
+    return kept
+
+def _filter_mmap(new_path, out_path, keys, encoding, use_cols):
+    """内存映射新文件，按块在字节层面切分记录，连续保留的记录合并成一段直接写出，内存占用与文件大小无关"""
+    kept = 0
+    with open(new_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            open(out_path, 'wb') as out:
+        # 表头原样写出（包括 BOM）
+        header_start, header_end = next(iter_record_spans(mm))
+        header = parse_record(mm[header_start:header_end].decode(encoding))
+        col_indices = key_indices(header, use_cols)
+        run_start = header_start
+        run_end = header_end
+        for end, row in iter_chunk_rows(mm, header_end, encoding):
+            if key_fingerprint(row_key(row, col_indices)) in keys:
+                # 遇到重复记录时写出之前累积的连续保留区间
+                if run_end > run_start:
+                    out.write(mm[run_start:run_end])
+                run_start = run_end = end
+            else:
+                run_end = end
+                kept += 1
+        if run_end > run_start:
+            out.write(mm[run_start:run_end])
+    return kept
+
+def _filter_text(new_path, out_path, keys, encoding, use_cols):
+    """UTF-16/32 等无法按字节切分的编码：逐行解码读取，保留的记录按原文写出"""
+    kept = 0
+    with open(new_path, 'r', encoding=encoding, newline='') as f, \
+            open(out_path, 'w', encoding=encoding, newline='') as out:
+        consumed = []
+
+        def tracked_lines():
+            # 记录 csv.reader 读取的原始行，用于原样写出整条记录
+            for line in f:
+                consumed.append(line)
+                yield line
+
+        reader = csv.reader(tracked_lines())
+        header = next(reader, None)
+        if header is None:
+            return 0
+        out.write(''.join(consumed).lstrip('\ufeff'))
+        consumed.clear()
+        col_indices = key_indices(header, use_cols)
+        for row in reader:
+            record = ''.join(consumed)
+            consumed.clear()
+            if key_fingerprint(row_key(row, col_indices)) not in keys:
+                out.write(record)
+                kept += 1
+    return kept
+
+# ---------- 磁盘外排序模式 ----------
+# 旧文件键集合放不进内存时使用：把新旧文件的键指纹分批排序后写入临时文件，再归并比对，
+# 内存占用只取决于 MEMORY_BUDGET_MB 和新文件行数（每行 1 bit 的重复标记）
+# 内存模式下每个键的估算占用（哈希表扩容时新旧两个表同时存在是峰值）
+KEY_MEMORY_BYTES = 96
+# 外排序时内存中每条待排序记录的估算占用
+SPILL_ENTRY_BYTES = 64
+# 同时打开归并的临时文件数上限，超过时先分批合并
+MAX_MERGE_RUNS = 64
+OLD_RECORD_SIZE = 16
+NEW_RECORD_SIZE = 24
+
+def estimate_key_count(path, encoding, use_cols):
+    """估算旧文件的键数：有索引时直接读取键数，否则按开头一段的平均行长推算"""
+    try:
+        with open(index_path(path, encoding, use_cols), 'rb') as f:
+            meta = json.loads(f.readline().decode('utf-8'))
+        if meta.get('version') == INDEX_VERSION and meta.get('size') == os.path.getsize(path):
+            return meta['count']
+    except (OSError, ValueError, KeyError):
+        pass
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        sample = f.read(INDEX_SAMPLE_SIZE)
+    lines = sample.count(b'\n')
+    if not lines:
+        return 1
+    return max(1, size * lines // len(sample))
+
+def exceeds_memory_budget(old_paths, encoding, use_cols):
+    """判断旧文件键集合的估算内存占用是否超过 MEMORY_BUDGET_MB"""
+    count = sum(estimate_key_count(p, encoding, use_cols) for p in old_paths)
+    estimated_mb = count * KEY_MEMORY_BYTES / (1024 * 1024)
+    logging.info(f'旧文件预计键数: {count}，预计占用内存 {estimated_mb:.1f}MB (上限 {MEMORY_BUDGET_MB}MB)')
+    return estimated_mb > MEMORY_BUDGET_MB
+
+def iter_record_fingerprints(path, encoding, use_cols):
+    """按文件顺序逐条返回数据记录（不含表头）比对列的指纹，记录的切分方式与过滤写出时一致"""
+    if is_byte_safe(encoding) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            spans = iter_record_spans(mm)
+            start, end = next(spans)
+            col_indices = key_indices(parse_record(mm[start:end].decode(encoding)), use_cols)
+            for start, end in spans:
+                yield key_fingerprint(row_key(parse_record(mm[start:end].decode(encoding)), col_indices))
+        return
+    with open(path, newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        col_indices = key_indices(header, use_cols)
+        for row in reader:
+            yield key_fingerprint(row_key(row, col_indices))
+
+def _write_run(entries, record_size, tmp_dir, runs):
+    entries.sort()
+    path = os.path.join(tmp_dir, f'run_{len(runs)}.bin')
+    with open(path, 'wb') as f:
+        f.write(b''.join(value.to_bytes(record_size, 'big') for value in entries))
+    runs.append(path)
+    entries.clear()
+
+def _read_run(path, record_size, batch=65536):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(record_size * batch)
+            if not chunk:
+                return
+            for i in range(0, len(chunk), record_size):
+                yield int.from_bytes(chunk[i:i + record_size], 'big')
+
+def spill_sorted_runs(values, record_size, tmp_dir, prefix):
+    """把整数流按内存上限分批排序写入临时文件，返回各批文件路径"""
+    run_limit = max(1024, MEMORY_BUDGET_MB * 1024 * 1024 // SPILL_ENTRY_BYTES)
+    run_dir = os.path.join(tmp_dir, prefix)
+    os.makedirs(run_dir, exist_ok=True)
+    runs, entries = [], []
+    for value in values:
+        entries.append(value)
+        if len(entries) >= run_limit:
+            _write_run(entries, record_size, run_dir, runs)
+    if entries:
+        _write_run(entries, record_size, run_dir, runs)
+    # 临时文件过多时分批合并，避免同时打开太多文件
+    level = 0
+    while len(runs) > MAX_MERGE_RUNS:
+        level += 1
+        merged_dir = os.path.join(run_dir, f'level_{level}')
+        os.makedirs(merged_dir, exist_ok=True)
+        merged = []
+        for i in range(0, len(runs), MAX_MERGE_RUNS):
+            path = os.path.join(merged_dir, f'run_{len(merged)}.bin')
+            with open(path, 'wb') as f:
+                for value in heapq.merge(*(_read_run(r, record_size) for r in runs[i:i + MAX_MERGE_RUNS])):
+                    f.write(value.to_bytes(record_size, 'big'))
+            merged.append(path)
+        for r in runs:
+            os.remove(r)
+        runs = merged
+    return runs
+
+def external_filter(old_paths, enc_old, new_path, out_path, enc_new, use_cols):
+    """
+    磁盘外排序去重：
+    1. 旧文件指纹分批排序写入临时文件；2. 新文件 (指纹, 行号) 同样分批排序写入临时文件；
+    3. 两边归并后顺序比对，把新文件中重复行的行号记入位图；4. 按原顺序再读一遍新文件，写出未标记的记录。
+    """
+    logging.info(f'使用磁盘外排序模式过滤新文件: {new_path}')
+    with tempfile.TemporaryDirectory(prefix='dedup_spill_', dir=os.path.dirname(os.path.abspath(out_path))) as tmp_dir:
+        def old_values():
+            for p in old_paths:
+                logging.info(f'外排序读取旧文件: {p}')
+                for hi, lo in iter_record_fingerprints(p, enc_old, use_cols):
+                    yield (hi << 64) | lo
+
+        ordinals = [0]
+
+        def new_values():
+            for ordinal, (hi, lo) in enumerate(iter_record_fingerprints(new_path, enc_new, use_cols)):
+                ordinals[0] = ordinal + 1
+                yield (hi << 128) | (lo << 64) | ordinal
+
+        old_runs = spill_sorted_runs(old_values(), OLD_RECORD_SIZE, tmp_dir, 'old')
+        new_runs = spill_sorted_runs(new_values(), NEW_RECORD_SIZE, tmp_dir, 'new')
+        logging.info(f'外排序临时文件: 旧 {len(old_runs)} 个, 新 {len(new_runs)} 个')
+
+        duplicates = bytearray((ordinals[0] + 7) // 8)
+        old_iter = heapq.merge(*(_read_run(r, OLD_RECORD_SIZE) for r in old_runs))
+        current_old = next(old_iter, None)
+        removed = 0
+        for value in heapq.merge(*(_read_run(r, NEW_RECORD_SIZE) for r in new_runs)):
+            fingerprint = value >> 64
+            while current_old is not None and current_old < fingerprint:
+                current_old = next(old_iter, None)
+            if current_old is None:
+                break
+            if current_old == fingerprint:
+                ordinal = value & MASK64
+                duplicates[ordinal >> 3] |= 1 << (ordinal & 7)
+                removed += 1
+    kept = write_unmarked(new_path, out_path, enc_new, duplicates)
+    logging.info(f'外排序去重完成: 移除 {removed} 行, 保留 {kept} 行')
+    return kept
+
+def external_common_keys(old_paths, enc_old, new_path, enc_new, use_cols):
+    """
+    磁盘外排序求新文件中在旧文件里也出现过的键指纹，返回 (KeyStore, 旧文件记录数)。
+    用于逐行判断重复（RowDeduper）：旧文件键集合放不进内存时，内存中只保存新旧文件共有的键，数量不超过新文件行数。
+    """
+    logging.info(f'使用磁盘外排序模式求共有键: {new_path}')
+    common = KeyStore()
+    old_count = [0]
+    with tempfile.TemporaryDirectory(prefix='dedup_spill_', dir=os.path.dirname(os.path.abspath(new_path))) as tmp_dir:
+        def old_values():
+            for p in old_paths:
+                logging.info(f'外排序读取旧文件: {p}')
+                for hi, lo in iter_record_fingerprints(p, enc_old, use_cols):
+                    old_count[0] += 1
+                    yield (hi << 64) | lo
+
+        def new_values():
+            for hi, lo in iter_record_fingerprints(new_path, enc_new, use_cols):
+                yield (hi << 64) | lo
+
+        old_runs = spill_sorted_runs(old_values(), OLD_RECORD_SIZE, tmp_dir, 'old')
+        new_runs = spill_sorted_runs(new_values(), OLD_RECORD_SIZE, tmp_dir, 'new')
+        old_iter = heapq.merge(*(_read_run(r, OLD_RECORD_SIZE) for r in old_runs))
+        current_old = next(old_iter, None)
+        for value in heapq.merge(*(_read_run(r, OLD_RECORD_SIZE) for r in new_runs)):
+            while current_old is not None and current_old < value:
+                current_old = next(old_iter, None)
+            if current_old is None:
+                break
+            if current_old == value:
+                common.add((value >> 64, value & MASK64))
+    logging.info(f'外排序完成: 旧文件 {old_count[0]} 条记录，与新文件共有 {len(common)} 个键')
+    return common, old_count[0]
+
+def write_unmarked(new_path, out_path, encoding, duplicates):
+    """按原顺序写出新文件中未被标记为重复的记录（表头原样保留）"""
+    def is_marked(ordinal):
+        return duplicates[ordinal >> 3] & (1 << (ordinal & 7))
+
+    kept = 0
+    if is_byte_safe(encoding) and os.path.getsize(new_path) > 0:
+        with open(new_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                open(out_path, 'wb') as out:
+            spans = iter_record_spans(mm)
+            run_start, run_end = next(spans)
+            for ordinal, (start, end) in enumerate(spans):
+                if is_marked(ordinal):
+                    if run_end > run_start:
+                        out.write(mm[run_start:run_end])
+                    run_start = run_end = end
+                else:
+                    run_end = end
+                    kept += 1
+            if run_end > run_start:
+                out.write(mm[run_start:run_end])
+        return kept
+    with open(new_path, 'r', encoding=encoding, newline='') as f, \
+            open(out_path, 'w', encoding=encoding, newline='') as out:
+        consumed = []
+
+        def tracked_lines():
+            for line in f:
+                consumed.append(line)
+                yield line
+
+        reader = csv.reader(tracked_lines())
+        if next(reader, None) is None:
+            return 0
+        out.write(''.join(consumed).lstrip('\ufeff'))
+        consumed.clear()
+        for ordinal, _ in enumerate(reader):
+            record = ''.join(consumed)
+            consumed.clear()
+            if not is_marked(ordinal):
+                out.write(record)
+                kept += 1
+    return kept
+
+# ---------- 按身份ID去重（跨平台） ----------
+# 两个项目的导出/转换文件列结构不同，按共同列比对经常对不上。这里改为按条目身份比对：
+# 从各文件中识别 IMDB/TMDB/Trakt/Bangumi ID 列，再用转换脚本累积的 success_log_*.csv 建立
+# IMDB/TMDB/Trakt ↔ Bangumi ID 对照表，只要新旧记录指向同一条目就视为重复。
+IDENTITY_COLUMNS = {
+    'imdb': {'imdb', 'imdb_id', 'imdb id', '原imdb id'},
+    'tmdb': {'tmdb', 'tmdb_id', 'tmdb id', '原tmdb id'},
+    'trakt': {'trakt', 'trakt_id', 'trakt id', '原trakt id'},
+    'bgm': {'bangumi', 'bangumi_id', 'bangumi id', 'bgm', 'bgm_id', 'subject_id', '匹配bangumi id'},
+}
+TYPE_COLUMNS = {'type', 'media_type', 'tmdb类型'}
+TYPE_VALUES = {'movie': 'movie', 'movies': 'movie', 'tv': 'tv', 'show': 'tv', 'shows': 'tv',
+               'episode': 'tv', 'episodes': 'tv'}
+# IMDB 和 Bangumi ID 全局唯一；TMDB/Trakt ID 在电影和剧集之间会重复，需要结合类型判断
+GLOBAL_ID_KINDS = ('imdb', 'bgm')
+# 反向项目转换后的文件（跨平台旧文件），按身份去重
+CROSS_PLATFORM_OLD = re.compile(r"(?:(?:temp_)?trakt_formatted|bangumi_export)\.csv$", re.IGNORECASE)
+CROSSWALK_VERSION = 1
+
+def identity_columns(header):
+    """返回 ({ID种类: 列下标}, 类型列下标)"""
+    lowered = [h.strip().lower().lstrip('\ufeff') for h in header]
+    cols = {}
+    for kind, names in IDENTITY_COLUMNS.items():
+        for i, h in enumerate(lowered):
+            if h in names:
+                cols[kind] = i
+                break
+    # Bangumi 导出格式（ID,类型,中文,日文...）中的 ID 列就是 Bangumi ID
+    if 'bgm' not in cols and 'id' in lowered and ('中文' in lowered or '日文' in lowered):
+        cols['bgm'] = lowered.index('id')
+    type_index = next((i for i, h in enumerate(lowered) if h in TYPE_COLUMNS), None)
+    return cols, type_index
+
+def file_type_hint(path):
+    """根据文件名猜测条目类型，如 export_movies_history.csv → movie"""
+    name = os.path.basename(path).lower()
+    if 'movie' in name:
+        return 'movie'
+    if 'show' in name or 'episode' in name:
+        return 'tv'
+    return None
+
+def normalize_id(kind, value):
+    value = (value or '').strip()
+    if value.lower() in ('', 'unknown', 'none', 'null', 'nan', '0'):
+        return None
+    if kind == 'imdb':
+        return value if value.startswith('tt') else None
+    # 经过表格软件或 pandas 处理的文件里数字ID可能带 .0
+    if value.endswith('.0'):
+        value = value[:-2]
+    return value
+
+def row_identity(row, cols, type_index=None, type_hint=None):
+    """返回记录的身份键列表，每个键为 (ID种类, 类型或None, ID)"""
+    media_type = type_hint
+    if type_index is not None and type_index < len(row):
+        media_type = TYPE_VALUES.get((row[type_index] or '').strip().lower(), media_type)
+    keys = []
+    for kind, i in cols.items():
+        value = normalize_id(kind, row[i] if i < len(row) else '')
+        if value:
+            keys.append((kind, None if kind in GLOBAL_ID_KINDS else media_type, value))
+    return keys
+
+class Crosswalk:
+    """IMDB/TMDB/Trakt ID ↔ Bangumi ID 对照表"""
+
+    def __init__(self):
+        self.to_bgm = {}     # (ID种类, ID) -> {(类型, Bangumi ID)}
+        self.from_bgm = {}   # Bangumi ID -> {身份键}
+
+    def link(self, bgm_id, keys):
+        for kind, media_type, value in keys:
+            self.to_bgm.setdefault((kind, value), set()).add((media_type, bgm_id))
+            self.from_bgm.setdefault(bgm_id, set()).add((kind, media_type, value))
+
+    def expand(self, keys):
+        """把身份键扩展为同一条目在各平台的全部身份键"""
+        bgm_ids = set()
+        for kind, media_type, value in keys:
+            if kind == 'bgm':
+                bgm_ids.add(value)
+                continue
+            for linked_type, bgm_id in self.to_bgm.get((kind, value), ()):
+                if media_type is None or linked_type is None or linked_type == media_type:
+                    bgm_ids.add(bgm_id)
+        expanded = set(keys)
+        for bgm_id in bgm_ids:
+            expanded.add(('bgm', None, bgm_id))
+            expanded |= self.from_bgm.get(bgm_id, set())
+        return expanded
+
+    def __len__(self):
+        return len(self.from_bgm)
+
+def _parse_success_log(path):
+    """读取转换脚本的成功日志，返回 [[Bangumi ID, IMDB, TMDB, Trakt, 类型], ...]"""
+    links = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            bgm_id = normalize_id('bgm', row.get('匹配Bangumi ID'))
+            if not bgm_id:
+                continue
+            media_type = TYPE_VALUES.get((row.get('TMDB类型') or '').strip().lower())
+            links.append([bgm_id, normalize_id('imdb', row.get('原IMDB ID')), normalize_id('tmdb', row.get('原TMDB ID')),
+                          normalize_id('trakt', row.get('原Trakt ID')), media_type])
+    return links
+
+def load_crosswalk(dirs):
+    """
+    从各目录的 success_log_*.csv 建立对照表。每个日志的解析结果按大小和修改时间缓存在
+    .dedup_index/crosswalk.json 中，只有新增或变化的日志才重新解析。
+    """
+    cache_path = os.path.join(INDEX_DIR, 'crosswalk.json')
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') != CROSSWALK_VERSION:
+            cache = None
+    except (OSError, ValueError):
+        cache = None
+    cached_logs = (cache or {}).get('logs', {})
+
+    logs = {}
+    changed = False
+    for d in dict.fromkeys(os.path.abspath(d) for d in dirs if d and os.path.isdir(d)):
+        for name in sorted(os.listdir(d)):
+            if not re.match(r"success_log_.*\.csv$", name, re.IGNORECASE):
+                continue
+            path = os.path.join(d, name)
+            st = os.stat(path)
+            entry = cached_logs.get(path)
+            if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                try:
+                    entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'links': _parse_success_log(path)}
+                except (OSError, UnicodeError, csv.Error) as e:
+                    logging.error(f'读取成功日志失败，已忽略: {path}, 错误: {e}')
+                    continue
+                changed = True
+            logs[path] = entry
+    if changed or set(logs) != set(cached_logs):
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            tmp = cache_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': CROSSWALK_VERSION, 'logs': logs}, f, ensure_ascii=False)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            logging.error(f'写入对照表缓存失败: {e}')
+
+    crosswalk = Crosswalk()
+    for entry in logs.values():
+        for bgm_id, imdb_id, tmdb_id, trakt_id, media_type in entry['links']:
+            keys = [('bgm', None, bgm_id)]
+            if imdb_id:
+                keys.append(('imdb', None, imdb_id))
+            if tmdb_id:
+                keys.append(('tmdb', media_type, tmdb_id))
+            if trakt_id:
+                keys.append(('trakt', media_type, trakt_id))
+            crosswalk.link(bgm_id, keys)
+    logging.info(f'对照表: {len(logs)} 个成功日志, {len(crosswalk)} 个Bangumi条目')
+    return crosswalk
+
+class IdentityIndex:
+    """旧文件的身份键集合。类型未知的 TMDB/Trakt ID 与任意类型匹配，类型已知时只与同类型或类型未知的匹配"""
+
+    def __init__(self, crosswalk=None):
+        self.crosswalk = crosswalk or Crosswalk()
+        self.global_ids = set()
+        self.typed = set()
+        self.any_type = set()
+        self.unknown_type = set()
+
+    def add(self, keys):
+        for kind, media_type, value in self.crosswalk.expand(keys):
+            if kind in GLOBAL_ID_KINDS:
+                self.global_ids.add((kind, value))
+                continue
+            self.any_type.add((kind, value))
+            if media_type:
+                self.typed.add((kind, media_type, value))
+            else:
+                self.unknown_type.add((kind, value))
+
+    def add_file(self, path):
+        encoding = detect_encoding(path)
+        with open(path, newline='', encoding=encoding) as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return
+            cols, type_index = identity_columns(header)
+            if not cols:
+                logging.warning(f'旧文件中没有可识别的ID列，无法按身份去重: {path}')
+                return
+            hint = file_type_hint(path)
+            for row in reader:
+                self.add(row_identity(row, cols, type_index, hint))
+        logging.info(f'按身份读取旧文件: {path}，累计 {len(self)} 个身份键')
+
+    def matches(self, keys):
+        for kind, media_type, value in self.crosswalk.expand(keys):
+            if kind in GLOBAL_ID_KINDS:
+                if (kind, value) in self.global_ids:
+                    return True
+            elif media_type:
+                if (kind, media_type, value) in self.typed or (kind, value) in self.unknown_type:
+                    return True
+            elif (kind, value) in self.any_type:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.global_ids) + len(self.any_type)
+
+def write_identity_dedup_file(new_path, index):
+    """按身份过滤新文件，没有任何ID的记录无法判断，原样保留"""
+    enc_new = detect_encoding(new_path)
+    out_path = dedup_output_path(new_path)
+    duplicates = bytearray()
+    removed = 0
+    with open(new_path, newline='', encoding=enc_new) as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        cols, type_index = identity_columns(header)
+        if not cols:
+            raise ValueError(f'新文件中没有可识别的ID列: {new_path}')
+        hint = file_type_hint(new_path)
+        for ordinal, row in enumerate(reader):
+            if ordinal >> 3 >= len(duplicates):
+                duplicates.extend(bytes(4096))
+            keys = row_identity(row, cols, type_index, hint)
+            if keys and index.matches(keys):
+                duplicates[ordinal >> 3] |= 1 << (ordinal & 7)
+                removed += 1
+    kept = write_unmarked(new_path, out_path, enc_new, duplicates)
+    print(f"去重完成: {out_path}")
+    logging.info(f'按身份去重完成: 移除 {removed} 行, 保留 {kept} 行, 生成去重文件: {out_path}')
+    return out_path
+
+def process_pairs_identity(pairs, crosswalk_dirs):
+    """
+    模式3：按身份去重，共用同一组旧文件的新文件只建立一次身份索引，
+    与 process_pairs 一样通过进程池初始化把索引交给每个子进程一次，各新文件的过滤并行进行。
+    """
+    crosswalk = load_crosswalk(crosswalk_dirs)
+    index_ids = {}
+    indexes = {}
+    jobs = []
+    for olds, new in pairs:
+        try:
+            if tuple(olds) not in index_ids:
+                index = IdentityIndex(crosswalk)
+                for op in olds:
+                    index.add_file(op)
+                index_ids[tuple(olds)] = len(index_ids)
+                indexes[index_ids[tuple(olds)]] = index
+            jobs.append((olds, new, (new, index_ids[tuple(olds)])))
+        except Exception as e:
+            print(f"{olds} -> {new} 处理失败: {e}")
+            logging.error(f'按身份处理文件对失败: {olds} -> {new}, 错误: {e}')
+
+    def finish(olds, new, run):
+        try:
+            run()
+        except Exception as e:
+            print(f"{olds} -> {new} 处理失败: {e}")
+            logging.error(f'按身份处理文件对失败: {olds} -> {new}, 错误: {e}')
+
+    run_pair_jobs(jobs, indexes, _identity_worker, finish)
+
+# ---------- 供其他脚本调用的流式去重 ----------
+def expand_sources(sources):
+    """把旧文件或文件夹列表展开为CSV文件路径列表，文件夹读取其中所有CSV，不存在的路径忽略"""
+    paths = []
+    for src in sources:
+        if os.path.isdir(src):
+            paths.extend(sorted(os.path.join(src, f) for f in os.listdir(src) if f.lower().endswith('.csv')))
+        elif os.path.isfile(src):
+            paths.append(src)
+        else:
+            logging.info(f'去重旧文件不存在，已忽略: {src}')
+    return paths
+
+class RowDeduper:
+    """
+    按行判断新文件记录是否已在旧文件中出现，用于边读边过滤。
+    旧文件按 (编码, 与新文件header的共同列) 分组，每组建立一次键集合；没有共同列的旧文件无法比对，直接忽略。
+    键集合超过 MEMORY_BUDGET_MB 的组改用磁盘外排序，只把与新文件 new_path 共有的键放进内存；没有给出 new_path 时忽略该组。
+    """
+
+    def __init__(self, header, old_paths, identity_paths=(), crosswalk=None, type_hint=None, new_path=None):
+        # identity_paths 中的旧文件（反向项目的转换文件）按身份比对，其余按共同列比对
+        self.identity = None
+        if identity_paths:
+            self.identity = IdentityIndex(crosswalk)
+            for op in identity_paths:
+                try:
+                    self.identity.add_file(op)
+                except (OSError, UnicodeError, csv.Error) as e:
+                    logging.error(f'按身份读取旧文件失败，已忽略: {op}, 错误: {e}')
+            self.id_cols, self.type_index = identity_columns(header)
+            self.header = list(header)
+            self.type_hint = type_hint
+            if not self.id_cols:
+                logging.warning('新文件中没有可识别的ID列，无法按身份去重')
+                self.identity = None
+        groups = {}
+        for op in old_paths:
+            try:
+                enc_old = detect_encoding(op)
+                with open(op, encoding=enc_old) as f:
+                    header_old = next(csv.reader(f), None)
+            except (OSError, UnicodeError) as e:
+                logging.error(f'读取旧文件表头失败，已忽略: {op}, 错误: {e}')
+                continue
+            if not header_old:
+                continue
+            use_cols = get_common_cols([header, header_old])
+            if not use_cols:
+                logging.warning(f'旧文件与新文件没有可比对的共同列，已忽略: {op}')
+                continue
+            groups.setdefault((enc_old, tuple(use_cols)), []).append(op)
+        self.filters = []
+        self.old_count = 0
+        for (enc_old, use_cols), paths in groups.items():
+            if not exceeds_memory_budget(paths, enc_old, use_cols):
+                keys = deduplicate(paths, enc_old, use_cols)
+                self.old_count += len(keys)
+            elif new_path:
+                keys, count = external_common_keys(paths, enc_old, new_path, detect_encoding(new_path), use_cols)
+                self.old_count += count
+            else:
+                logging.error(f'旧文件键集合超过内存上限，且没有新文件可供外排序比对，已忽略: {paths}')
+                continue
+            self.filters.append((use_cols, keys))
+
+    def is_duplicate(self, row):
+        """row 为 csv.DictReader 读出的字典"""
+        for use_cols, keys in self.filters:
+            values = [(row.get(col) or '').strip() for col in use_cols]
+            if key_fingerprint(values) in keys:
+                return True
+        if self.identity:
+            keys = row_identity([row.get(col) for col in self.header], self.id_cols, self.type_index, self.type_hint)
+            if keys and self.identity.matches(keys):
+                return True
+        return False
+
+    def __len__(self):
+        return self.old_count + (len(self.identity) if self.identity else 0)
+
+# 修改：主流程中自动获得共同列并传递
+def prepare_pair(old_paths, new_path):
+    """检测新旧文件编码并求出共同比对列，返回 (新文件编码, 旧文件编码, 比对列)"""
+    enc_new = detect_encoding(new_path)
+    enc_old = detect_encoding(old_paths[0])
+    # 1. 先读取新旧文件header
+    with open(new_path, encoding=enc_new) as f:
+        header_new = next(csv.reader(f))
+    headers_old = []
+    for op in old_paths:
+        with open(op, encoding=enc_old) as f:
+            headers_old.append(next(csv.reader(f)))
+    # 2. 求新旧文件共同列
+    use_cols = get_common_cols([header_new] + headers_old)
+    return enc_new, enc_old, use_cols
+
+def dedup_output_path(new_path):
+    ds = f"{date.today().month:02d}.{date.today().day:02d}"
+    base = os.path.splitext(os.path.basename(new_path))[0]
+    return os.path.join(os.path.dirname(new_path), f"{base}_New_{ds}.csv")
+
+def write_dedup_file(new_path, keys, enc_new, use_cols):
+    """按共同列过滤新文件，生成带 _New_ 日期后缀的去重文件并返回其路径"""
+    out_path = dedup_output_path(new_path)
+    filter_new_lines(new_path, out_path, keys, enc_new, use_cols)
+    print(f"去重完成: {out_path}")
+    logging.info(f'生成去重文件: {out_path} (编码:{enc_new})')
+    return out_path
+
+def archive_new_file(new_path):
+    """移动或重命名原文件到 dedup 目录，下次作为旧文件使用"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    de_dup_dir = os.path.join(script_dir, "dedup")
+    os.makedirs(de_dup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(new_path))[0]
+    if re.search(r"(?:_\d{2}\.\d{2})$|(?:_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$", stem):
+        dest_name = os.path.basename(new_path)
+    else:
+        ctime = os.path.getctime(new_path)
+        dt = datetime.fromtimestamp(ctime)
+        ct_suffix = f"{dt.month:02d}.{dt.day:02d}"
+        ext = os.path.splitext(new_path)[1]
+        dest_name = f"{stem}_{ct_suffix}{ext}"
+    dest = os.path.join(de_dup_dir, dest_name)
+    shutil.move(new_path, dest)
+    os.utime(dest, None)
+    print(f"已移动原文件到: {dest}")
+    logging.info(f'原文件移动/重命名: {dest_name}')
+
+def write_dedup_file_external(old_paths, enc_old, new_path, enc_new, use_cols):
+    """磁盘外排序模式生成去重文件并返回其路径"""
+    out_path = dedup_output_path(new_path)
+    external_filter(old_paths, enc_old, new_path, out_path, enc_new, use_cols)
+    print(f"去重完成: {out_path}")
+    logging.info(f'生成去重文件: {out_path} (编码:{enc_new}, 外排序模式)')
+    return out_path
+
+def process_batch_manual(old_paths, new_path):
+    logging.info('模式2: 手动模式开始处理')
+    enc_new, enc_old, use_cols = prepare_pair(old_paths, new_path)
+    # 3. 按共同列做去重，旧文件键集合超过内存上限时改用外排序模式
+    if exceeds_memory_budget(old_paths, enc_old, use_cols):
+        write_dedup_file_external(old_paths, enc_old, new_path, enc_new, use_cols)
+        return
+    keys = deduplicate(old_paths, enc_old, use_cols)
+    write_dedup_file(new_path, keys, enc_new, use_cols)
+
+# ---------- 多个文件对并行处理 ----------
+# 子进程中共享的只读数据：编号 -> 键集合（KeyStore）或身份索引（IdentityIndex），进程启动时传入一次
+_worker_key_sets = {}
+
+def _init_worker(key_sets):
+    # spawn 方式启动的子进程不会执行 __main__，需要自己配置日志
+    if not logging.getLogger().handlers:
+        setup_logging()
+    _worker_key_sets.update(key_sets)
+
+def _dedup_worker(new_path, key_set_id, enc_new, use_cols):
+    return write_dedup_file(new_path, _worker_key_sets[key_set_id], enc_new, use_cols)
+
+def _identity_worker(new_path, index_id):
+    return write_identity_dedup_file(new_path, _worker_key_sets[index_id])
+
+def run_pair_jobs(jobs, shared, worker, finish):
+    """
+    jobs 为 (旧文件, 新文件, worker参数)，shared 为各任务共用的只读数据（键集合或身份索引），
+    进程池启动时交给每个子进程一次；只有一组文件对或只有一个CPU时直接在当前进程依次处理，省去启动进程池的开销。
+    """
+    if not jobs:
+        return
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        _worker_key_sets.update(shared)
+        for olds, new, args in jobs:
+            finish(olds, new, lambda: worker(*args))
+        return
+
+    logging.info(f'使用 {workers} 个进程并行处理 {len(jobs)} 组文件对，共享 {len(shared)} 个键集合或身份索引')
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        futures = {pool.submit(worker, *args): (olds, new) for olds, new, args in jobs}
+        for future in as_completed(futures):
+            olds, new = futures[future]
+            finish(olds, new, future.result)
+
+def process_pairs(pairs, archive=False):
+    """
+    并行处理多组文件对：主进程按 (旧文件, 编码, 比对列) 分组，每组只建立一次键集合，
+    进程池启动时把所有键集合只读地交给每个子进程一次，然后各新文件的过滤并行进行。
+    估算键集合超过 MEMORY_BUDGET_MB 的组改用磁盘外排序模式依次处理。
+    archive 为 True 时（模式1）处理成功后把新文件移动到 dedup 目录。
+    """
+    key_set_ids = {}
+    key_sets = {}
+    jobs = []
+    external_jobs = []
+    oversized = {}
+    for olds, new in pairs:
+        try:
+            enc_new, enc_old, use_cols = prepare_pair(olds, new)
+            group = (tuple(olds), enc_old, tuple(use_cols))
+            if group not in oversized:
+                oversized[group] = exceeds_memory_budget(olds, enc_old, use_cols)
+            if oversized[group]:
+                # 超过内存上限的组不建立键集合，之后在主进程中逐个外排序处理
+                external_jobs.append((olds, new, enc_old, enc_new, use_cols))
+                continue
+            if group not in key_set_ids:
+                key_set_ids[group] = len(key_set_ids)
+                key_sets[key_set_ids[group]] = deduplicate(olds, enc_old, use_cols)
+            jobs.append((olds, new, (new, key_set_ids[group], enc_new, use_cols)))
+        except Exception as e:
+            print(f"{olds} -> {new} 处理失败: {e}")
+            logging.error(f'准备文件对失败: {olds} -> {new}, 错误: {e}')
+
+    def finish(olds, new, run):
+        try:
+            run()
+            if archive:
+                archive_new_file(new)
+        except Exception as e:
+            print(f"{olds} -> {new} 处理失败: {e}")
+            logging.error(f'处理文件对失败: {olds} -> {new}, 错误: {e}')
+
+    # 外排序本身受内存上限约束，并行会成倍占用内存和磁盘，所以依次处理
+    for olds, new, enc_old, enc_new, use_cols in external_jobs:
+        finish(olds, new, lambda: write_dedup_file_external(olds, enc_old, new, enc_new, use_cols))
+    run_pair_jobs(jobs, key_sets, _dedup_worker, finish)
+
+def auto_select_files():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    logging.info(f'模式1日志调试: dedup 目录自动选择，脚本目录={script_dir}')
+    de_dup_dir = os.path.join(script_dir, "dedup")
+    if not os.path.isdir(de_dup_dir):
+        os.makedirs(de_dup_dir, exist_ok=True)
+        print(f"未找到目录: {de_dup_dir}，已自动创建。请将旧文件放入后重试。")
+        logging.info(f'已创建缺失目录: {de_dup_dir}')
+        return []
+
+    old_files = [os.path.join(de_dup_dir, f) for f in os.listdir(de_dup_dir) if f.lower().endswith('.csv')]
+    new_files = [os.path.join(script_dir, f) for f in os.listdir(script_dir)
+                 if f.lower().endswith('.csv') and "_New_" not in f]
+
+    if not old_files:
+        print(f"在目录 {de_dup_dir} 中未找到任何 CSV 文件，请先放入旧文件。")
+        return []
+    if not new_files:
+        print(f"在脚本目录未找到任何新 CSV 文件。")
+        return []
+
+    # 基于相似度匹配新旧文件
+    def clean(name):
+        s = name
+        # 去除 MM.DD 日期后缀
+        s = re.sub(r'_(\d{2}\.\d{2})$', '', s)
+        # 去除完整时间戳后缀 YYYY-MM-DD_HH-MM-SS
+        s = re.sub(r'_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$', '', s)
+        # 去除带点的数字序号后缀，如 _9 或 _2 或 _09.04
+        s = re.sub(r'_[0-9]+(?:\.[0-9]+)*$', '', s)
+        # 去除纯数字点数字后缀，如 1.12 或 2.3.4
+        s = re.sub(r'[0-9]+(?:\.[0-9]+)+$', '', s)
+        return s
+
+    mapping = {}
+    threshold = 0.85
+    for old in old_files:
+        key = clean(os.path.splitext(os.path.basename(old))[0])
+        best_ratio, best_new = 0, None
+        for new in new_files:
+            new_key = clean(os.path.splitext(os.path.basename(new))[0])
+            ratio = difflib.SequenceMatcher(None, key, new_key).ratio()
+            if ratio > best_ratio or (
+               ratio == best_ratio and os.path.getmtime(new) > os.path.getmtime(best_new or new)
+            ):
+                best_ratio, best_new = ratio, new
+        if best_ratio >= threshold:
+            mapping.setdefault(best_new, []).append(old)
+            logging.info(f'匹配成功: {old} -> {best_new}, 相似度 {best_ratio:.2f}')
+        else:
+            logging.info(f'旧文件 {old} 无匹配的新文件 (最高相似度 {best_ratio:.2f})')
+    return [(olds, new) for new, olds in mapping.items()]
+
+def auto_select_special():
+    """特殊模式：扫描脚本所在目录的特定新文件，并在兄弟文件夹根目录中扫描特定旧文件"""
+    logging.info('模式3: 进入特殊模式 auto_select_special')
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(script_dir)
+    folder = os.path.basename(script_dir)
+    # 根据脚本目录选择不同的新文件模式
+    if folder == "Bangumi to Trakt":
+        sibling = "Trakt To Bangumi"
+        # 仅匹配 Bangumi 相关文件
+        new_patterns = [
+            re.compile(r".*Bangumi.*\.csv", re.IGNORECASE)
+        ]
+    elif folder == "Trakt To Bangumi":
+        sibling = "Bangumi to Trakt"
+        # 仅匹配 export_*_(history|watchlist).* 文件
+        new_patterns = [
+            re.compile(r"export_(?:movies|shows|episodes)_(?:history|watchlist).*\.csv", re.IGNORECASE)
+        ]
+    else:
+        logging.error(f'未知脚本目录名称: {folder}')
+        print(f"未知脚本目录名称: {folder}")
+        return []
+    sibling_root = os.path.join(parent_dir, sibling)
+    logging.info(f'特殊模式目录信息: script_dir={script_dir}, sibling_root={sibling_root}')
+    if not os.path.isdir(sibling_root):
+        logging.error(f'未找到目录: {sibling_root}')
+        print(f"未找到目录: {sibling_root}")
+        return []
+
+    # 匹配新文件
+    logging.info(f'使用的新文件匹配正则: {[p.pattern for p in new_patterns]}')
+    new_files = [os.path.join(script_dir, f) for f in os.listdir(script_dir)
+                 if any(pat.match(f) for pat in new_patterns) and "_New_" not in f]
+    logging.info(f'匹配到的新文件: {new_files}')
+    if not new_files:
+        logging.warning('未找到符合条件的新文件。')
+        print("未找到符合条件的新文件。")
+        return []
+
+    # 匹配旧文件：根据当前目录选择不同的旧文件
+    old_files = []
+    if folder == "Bangumi to Trakt":
+        # 在 sibling_root 中匹配 bangumi_export.csv
+        logging.info('特殊模式: 匹配旧文件 bangumi_export.csv')
+        for f in os.listdir(sibling_root):
+            if re.match(r"bangumi_export\.csv$", f, re.IGNORECASE):
+                old_files.append(os.path.join(sibling_root, f))
+    else:  # Trakt To Bangumi
+        logging.info('特殊模式: 匹配旧文件 trakt_formatted.csv 和 temp_trakt_formatted.csv')
+        for fname in ["trakt_formatted.csv", "temp_trakt_formatted.csv"]:
+            path = os.path.join(sibling_root, fname)
+            if os.path.isfile(path):
+                old_files.append(path)
+    logging.info(f'匹配到的旧文件: {old_files}')
+    if not old_files:
+        logging.warning('未找到符合条件的旧文件。')
+        print("未找到符合条件的旧文件。")
+        return []
+
+    # 多对一：所有新文件共用同一组旧文件
+    pairs = [(old_files, new) for new in new_files]
+    logging.info(f'特殊模式匹配完成: {pairs}')
+    return pairs
+
+
+def main():
+    print("欢迎使用 Bangumi-to-Trakt 、 Trakt-to-Bangumi 项目专用去重脚本 v8.9")
+    print("https://github.com/wan0ge/Bangumi-to-Trakt")
+    print("https://github.com/wan0ge/Trakt-to-Bangumi")
+    print("-" * 60)
+    print("请选择模式")
+    print("模式1: 自动选择文件：根据dedup文件夹内的旧文件自动选择脚本目录的新文件 去重后自动移动原至dedup")
+    print("模式2: 手动选择文件：手动输入新旧文件路径，支持拖拽，多个旧文件用空格或逗号分隔，不移动原文件")
+    print("模式3: 特殊选择模式：自动选择脚本目录特定新文件，并在兄弟文件夹匹配特定旧文件（使用反向项目对面平台转换后的文件作为旧文件去重）")
+    print("-" * 60)
+
+    while True:
+        mode = input("选择模式 (1=自动, 2=手动, 3=特殊, 其他退出): ").strip()
+        if mode == '1':
+            logging.info('用户选择模式1')
+            pairs = auto_select_files()
+            if not pairs:
+                print("文件选择失败，返回模式选择。")
+                continue
+            print("检测到以下待处理文件对：")
+            for i, (olds, new) in enumerate(pairs, 1):
+                print(f"  {i}. 旧文件:")
+                for old in olds:
+                    print(f"    {old}")
+                print(f"    新文件: {new}")
+            if input("全部确认并去重? (y/n): ").strip().lower() == 'y':
+                process_pairs(pairs, archive=True)
+
+        elif mode == '2':
+            logging.info('用户选择模式2')
+            inp = input("输入旧文件列表 (空格或逗号分隔): ").strip()
+            if not inp:
+                break
+            old_paths = shlex.split(inp.replace(',', ' '))
+            new_path = input("输入新文件路径: ").strip().strip("'\"")
+            if not new_path:
+                break
+            print(f"准备去重:\n  旧文件: {old_paths}\n  新文件: {new_path}")
+            if input("确认? (y/n): ").strip().lower() == 'y':
+                try:
+                    process_batch_manual(old_paths, new_path)
+                except Exception as e:
+                    print(f"失败: {e}")
+
+        elif mode == '3':
+            logging.info('用户选择模式3')
+            pairs = auto_select_special()
+            if not pairs:
+                print("文件选择失败，返回模式选择。")
+                continue
+            print("检测到以下待处理文件对：")
+            for i, (olds, new) in enumerate(pairs, 1):
+                print(f"  {i}. 旧文件:")
+                for old in olds:
+                    print(f"    {old}")
+                print(f"    新文件: {new}")
+            if input("全部确认并去重? (y/n): ").strip().lower() == 'y':
+                # 新旧文件来自不同平台，按身份（IMDB/TMDB/Trakt/Bangumi ID 及成功日志对照表）去重
+                script_dir = os.path.dirname(os.path.abspath(__file__))
+                crosswalk_dirs = [script_dir, os.path.join(script_dir, "dedup")]
+                crosswalk_dirs += [os.path.dirname(os.path.abspath(p)) for p in pairs[0][0]]
+                process_pairs_identity(pairs, crosswalk_dirs)
+        else:
+            break
+
+        if input("继续下一批? (y/n): ").strip().lower() != 'y':
+            break
+
+    print("结束")
+    logging.info('脚本结束')
+
+
+if __name__ == '__main__':
+    setup_logging()
+    logging.info('脚本启动')
+    logging.info('检测到 chardet，可进行高级编码检测' if chardet else '未安装 chardet，仅使用 BOM 检测')
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+--profile 选项共用的性能分析：
+主线程用 cProfile 记录，写入 .prof 文件（可用 python -m pstats 或 snakeviz 查看）；
+同时每隔 interval 秒对所有线程（包括请求线程池）采样调用栈，写入 .folded 文件
+（折叠栈格式，可直接用 flamegraph.pl 或 https://www.speedscope.app 生成火焰图）。
+"""
+import atexit
+import collections
+import cProfile
+import datetime
+import logging
+import os
+import pstats
+import sys
+import threading
+
+class StackSampler(threading.Thread):
+    """后台线程定时采样所有线程的调用栈，按折叠栈计数"""
+
+    def __init__(self, interval=0.01):
+        super().__init__(name="StackSampler", daemon=True)
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+def start_profiling(name, interval=0.01):
+    """
+    开始性能分析，返回 stop 函数；脚本退出时（包括 sys.exit）也会自动调用。
+    结果写入 profile_{name}_{时间}.prof 和 .folded。
+    """
+    prefix = f"profile_{name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval)
+    sampler.start()
+    profiler.enable()
+    stopped = []
+
+    def stop():
+        if stopped:
+            return
+        stopped.append(True)
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(f"{prefix}.prof")
+        sampler.write(f"{prefix}.folded")
+        print(f"\n性能分析结果: {prefix}.prof（主线程 cProfile）, {prefix}.folded（所有线程采样，火焰图格式）")
+        print("主线程累计耗时最多的函数:")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(15)
+        logging.info(f"性能分析结果已写入 {prefix}.prof 和 {prefix}.folded")
+
+    atexit.register(stop)
+    return stop
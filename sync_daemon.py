@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+持续同步：每隔 [SyncDaemon] interval_minutes 分钟从 Trakt 获取新的观看记录（trakt_source.py），
+用 Trakt-to-Bangumi.py 转换后再用 BangumiMigrate-Csv-Pro.py 导入 Bangumi，无需手动运行脚本和确认：
+
+    python sync_daemon.py          持续运行，Ctrl+C 或 SIGTERM 在当前一轮结束后退出
+    python sync_daemon.py --once   只同步一轮
+
+三个脚本在同一进程中加载一次，TMDB/Bangumi 响应缓存和映射数据库在各轮之间共用，没有新记录的一轮只请求一次 Trakt。
+Trakt 同步进度在转换和导入都完成后才保存，中途退出或出错时下一轮会重新获取这些记录（已处理的条目由日志和导入日志跳过）。
+每一轮的结果写入 [SyncDaemon] state_file。
+"""
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(name, filename):
+    """按文件路径加载脚本（文件名带连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def setup_console_logging():
+    """
+    转换脚本加载时已把根日志器写入 Trakt-to-Bangumi.log，这里再加一个控制台输出，显示同步、转换和获取记录的进度；
+    导入脚本使用自己的日志器（BangumiMigrate-Csv-Pro.log 和控制台），不经过根日志器。
+    """
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    logging.getLogger().addHandler(console_handler)
+
+def log(msg):
+    logging.info(f"[同步] {msg}")
+
+class SyncDaemon:
+    def __init__(self, converter, importer, source):
+        self.converter = converter
+        self.importer = importer
+        self.source = source
+        self.stop_event = threading.Event()
+        self.cache_day = None
+
+    def request_stop(self, signum, frame):
+        """第一次信号在当前一轮结束后退出，再次收到信号立即退出"""
+        if self.stop_event.is_set():
+            log("再次收到退出信号，立即退出")
+            raise SystemExit(1)
+        log("收到退出信号，将在当前一轮结束后退出（再次发送立即退出）")
+        self.stop_event.set()
+
+    def run_cycle(self, config):
+        """同步一轮，返回本轮新记录数"""
+        state_path = config.get('TraktSource', 'state_file', fallback='trakt_sync_state.json')
+        state = self.source.load_state(state_path)
+        # 想看列表需要不同的观看状态，持续同步只处理观看历史
+        rows_by_list, new_state = self.source.pull(config, state, ("history",))
+        rows = rows_by_list["history"]
+        if not rows:
+            self.source.save_state(state_path, new_state)
+            return 0
+
+        today = datetime.datetime.now().strftime("%Y%m%d")
+        if today != self.cache_day:
+            # 内存中的API响应不会过期，每天换一个，过期的响应由映射数据库按 cache_ttl_days 处理
+            self.converter.RESPONSE_CACHE = self.converter.ResponseCache()
+            self.cache_day = today
+        self.converter.API_CALLS.clear()
+
+        input_csv = self.source.output_path(config, "history")
+        self.source.write_rows(input_csv, rows)
+        self.converter.CONFIG['Files']['input_csv'] = input_csv
+        auto_import = config.getboolean('SyncDaemon', 'auto_import', fallback=True)
+        if auto_import and not self.importer.check_config(config):
+            raise ValueError("[BangumiMigrate] 配置不完整，无法导入")
+        log(f"获取到 {len(rows)} 条新观看记录，开始{'转换并导入' if auto_import else '转换'}")
+        # 转换过程的输出同时写入日志，控制台由日志处理器统一显示，不再重复 print
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            if auto_import:
+                # 每个匹配成功的条目立即交给导入调度器，与后面条目的转换同时进行
+                self.converter.convert_and_import(today, self.importer, config)
+            else:
+                self.converter.convert_csv(today, interactive=False)
+
+        self.source.save_state(state_path, new_state)
+        return len(rows)
+
+    def run(self, once=False):
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        while not self.stop_event.is_set():
+            config = self.source.load_config()
+            interval = max(1.0, config.getfloat('SyncDaemon', 'interval_minutes', fallback=10)) * 60
+            daemon_state_path = config.get('SyncDaemon', 'state_file', fallback='sync_daemon_state.json')
+            daemon_state = self.source.load_state(daemon_state_path)
+            started = time.monotonic()
+            cycle = {"started_at": datetime.datetime.now().isoformat(timespec='seconds')}
+            try:
+                cycle["new_rows"] = self.run_cycle(config)
+                cycle["result"] = "成功"
+                log(f"本轮完成，新记录 {cycle['new_rows']} 条，耗时 {time.monotonic() - started:.1f} 秒")
+            except Exception as e:
+                cycle["result"] = f"失败: {e}"
+                logging.exception("同步出错")
+                log(f"本轮同步出错: {e}，下一轮重试")
+            cycle["seconds"] = round(time.monotonic() - started, 1)
+            daemon_state["cycles"] = daemon_state.get("cycles", 0) + 1
+            daemon_state["last_cycle"] = cycle
+            if cycle["result"] == "成功":
+                daemon_state["last_success"] = cycle["started_at"]
+                daemon_state["total_rows"] = daemon_state.get("total_rows", 0) + cycle["new_rows"]
+            self.source.save_state(daemon_state_path, daemon_state)
+            if once:
+                break
+            self.stop_event.wait(interval)
+        log("持续同步已退出")
+
+def main():
+    parser = argparse.ArgumentParser(description="Trakt → Bangumi 持续同步")
+    parser.add_argument("--once", action="store_true", help="只同步一轮后退出")
+    args = parser.parse_args()
+
+    # 配置文件、映射数据库和日志都按脚本目录的相对路径读写
+    os.chdir(SCRIPT_DIR)
+    sys.path.insert(0, SCRIPT_DIR)
+    converter = load_script("trakt_to_bangumi", "Trakt-to-Bangumi.py")
+    importer = load_script("bangumi_migrate", "BangumiMigrate-Csv-Pro.py")
+    import trakt_source
+    setup_console_logging()
+    importer.setup_logging()
+    log("持续同步已启动")
+    SyncDaemon(converter, importer, trakt_source).run(once=args.once)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+持续同步进度检查：用本地模拟的 Trakt/TMDB/Bangumi 服务器对同一部剧运行 sync_daemon.py 的多轮同步，
+检查之后几轮继续观看的集数会更新输出文件的"看到"并重新标记 Bangumi 进度（只执行进度步骤，不重复收藏），
+最后在输出文件中修改状态后重新导入，检查已完成的条目会按新状态重新收藏，不一致时以非0退出码结束。
+修改 convert_csv 的跳过逻辑、导入日志或 ImportTask 后运行：
+
+    python sync_progress_check.py
+"""
+import configparser
+import contextlib
+import csv
+import glob
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SHOW = {"title": "Frieren", "ids": {"trakt": 5101, "imdb": "tt0000101", "tmdb": 101}}
+SUBJECT = {"id": 301, "name": "葬送のフリーレン", "name_cn": "葬送的芙莉莲", "air_date": "2023-09-29"}
+EPISODE_COUNT = 12
+
+# 每一轮之前新增的观看记录（集数），以及该轮结束后期望的"看到"
+CYCLES = [
+    ("第1轮：首次同步", [1, 2], 2),
+    ("第2轮：同一天继续观看", [3], 3),
+    ("第3轮：第二天继续观看", [4, 5], 5),
+    ("第4轮：重看已看过的集", [1], 5),
+]
+# 同步结束后把输出文件中的状态改为该值重新导入，期望的收藏类型
+STATUS_CHANGE = ("改为在看后重新导入", "在看", 3)
+
+class StandIn:
+    """模拟服务器的状态：Trakt 观看历史，以及 Bangumi 收到的收藏（条目ID, 收藏类型）和进度请求（标记集数）"""
+    history = []
+    collects = []
+    progress = []
+    lock = threading.Lock()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """按路径前缀 /trakt、/tmdb、/bgm 模拟三个API，只实现持续同步用到的接口"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def parts(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        return [urllib.parse.unquote(p) for p in parsed.path.strip("/").split("/")], urllib.parse.parse_qs(parsed.query)
+
+    def reply(self, body, headers=None):
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+            return
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def no_content(self):
+        self.send_response(204)
+        self.end_headers()
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        parts, query = self.parts()
+        if parts[:3] == ["trakt", "sync", "history"]:
+            since = query.get("start_at", [""])[0]
+            with StandIn.lock:
+                items = [item for item in StandIn.history if item["watched_at"] >= since]
+            self.reply(items, {"X-Pagination-Page-Count": "1"})
+        elif parts[0] == "tmdb":
+            self.reply(self.tmdb(parts[1:], query))
+        elif parts[0] == "bgm" and parts[1:3] == ["search", "subject"]:
+            self.reply({"list": [SUBJECT] if parts[3] in (SUBJECT["name"], SHOW["title"]) else []})
+        elif parts[0] == "bgm" and parts[1:3] == ["v0", "episodes"]:
+            self.reply({"data": [{"id": 9000 + n, "sort": n, "type": 0} for n in range(1, EPISODE_COUNT + 1)], "total": EPISODE_COUNT})
+        else:
+            self.reply(None)
+
+    def do_POST(self):
+        parts, _ = self.parts()
+        data = self.body()
+        with StandIn.lock:
+            StandIn.collects.append((parts[-1], data.get("type")))
+        self.no_content()
+
+    def do_PATCH(self):
+        data = self.body()
+        with StandIn.lock:
+            StandIn.progress.append(len(data.get("episode_id", [])))
+        self.no_content()
+
+    def tmdb(self, parts, query):
+        if parts[0] == "find":
+            found = parts[1] == SHOW["ids"]["imdb"]
+            return {"movie_results": [], "tv_results": [{"id": SHOW["ids"]["tmdb"]}] if found else []}
+        if parts[0] == "tv" and parts[1] == str(SHOW["ids"]["tmdb"]):
+            if len(parts) > 2:
+                return {"results": []}
+            return {"id": SHOW["ids"]["tmdb"], "name": SUBJECT["name"] if query.get("language") == ["ja"] else SHOW["title"],
+                    "original_name": SUBJECT["name"], "first_air_date": SUBJECT["air_date"], "number_of_seasons": 1,
+                    "seasons": [{"season_number": 1, "name": "シーズン1", "air_date": SUBJECT["air_date"], "episode_count": EPISODE_COUNT}],
+                    "production_countries": [{"iso_3166_1": "JP", "name": "Japan"}]}
+        return None
+
+def load_script(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+def load_scripts(base_url):
+    """在临时目录中加载三个脚本（配置、日志和输出文件写在临时目录），API地址指向模拟服务器"""
+    os.chdir(tempfile.mkdtemp(prefix="sync_progress_"))
+    sys.path.insert(0, SCRIPT_DIR)
+    converter = load_script("trakt_to_bangumi", "Trakt-to-Bangumi.py")
+    importer = load_script("bangumi_migrate", "BangumiMigrate-Csv-Pro.py")
+    import sync_daemon
+    import trakt_source
+    logging.disable(logging.CRITICAL)
+    converter.TMDB_API_BASE = f"{base_url}/tmdb"
+    converter.TRAKT_API_BASE = f"{base_url}/trakt"
+    converter.BANGUMI_API_BASE = f"{base_url}/bgm"
+    converter.CONFIG['API']['tmdb_api_key'] = "sync-check"
+    converter.CONFIG['API']['trakt_client_id'] = "sync-check"
+    converter.TMDB_LIMITER.interval = 0
+    importer.BANGUMI_API_BASE = f"{base_url}/bgm/v0"
+    importer.API_URL = f"{importer.BANGUMI_API_BASE}/users/-/collections/"
+    importer.PROGRESS_DELAY = 0
+    trakt_source.TRAKT_API_BASE = f"{base_url}/trakt"
+
+    config = configparser.ConfigParser()
+    config.read_dict({
+        "API": {"trakt_client_id": "sync-check", "trakt_access_token": "sync-check"},
+        "TraktSource": {"state_file": "trakt_sync_state.json", "history_csv": "trakt_history.csv"},
+        "SyncDaemon": {"auto_import": "true"},
+        "BangumiMigrate": {"access_token": "sync-check", "input_csv": converter.CONFIG['Files']['output_csv'],
+                           "wait_time": "0", "max_workers": "2", "auto_complete": "false", "metrics_interval": "0"},
+    })
+    return sync_daemon.SyncDaemon(converter, importer, trakt_source), config
+
+def exported_progress(converter):
+    with open(converter.CONFIG['Files']['output_csv'], newline='', encoding='utf-8') as f:
+        return {row["ID"]: row["看到"] for row in csv.DictReader(f)}
+
+def set_exported_status(converter, status):
+    path = converter.CONFIG['Files']['output_csv']
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = [dict(row, 状态=status) for row in reader]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    daemon, config = load_scripts(f"http://127.0.0.1:{server.server_address[1]}")
+
+    failed = 0
+    print(f"{'同步轮次':<18}{'看到':>8}{'标记集数':>10}{'收藏请求':>10}  结果")
+    for number, (cycle, episodes, expected) in enumerate(CYCLES, 1):
+        with StandIn.lock:
+            for episode in episodes:
+                StandIn.history.append({
+                    "id": len(StandIn.history) + 1, "type": "episode", "show": SHOW,
+                    "watched_at": f"2025-01-{len(StandIn.history) + 1:02d}T00:00:00.000Z",
+                    "episode": {"season": 1, "number": episode},
+                })
+            StandIn.progress.clear()
+        if number == 3:
+            # 模拟第二天：当天的成功日志不存在，条目重新匹配后命中输出文件中已有的Bangumi ID
+            for path in glob.glob("success_log_*.csv"):
+                os.remove(path)
+        daemon.run_cycle(config)
+
+        progress = exported_progress(daemon.converter)
+        watched = progress.get(str(SUBJECT["id"]), "")
+        marked = StandIn.progress[-1] if StandIn.progress else 0
+        problems = []
+        if len(progress) != 1:
+            problems.append(f"输出文件有 {len(progress)} 行，应为 1 行")
+        if watched != str(expected):
+            problems.append(f"看到 {watched or '空'}，应为 {expected}")
+        if (marked or expected) != expected:
+            problems.append(f"标记了 {marked} 集，应为 {expected} 集")
+        if number > 1 and expected > CYCLES[number - 2][2] and not StandIn.progress:
+            problems.append("没有重新标记进度")
+        if len(StandIn.progress) > 1:
+            problems.append(f"进度请求 {len(StandIn.progress)} 次，同一条目只应标记 1 次")
+        if len(StandIn.collects) != 1:
+            problems.append(f"收藏请求 {len(StandIn.collects)} 次，应只在首次同步时收藏 1 次")
+        failed += bool(problems)
+        print(f"{cycle:<18}{watched:>8}{marked:>10}{len(StandIn.collects):>10}  {'; '.join(problems) or 'OK'}")
+
+    cycle, status, expected_type = STATUS_CHANGE
+    with StandIn.lock:
+        StandIn.progress.clear()
+    set_exported_status(daemon.converter, status)
+    daemon.importer.import_csv(config, os.path.abspath(daemon.converter.CONFIG['Files']['output_csv']))
+    watched = exported_progress(daemon.converter).get(str(SUBJECT["id"]), "")
+    marked = StandIn.progress[-1] if StandIn.progress else 0
+    problems = []
+    if len(StandIn.collects) != 2:
+        problems.append(f"收藏请求共 {len(StandIn.collects)} 次，状态变化后应重新收藏 1 次")
+    elif StandIn.collects[-1][1] != expected_type:
+        problems.append(f"重新收藏的类型为 {StandIn.collects[-1][1]}，应为 {expected_type}")
+    if len(StandIn.progress) != 1 or marked != CYCLES[-1][2]:
+        problems.append(f"进度请求 {len(StandIn.progress)} 次、标记 {marked} 集，应按新状态标记 1 次 {CYCLES[-1][2]} 集")
+    failed += bool(problems)
+    print(f"{cycle:<18}{watched:>8}{marked:>10}{len(StandIn.collects):>10}  {'; '.join(problems) or 'OK'}")
+
+    server.shutdown()
+    if failed:
+        print(f"\n{failed} 轮同步的进度与预期不一致")
+        sys.exit(1)
+    print("\n每一轮同步的进度都符合预期")
+
+if __name__ == "__main__":
+    main()
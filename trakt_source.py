@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+直接从 Trakt API 获取观看历史(/sync/history)和想看列表(/sync/watchlist)，写成 Trakt-to-Bangumi.py 可以读取的CSV，
+不再需要先用其他项目导出全部记录：
+
+    python trakt_source.py            只下载上次同步之后的新记录
+    python trakt_source.py --full     重新下载全部记录
+
+每个列表最新一条记录的时间保存在 [TraktSource] state_file 中，下次同步时观看历史用 start_at 只请求更新的记录，
+想看列表（API不支持 start_at）按加入时间过滤。分页先请求第1页得到总页数，其余页并发请求。
+"""
+import argparse
+import configparser
+import csv
+import datetime
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TRAKT_API_BASE = "https://api.trakt.tv"
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+LISTS = ("history", "watchlist")
+PAGE_LIMIT = 100
+# 与 README 中"本项目支持的csv文件格式"一致，逐集记录带 season/episode，type 供去重区分电影和剧集
+CSV_COLUMNS = ["imdb", "tmdb", "trakt", "watched_at", "title", "season", "episode", "type"]
+
+# 日志配置：只在作为脚本运行时写入 trakt_source.log，被其他脚本导入时沿用调用方的日志设置
+def setup_logging():
+    logging.basicConfig(
+        filename='trakt_source.log',
+        filemode='a',
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO
+    )
+
+def load_config():
+    config = configparser.ConfigParser()
+    if not os.path.exists(CONFIG_PATH):
+        logging.error(f"配置文件不存在: {CONFIG_PATH}")
+        raise FileNotFoundError(f"配置文件不存在: {CONFIG_PATH}")
+    config.read(CONFIG_PATH, encoding='utf-8')
+    return config
+
+def trakt_headers(config):
+    """/sync 接口需要用户授权，client id 和 access token 缺一不可"""
+    client_id = config.get('API', 'trakt_client_id', fallback='').strip()
+    access_token = config.get('API', 'trakt_access_token', fallback='').strip()
+    if not client_id or client_id.startswith('请输入') or not access_token or access_token.startswith('请输入'):
+        raise ValueError("请在 config.ini 的 [API] 中填写 trakt_client_id 和 trakt_access_token")
+    return {
+        "Content-Type": "application/json",
+        "trakt-api-version": "2",
+        "trakt-api-key": client_id,
+        "Authorization": f"Bearer {access_token}",
+    }
+
+def fetch_page(url, params, headers, max_retries=3):
+    """请求一页，网络错误、429限流和5xx错误时重试，返回 (条目列表, 总页数)"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = requests.get(url, params=params, headers=headers, timeout=30)
+        except requests.exceptions.RequestException as e:
+            if attempt == max_retries:
+                raise
+            wait = 2 ** attempt
+            logging.warning(f"请求 {url} 第{params.get('page')}页出错: {e}，{wait} 秒后重试")
+            time.sleep(wait)
+            continue
+        if response.status_code == 429 or response.status_code >= 500:
+            if attempt == max_retries:
+                response.raise_for_status()
+            wait = float(response.headers.get("Retry-After") or 2 ** attempt)
+            logging.warning(f"请求 {url} 第{params.get('page')}页返回 {response.status_code}，{wait} 秒后重试")
+            time.sleep(wait)
+            continue
+        response.raise_for_status()
+        return response.json(), int(response.headers.get("X-Pagination-Page-Count") or 1)
+
+def fetch_list(list_name, headers, since=None, workers=4):
+    """下载一个列表的全部页（观看历史只下载 since 之后的），按 Trakt 记录ID去掉翻页时可能出现的重复条目"""
+    url = f"{TRAKT_API_BASE}/sync/{list_name}"
+    params = {"extended": "full", "limit": PAGE_LIMIT}
+    if list_name == "history":
+        # 固定结束时间，下载过程中新增的观看记录不会让后面的页错位，留到下次同步
+        params["end_at"] = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        if since:
+            params["start_at"] = since
+    items, page_count = fetch_page(url, dict(params, page=1), headers)
+    if page_count > 1:
+        logging.info(f"{list_name}: 共 {page_count} 页，并发下载其余页")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for page_items in pool.map(lambda page: fetch_page(url, dict(params, page=page), headers)[0],
+                                       range(2, page_count + 1)):
+                items.extend(page_items)
+    unique = {}
+    for item in items:
+        unique.setdefault(item.get("id") or id(item), item)
+    return list(unique.values())
+
+def item_time(item):
+    return item.get("watched_at") or item.get("listed_at") or ""
+
+def item_row(item):
+    """把一条 Trakt 记录转为输入CSV的一行，剧集的ID使用整部剧的ID；不支持的类型（如 person）返回 None"""
+    kind = item.get("type")
+    season = episode = ""
+    if kind == "episode":
+        media = item.get("show") or {}
+        season = (item.get("episode") or {}).get("season", "")
+        episode = (item.get("episode") or {}).get("number", "")
+    elif kind == "season":
+        media = item.get("show") or {}
+        season = (item.get("season") or {}).get("number", "")
+    elif kind in ("movie", "show"):
+        media = item.get(kind) or {}
+    else:
+        return None
+    ids = media.get("ids") or {}
+    return {
+        "imdb": ids.get("imdb") or "",
+        "tmdb": ids.get("tmdb") or "",
+        "trakt": ids.get("trakt") or "",
+        "watched_at": item_time(item),
+        "title": media.get("title") or "",
+        "season": "" if season is None else season,
+        "episode": "" if episode is None else episode,
+        "type": "movie" if kind == "movie" else "show",
+    }
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"读取同步进度文件 {path} 失败，将重新下载全部记录: {e}")
+        return {}
+
+def save_state(path, state):
+    """先写临时文件再替换，中途退出不会留下损坏的进度文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def pull(config, state, lists=LISTS, full=False):
+    """
+    下载各列表中比 state 记录的时间更新的条目，返回 ({列表名: 按时间排序的行}, 新的state)。
+    state 不会被修改，调用方在新记录处理完成后再保存新的state。
+    """
+    headers = trakt_headers(config)
+    workers = config.getint('TraktSource', 'page_workers', fallback=4)
+    rows_by_list = {}
+    new_state = json.loads(json.dumps(state))
+    for list_name in lists:
+        since = None if full else (state.get(list_name) or {}).get("start_at")
+        items = fetch_list(list_name, headers, since, workers)
+        if since:
+            # start_at 包含边界，想看列表不支持 start_at，都按时间过滤一次
+            items = [item for item in items if item_time(item) > since]
+        rows = sorted((row for row in map(item_row, items) if row), key=lambda row: row["watched_at"])
+        rows_by_list[list_name] = rows
+        latest = max([since or ""] + [row["watched_at"] for row in rows])
+        new_state[list_name] = {
+            "start_at": latest or None,
+            "synced_at": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+        logging.info(f"{list_name}: 下载 {len(items)} 条记录，新记录 {len(rows)} 条，同步进度 {latest or '无'}")
+    return rows_by_list, new_state
+
+def write_rows(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def output_path(config, list_name):
+    return config.get('TraktSource', f'{list_name}_csv', fallback=f'trakt_{list_name}.csv')
+
+def main():
+    parser = argparse.ArgumentParser(description="从 Trakt API 获取观看历史和想看列表")
+    parser.add_argument("--full", action="store_true", help="忽略同步进度，重新下载全部记录")
+    parser.add_argument("--lists", nargs="+", choices=LISTS, help="要获取的列表（默认为配置文件中的 lists）")
+    args = parser.parse_args()
+
+    config = load_config()
+    lists = args.lists or [name.strip() for name in config.get('TraktSource', 'lists', fallback='history').split(',') if name.strip()]
+    unknown = [name for name in lists if name not in LISTS]
+    if unknown:
+        parser.error(f"不支持的列表: {', '.join(unknown)}")
+    state_path = config.get('TraktSource', 'state_file', fallback='trakt_sync_state.json')
+    state = load_state(state_path)
+
+    try:
+        rows_by_list, new_state = pull(config, state, lists, full=args.full)
+    except (ValueError, requests.exceptions.RequestException) as e:
+        logging.error(f"获取Trakt记录失败: {e}")
+        print(f"获取Trakt记录失败: {e}")
+        return 1
+    for list_name, rows in rows_by_list.items():
+        path = output_path(config, list_name)
+        write_rows(path, rows)
+        print(f"{list_name}: {len(rows)} 条新记录已写入 {path}")
+    save_state(state_path, new_state)
+    print(f"同步进度已保存到 {state_path}")
+    return 0
+
+if __name__ == '__main__':
+    setup_logging()
+    logging.info('脚本启动')
+    raise SystemExit(main())